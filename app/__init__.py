@@ -5,8 +5,10 @@ import telebot
 from dotenv import load_dotenv
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.engine import Engine
 
-from app.credentials import TOKEN
+from app.credentials import TOKEN, TELEGRAM_API_URL
+from app.logs import setup_logging
 
 load_dotenv(dotenv_path='.env')
 
@@ -20,7 +22,24 @@ server.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DATABASE_URL")
 
 db = SQLAlchemy(server)
 
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL
 bot = telebot.TeleBot(TOKEN)
 
-logging.basicConfig(filename=os.path.join(BASE_DIR, 'log.log'), level=logging.DEBUG)
+log_handler = setup_logging(
+    path=os.path.join(BASE_DIR, 'log.log'),
+    level=os.getenv('LOG_LEVEL', 'DEBUG'),
+    max_bytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    backup_count=int(os.getenv('LOG_BACKUP_COUNT', 3)),
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+    rate=int(os.getenv('LOG_RATE_LIMIT', 10)),  # records per message key
+    period=float(os.getenv('LOG_RATE_PERIOD', 60)),  # seconds
+)
 logger = logging.getLogger()
+
+from app import metrics  # noqa: E402 metrics use the logger
+
+metrics.instrument_db(Engine)
+metrics.instrument_telegram(telebot.apihelper)
+metrics.Gauge('weatherbot_log_dropped_total', 'Log records dropped because the queue was full',
+              func=lambda: log_handler.dropped)
@@ -0,0 +1,74 @@
+import hashlib
+import hmac
+import json
+import os
+import queue
+import threading
+import time
+
+from app import logger
+from app.credentials import CAPTURE_UPDATES_PATH, CAPTURE_SALT, TOKEN
+
+person_keys = ('chat', 'from', 'user', 'sender_chat', 'forward_from', 'forward_from_chat')
+kept_person_fields = ('is_bot', 'type', 'language_code')
+dropped_keys = ('contact', 'location', 'venue', 'photo', 'document', 'voice', 'video', 'audio', 'caption')
+
+
+class UpdateRecorder:
+    """append anonymized raw updates with their arrival time to a JSONL file from a background thread.
+    Chat and user ids are replaced with stable pseudonyms, names and personal attachments are dropped
+    """
+
+    def __init__(self, path, salt, queue_size=10000):
+        self.path = path
+        self.salt = salt.encode('utf-8')
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self._thread = threading.Thread(target=self._write, name='update-recorder', daemon=True)
+        self._thread.start()
+
+    def record(self, raw_update):
+        try:
+            self._queue.put_nowait((time.time(), raw_update))
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        while True:
+            ts, raw_update = self._queue.get()
+            try:
+                update = self.anonymize(json.loads(raw_update))
+            except ValueError as e:
+                logger.warning(f'Update was not captured\n{repr(e)}')
+                continue
+            line = json.dumps({'ts': ts, 'update': update}, ensure_ascii=False) + '\n'
+            os.write(self._fd, line.encode('utf-8'))  # one write per line keeps lines whole across workers
+
+    def pseudonym(self, value):
+        digest = hmac.new(self.salt, str(value).encode('utf-8'), hashlib.sha256).digest()
+        return int.from_bytes(digest[:4], 'big') % (2 ** 31 - 1) + 1  # fits the integer chat_id column
+
+    def anonymize(self, value):
+        if isinstance(value, list):
+            return [self.anonymize(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        result = {}
+        for key, item in value.items():
+            if key in dropped_keys:
+                continue
+            if key in person_keys and isinstance(item, dict):
+                person = {field: item[field] for field in kept_person_fields if field in item}
+                if 'id' in item:
+                    person['id'] = self.pseudonym(item['id'])
+                if 'first_name' in item:  # required by telebot to parse the update back
+                    person['first_name'] = 'user'
+                result[key] = person
+            else:
+                result[key] = self.anonymize(item)
+        return result
+
+
+update_recorder = UpdateRecorder(CAPTURE_UPDATES_PATH, CAPTURE_SALT or TOKEN) if CAPTURE_UPDATES_PATH else None
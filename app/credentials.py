@@ -11,3 +11,17 @@ NGROK_DEPLOY_DOMAIN = os.getenv("NGROK_DEPLOY_DOMAIN")
 DEBUG = os.getenv("DEBUG")
 SERVER_IP = os.getenv("SERVER_IP")
 PORT = os.getenv("PORT")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# opt-in capture of anonymized webhook updates for scripts/replay.py
+CAPTURE_UPDATES_PATH = os.getenv("CAPTURE_UPDATES_PATH")
+CAPTURE_SALT = os.getenv("CAPTURE_SALT")  # key of the id pseudonyms, the bot token is used if not set
+
+# upstreams, overridden to point the bot at local stand-ins (scripts/stubs.py)
+WEATHER_URL = os.getenv("WEATHER_URL", "https://yandex.{}")  # {} is 'ru' or 'com'
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # e.g. http://127.0.0.1:8081/bot{0}/{1}
+
+# sharding: users are split into SHARD_COUNT shards by chat id, every instance serves the shards assigned to its
+# INSTANCE_NAME in the shard table (scripts/shards.py), 0 serves every user from one instance
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+INSTANCE_NAME = os.getenv("INSTANCE_NAME", "")
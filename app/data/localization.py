@@ -30,6 +30,7 @@ phenomenon_button_names = {
 
     'manually': {'en': 'Manually', 'ru': 'Вручную'},
     'all phenomena': {'en': 'All phenomena', 'ru': 'Все события'},
+    'forecast changes': {'en': 'Forecast changes', 'ru': 'Изменения прогноза'},
     'set time': {'en': 'Set time', 'ru': 'Изменить время'},
     'back': {'en': '↩ Back', 'ru': '↩ Назад'},
     'remove all': {'en': 'Remove all', 'ru': 'Удалить все'},
@@ -76,6 +77,10 @@ hints = {
     'phenomenon set del': {'en': 'The phenomenon', 'ru': 'Cобытие '},
     'phenomenon set': {'en': 'was set', 'ru': 'добавлено'},
     'ph manually set': {'en': 'was set at', 'ru': 'было установлено на'},
+    'weather in': {'en': 'Weather in', 'ru': 'Погода в городе'},
+    'forecast changed': {'en': "Tomorrow's forecast has changed", 'ru': 'Прогноз на завтра изменился'},
+    'as of': {'en': 'The weather website is unavailable, the forecast is as of',
+              'ru': 'Сайт погоды недоступен, прогноз по состоянию на'},
     'phenomenon delete': {'en': 'has been deleted', 'ru': 'удалено'},
     'phenomenon tomorrow': {'en': 'Expected tomorrow:', 'ru': 'Завтра ожидается:'},
     'phenomenon': {'en': 'Phenomenon', 'ru': 'Событие'},
@@ -132,15 +137,43 @@ info = {
     ],
 }
 
+# forecast values, the weather website is read in English and they are translated when a reply is rendered
+day_part_names = {
+    'morning': {'en': 'morning', 'ru': 'утром'},
+    'day': {'en': 'day', 'ru': 'днём'},
+    'evening': {'en': 'evening', 'ru': 'вечером'},
+    'night': {'en': 'night', 'ru': 'ночью'},
+}
+
+month_names = {
+    'en': ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September', 'October',
+           'November', 'December'],
+    'ru': ['января', 'февраля', 'марта', 'апреля', 'мая', 'июня', 'июля', 'августа', 'сентября', 'октября',
+           'ноября', 'декабря'],
+}
+
+wind_directions = {
+    'N': {'en': 'N', 'ru': 'С'},
+    'NE': {'en': 'NE', 'ru': 'СВ'},
+    'E': {'en': 'E', 'ru': 'В'},
+    'SE': {'en': 'SE', 'ru': 'ЮВ'},
+    'S': {'en': 'S', 'ru': 'Ю'},
+    'SW': {'en': 'SW', 'ru': 'ЮЗ'},
+    'W': {'en': 'W', 'ru': 'З'},
+    'NW': {'en': 'NW', 'ru': 'СЗ'},
+}
+
+duration_units = {'en': ('h', 'min'), 'ru': ('ч', 'мин')}
+
 # check if a phenomenon has an alias for returning the condition
 phenomenon_aliases = {
-    'hailstorm': {'en': ['hail', 'hailstorm', 'thunderstorm with hail'],
+    'hailstorm': {'en': ['hail', 'thunderstorm with hail'],
                   'ru': ['град', 'гроза с градом']},
     'thunderstorm': {'en': ['thunderstorm', 'thunderstorm with hail', 'thunderstorm with rain'],
                      'ru': ['гроза', 'гроза с градом', 'дождь с грозой']},
     'rain': {'en': ['rain', 'moderate rain', 'wet snow'],
              'ru': ['дождь', 'умеренно сильный дождь', 'дождь со снегом']},
     'heavy rain': {
-        'en': ['thunderstorm with rain', 'heavy rain', 'continuous-heavy-rain', 'showers', 'thunderstorm with hail'],
+        'en': ['thunderstorm with rain', 'heavy rain', 'continuous heavy rain', 'showers', 'thunderstorm with hail'],
         'ru': ['дождь с грозой', 'ливень', 'длительный сильный дождь', 'ливень', 'гроза с градом', 'сильный дождь']},
 }
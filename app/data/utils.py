@@ -1,7 +1,16 @@
 from app.data import CITIES_DATA
 
+city_names_ru = {en_name: ru_name for ru_name, en_name in CITIES_DATA.items()}
+
 
 def get_city_data(city):
     """return the cities_db dictionary"""
     content = CITIES_DATA[city]
     return content
+
+
+def get_city_name(city, lang):
+    """return the name of a city in the language, the english name if there is no translation"""
+    if lang == 'ru':
+        return city_names_ru.get(city, city)
+    return city
@@ -0,0 +1,74 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """let through at most `rate` records per `period` seconds for every message key.
+    The key is the `log_key` extra of the record or its call site, so f-string messages with different values
+    are still limited together. The first record after a suppressed run tells how many were dropped
+    """
+
+    def __init__(self, rate, period):
+        super().__init__()
+        self.rate = rate
+        self.period = period
+        self._windows = {}  # key -> [window start, records in the window, suppressed records]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = getattr(record, 'log_key', None) or (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.rate:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f'{record.msg} ({suppressed} similar messages suppressed)'
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """queue records for the background listener and drop them when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(path, level, max_bytes, backup_count, queue_size, rate, period):
+    """log through a bounded queue to a size-rotated file written by a background thread"""
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(RateLimitFilter(rate, period))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return queue_handler
@@ -0,0 +1,152 @@
+import os
+import time
+
+from app.data.localization import info, phenomenon_button_names
+from app.mastermind.caching import LruCache, get_cache
+from app.mastermind.conditions import get_condition_name, phenomenon_conditions
+from app.mastermind.forecast import new_version
+from app.models import Phenomenon
+
+ALERT_RULES_CACHE_SIZE = int(os.getenv('ALERT_RULES_CACHE_SIZE', 10000))
+ALERT_RULES_TTL = int(os.getenv('ALERT_RULES_TTL', 300))  # seconds compiled rules are used without a shared version
+
+CHANGE_ALERT = 'forecast changes'  # phenomenon row of the users alerted when tomorrow's forecast changes
+
+# (user id, lang) -> (PhenomenonRules, version of the phenomena, time it was compiled)
+compiled_rules = LruCache(ALERT_RULES_CACHE_SIZE)
+# user id -> version of the phenomena, changed by `invalidate_rules` in any process sharing the cache
+rule_versions = get_cache('rule version', ALERT_RULES_CACHE_SIZE)
+
+
+class ForecastSummary:
+    """the values of tomorrow's forecast the phenomenon rules look at"""
+    __slots__ = ('temp_min', 'temp_max', 'conditions', 'wind', 'humidity')
+
+    def __init__(self, day_forecast):
+        day_parts = day_forecast.parts[:4]
+        self.temp_min = min(daypart.temp_min for daypart in day_parts)
+        self.temp_max = max(daypart.temp_max for daypart in day_parts)
+        self.conditions = [(daypart.condition_code, daypart.condition) for daypart in day_parts]
+        self.wind = max([daypart.wind_speed or 0 for daypart in day_parts])
+        self.humidity = max(daypart.humidity for daypart in day_parts)
+
+
+class PhenomenonRules:
+    """phenomena of a user compiled into checks of a ForecastSummary.
+    Every check gets the text found so far and returns the line it adds, the result of the last forecast
+    is kept, so an unchanged forecast is not checked again
+    """
+    __slots__ = ('checks', '_last')
+
+    def __init__(self, checks):
+        self.checks = tuple(checks)
+        self._last = (None, '')  # ((city, day forecast), text)
+
+    def evaluate(self, city_name, day_forecast):
+        """return the lines of the phenomena expected in the forecast, empty string if there are none"""
+        key = (city_name, day_forecast)
+        last_key, last_text = self._last
+        if key == last_key:
+            return last_text
+
+        text = ''
+        if self.checks:
+            summary = ForecastSummary(day_forecast)
+            for check in self.checks:
+                text += check(summary, text)
+        self._last = (key, text)
+        return text
+
+
+def compile_condition_check(name, codes, lang):
+    def check(summary, text):
+        if name in text:
+            return ''
+        for code, condition in summary.conditions:
+            if code in codes:
+                return f'\n{get_condition_name(condition, code, lang).capitalize()}'
+        return ''
+    return check
+
+
+def compile_threshold_check(label, is_expected, get_value):
+    def check(summary, text):
+        return f'\n{label} {get_value(summary)}' if is_expected(summary) else ''
+    return check
+
+
+def compile_temperature_check(label, is_expected):
+    def check(summary, text):
+        if not is_expected(summary) or '°C' in text:
+            return ''
+        if summary.temp_min != summary.temp_max:
+            return f'\n{label}: {summary.temp_min}°C...{summary.temp_max}°C'
+        return f'\n{label}: {summary.temp_min}°C'
+    return check
+
+
+def compile_phenomenon(phenomenon, lang):
+    """return the check of a chosen phenomenon or None if it is not checked"""
+    name = phenomenon_button_names[phenomenon][lang].lower() if phenomenon in phenomenon_button_names else ''
+    wind_unit = info[lang][10]
+    if phenomenon in phenomenon_conditions:
+        return compile_condition_check(name, phenomenon_conditions[phenomenon], lang)
+    if phenomenon == 'strong wind':
+        return compile_threshold_check(name.capitalize(), lambda s: 29 >= s.wind >= 12,
+                                       lambda s: f'{s.wind} {wind_unit}')
+    if phenomenon == 'hurricane':
+        return compile_threshold_check(name.capitalize(), lambda s: s.wind >= 30,
+                                       lambda s: f'{s.wind} {wind_unit}')
+    if phenomenon == 'intense heat':
+        return compile_threshold_check(name.capitalize(), lambda s: s.temp_max >= 30,
+                                       lambda s: f'+{s.temp_max}°C')
+    return None
+
+
+def compile_manual_phenomenon(phenomenon, value, lang):
+    """return the check of a phenomenon set manually or None if it is not checked"""
+    if value is None:
+        return None
+    value = int(value)
+    name = phenomenon_button_names[phenomenon][lang].lower() if phenomenon in phenomenon_button_names else ''
+    wind_unit = info[lang][10]
+    if phenomenon == 'temperature more':
+        return compile_temperature_check(info[lang][11].capitalize(), lambda s: value <= s.temp_max)
+    if phenomenon == 'temperature less':
+        return compile_temperature_check(info[lang][11].capitalize(), lambda s: value >= s.temp_min)
+    if phenomenon == 'wind speed':
+        return compile_threshold_check(f'{name.capitalize()}:', lambda s: value <= s.wind,
+                                       lambda s: f'{s.wind} {wind_unit}')
+    if phenomenon == 'humidity':
+        return compile_threshold_check(f'{name.capitalize()}:', lambda s: value <= s.humidity,
+                                       lambda s: f'{s.humidity}%')
+    return None
+
+
+def compile_rules(phenomena, lang):
+    """compile Phenomenon rows of a user, the chosen phenomena are checked before the manual ones"""
+    checks = [compile_phenomenon(ph.phenomenon, lang) for ph in phenomena if not ph.is_manually]
+    checks += [compile_manual_phenomenon(ph.phenomenon, ph.value, lang) for ph in phenomena if ph.is_manually]
+    return PhenomenonRules([check for check in checks if check is not None])
+
+
+def get_rules(user_id, lang):
+    """return the compiled rules of the user. They are compiled again once `invalidate_rules` has changed the
+    version of the user's phenomena, or after ALERT_RULES_TTL seconds: with the in-process cache (memory://)
+    another worker's invalidation is not seen
+    """
+    key = (user_id, lang)
+    version = rule_versions.get(user_id)
+    entry = compiled_rules.get(key)
+    if entry is None or entry[1] != version or time.monotonic() - entry[2] > ALERT_RULES_TTL:
+        phenomena = Phenomenon.query.filter_by(user_id=user_id).order_by(Phenomenon.id).all()
+        entry = (compile_rules(phenomena, lang), version, time.monotonic())
+        compiled_rules.set(key, entry)
+    return entry[0]
+
+
+def invalidate_rules(user_id):
+    """forget the compiled rules of the user, call it after changing the phenomena of the user"""
+    rule_versions.set(user_id, new_version())
+    for lang in info:
+        compiled_rules.pop((user_id, lang))
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+from app import logger
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+state_names = {CLOSED: 'closed', HALF_OPEN: 'half-open', OPEN: 'open'}
+
+
+class CircuitOpen(Exception):
+    """raised instead of calling the upstream while the circuit is open"""
+
+
+class CircuitBreaker:
+    """stops calling an upstream that fails or is slow.
+    The last `window` calls are kept, failed and slow (longer than `slow_call_seconds`) calls count as failures.
+    Once `min_calls` have been made and `failure_rate` of them failed the circuit opens and every call raises
+    CircuitOpen for `open_seconds`. After that `probes` calls are let through (half-open): the circuit closes if all
+    of them succeed and opens again on the first failure.
+    Only exceptions for which `is_failure(exception)` is true are counted, the others are passed through
+    """
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, slow_call_seconds=5.0, open_seconds=30.0,
+                 probes=3, is_failure=lambda exception: True):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.rejected = 0
+        self._outcomes = deque(maxlen=window)  # True for a failed or slow call
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_closed(self):
+        return self.state == CLOSED
+
+    def call(self, function, *args, **kwargs):
+        is_probe = self._before_call()
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self._after_call(is_probe, not self.is_failure(e))
+            raise
+        self._after_call(is_probe, time.perf_counter() - start < self.slow_call_seconds)
+        return result
+
+    def _before_call(self):
+        """return True if the call is a half-open probe, raise CircuitOpen if the call is not allowed"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.open_seconds:
+                    self.rejected += 1
+                    raise CircuitOpen(f'{self.name} circuit is open')
+                self._set_state(HALF_OPEN)
+                self._probes_started = self._probes_succeeded = 0
+            if self.state == HALF_OPEN:
+                if self._probes_started >= self.probes:
+                    self.rejected += 1
+                    raise CircuitOpen(f'{self.name} circuit is half-open')
+                self._probes_started += 1
+                return True
+            return False
+
+    def _after_call(self, is_probe, is_ok):
+        with self._lock:
+            if is_probe:
+                if self.state != HALF_OPEN:
+                    return
+                if not is_ok:
+                    self._open()
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.probes:
+                        self._outcomes.clear()
+                        self._set_state(CLOSED)
+                return
+
+            if self.state != CLOSED:
+                return
+            self._outcomes.append(not is_ok)
+            failures = sum(self._outcomes)
+            if len(self._outcomes) >= self.min_calls and failures >= self.failure_rate * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning(f'{self.name} circuit is {state_names[state]}')
+        self.state = state
@@ -0,0 +1,272 @@
+import collections
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from telebot.apihelper import ApiException
+
+from app import bot, db, logger, server
+from app.credentials import INSTANCE_NAME
+from app.metrics import Counter, Gauge
+from app.models import BlockedChat, Broadcast, User
+
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', 25))  # messages per second, Telegram allows about 30 per bot
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', 8))  # messages sent concurrently
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 200))  # users read and checkpointed at once
+BROADCAST_LEASE = int(os.getenv('BROADCAST_LEASE', 120))  # seconds without a checkpoint before a broadcast is resumed
+BROADCAST_RETRIES = 3  # attempts of a message answered 429 Too Many Requests
+MAX_MESSAGE_LENGTH = 4096
+
+# the process sending a broadcast, a restarted one is another sender
+SENDER = f'{INSTANCE_NAME or socket.gethostname()}:{os.getpid()}'
+
+broadcast_messages = Counter('weatherbot_broadcast_messages_total', 'Broadcast messages by result', ['result'])
+
+
+class RateLimiter:
+    """spaces the calls of `wait` 1 / `rate` seconds apart across the threads, `pause` holds every caller back"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, seconds):
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+outbound_limiter = RateLimiter(BROADCAST_RATE)
+
+
+def get_retry_after(e):
+    """return the seconds Telegram asks to wait in a 429 answer, None for other errors"""
+    if e.result is None or e.result.status_code != 429:
+        return None
+    try:
+        return float(e.result.json()['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        return 1.0
+
+
+def send(chat_id, text, parse_mode=None):
+    """send a message through the rate limiter, return 'sent', 'blocked' (by the user) or 'failed'"""
+    for _ in range(BROADCAST_RETRIES):
+        outbound_limiter.wait()
+        try:
+            bot.send_message(chat_id, text, parse_mode=parse_mode)
+            return 'sent'
+        except ApiException as e:
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                logger.warning(f'Broadcast is throttled by Telegram for {retry_after} s')
+                outbound_limiter.pause(retry_after)
+                continue
+            if e.result is not None and e.result.status_code == 403:  # blocked or deactivated
+                return 'blocked'
+            logger.warning(f'Broadcast message to {chat_id} has failed\n{repr(e)}')
+            return 'failed'
+        except requests.RequestException as e:
+            logger.warning(f'Broadcast message to {chat_id} has failed\n{repr(e)}')
+            return 'failed'
+    return 'failed'
+
+
+class BroadcastJob:
+    """sends a broadcast in this process, chunk by chunk of users in id order (keyset pagination).
+    The progress is saved after every chunk, the job stops when its checkpoint finds the broadcast paused,
+    cancelled or taken over. A message may be sent twice to the users of the chunk a stopped process was sending
+    """
+
+    def __init__(self, broadcast_id):
+        self.broadcast_id = broadcast_id
+        self.done = 0  # users done by this job
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name=f'broadcast-{broadcast_id}', daemon=True)
+
+    @property
+    def rate(self):
+        """users done per second by this job"""
+        return self.done / max(time.monotonic() - self.started_at, 1e-9)
+
+    def _run(self):
+        try:
+            with server.app_context():
+                self._send_all()
+        except Exception as e:
+            logger.error(f'Broadcast {self.broadcast_id} has stopped, it will be resumed\n{repr(e)}')
+        finally:
+            with running_lock:
+                running.pop(self.broadcast_id, None)
+
+    def _send_all(self):
+        broadcast = Broadcast.query.get(self.broadcast_id)
+        text, parse_mode, last_user_id = broadcast.text, broadcast.parse_mode, broadcast.last_user_id
+        logger.info(f'Broadcast {self.broadcast_id} is sent from user {last_user_id} on')
+        with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS, thread_name_prefix='broadcast') as executor:
+            while True:
+                chats = db.session.query(User.id, User.chat_id) \
+                    .outerjoin(BlockedChat, BlockedChat.chat_id == User.chat_id) \
+                    .filter(User.id > last_user_id, BlockedChat.chat_id.is_(None)) \
+                    .order_by(User.id).limit(BROADCAST_CHUNK_SIZE).all()
+                db.session.commit()  # no transaction is kept open while sending
+                if not chats:
+                    self._finish()
+                    return
+                results = list(executor.map(lambda chat: send(chat.chat_id, text, parse_mode), chats))
+                last_user_id = chats[-1].id
+                if not self._checkpoint(last_user_id, chats, results):
+                    return
+
+    def _checkpoint(self, last_user_id, chats, results):
+        """save the progress, return False if the job has to stop"""
+        counts = collections.Counter(results)
+        now = int(time.time())
+        for chat, result in zip(chats, results):
+            if result == 'blocked':
+                db.session.merge(BlockedChat(chat_id=chat.chat_id, blocked_at=now))
+        updated = Broadcast.query.filter_by(id=self.broadcast_id, instance=SENDER).update({
+            'last_user_id': last_user_id, 'heartbeat_at': now,
+            'sent': Broadcast.sent + counts['sent'],
+            'failed': Broadcast.failed + counts['failed'],
+            'blocked': Broadcast.blocked + counts['blocked'],
+        }, synchronize_session=False)
+        db.session.commit()
+        for result, count in counts.items():
+            broadcast_messages.inc(result, amount=count)
+        self.done += len(chats)
+
+        broadcast = Broadcast.query.get(self.broadcast_id)
+        db.session.commit()
+        if not updated:
+            logger.warning(f'Broadcast {self.broadcast_id} has been taken over by {broadcast.instance}')
+            return False
+        left = max(broadcast.total - broadcast.sent - broadcast.failed - broadcast.blocked, 0)
+        logger.info(f'Broadcast {self.broadcast_id}: {broadcast.sent} sent, {broadcast.failed} failed, '
+                    f'{broadcast.blocked} blocked of {broadcast.total}, {self.rate:.1f} messages/s, '
+                    f'ETA {left / max(self.rate, 1e-9):.0f} s')
+        if broadcast.status != 'running':
+            logger.info(f'Broadcast {self.broadcast_id} has been {broadcast.status}')
+            return False
+        return True
+
+    def _finish(self):
+        Broadcast.query.filter_by(id=self.broadcast_id, instance=SENDER, status='running') \
+            .update({'status': 'done', 'heartbeat_at': int(time.time())}, synchronize_session=False)
+        db.session.commit()
+        logger.info(f'Broadcast {self.broadcast_id} is done')
+
+
+running = {}  # broadcast id -> BroadcastJob of this process
+running_lock = threading.Lock()
+Gauge('weatherbot_broadcasts_running', 'Broadcasts sent by this process', func=lambda: len(running))
+
+
+def _start_job(broadcast_id):
+    with running_lock:
+        if broadcast_id in running:
+            return
+        job = running[broadcast_id] = BroadcastJob(broadcast_id)
+    job.thread.start()
+
+
+def start_broadcast(text, parse_mode=None):
+    """save a broadcast of the text to every user and start sending it from this process"""
+    total = db.session.query(User.id).outerjoin(BlockedChat, BlockedChat.chat_id == User.chat_id) \
+        .filter(BlockedChat.chat_id.is_(None)).count()
+    now = int(time.time())
+    broadcast = Broadcast(text=text, parse_mode=parse_mode, status='running', total=total, created_at=now,
+                          instance=SENDER, heartbeat_at=now)
+    db.session.add(broadcast)
+    db.session.commit()
+    _start_job(broadcast.id)
+    return broadcast
+
+
+def claim(broadcast_id, statuses=('running',)):
+    """make this process the sender of the broadcast if it is in one of the statuses and its sender has not
+    checkpointed for BROADCAST_LEASE seconds (a paused one has no sender). Return True if it has been claimed
+    """
+    now = int(time.time())
+    claimed = Broadcast.query.filter(
+        Broadcast.id == broadcast_id, Broadcast.status.in_(statuses),
+        db.or_(Broadcast.status != 'running', Broadcast.heartbeat_at.is_(None),
+               Broadcast.heartbeat_at < now - BROADCAST_LEASE)
+    ).update({'status': 'running', 'instance': SENDER, 'heartbeat_at': now}, synchronize_session=False)
+    db.session.commit()
+    return bool(claimed)
+
+
+def resume_broadcasts():
+    """take over the running broadcasts whose sender has stopped checkpointing, e.g. it has been restarted"""
+    stale = int(time.time()) - BROADCAST_LEASE
+    broadcast_ids = [broadcast_id for broadcast_id, in db.session.query(Broadcast.id).filter(
+        Broadcast.status == 'running', db.or_(Broadcast.heartbeat_at.is_(None), Broadcast.heartbeat_at < stale))]
+    for broadcast_id in broadcast_ids:
+        if claim(broadcast_id):
+            logger.info(f'Broadcast {broadcast_id} is resumed by {SENDER}')
+            _start_job(broadcast_id)
+
+
+def pause_broadcast(broadcast):
+    return _set_status(broadcast, 'paused', ('running',))
+
+
+def cancel_broadcast(broadcast):
+    return _set_status(broadcast, 'cancelled', ('running', 'paused'))
+
+
+def resume_broadcast(broadcast):
+    """send a paused broadcast from this process, return False if it is not paused"""
+    if not claim(broadcast.id, statuses=('paused',)):
+        return False
+    _start_job(broadcast.id)
+    return True
+
+
+def _set_status(broadcast, status, from_statuses):
+    """return False if the broadcast is not in one of `from_statuses`. Its sender stops at the next checkpoint"""
+    updated = Broadcast.query.filter(Broadcast.id == broadcast.id, Broadcast.status.in_(from_statuses)) \
+        .update({'status': status}, synchronize_session=False)
+    db.session.commit()
+    return bool(updated)
+
+
+broadcast_actions = {'pause': pause_broadcast, 'resume': resume_broadcast, 'cancel': cancel_broadcast}
+
+
+def get_progress(broadcast):
+    """return the state of the broadcast with its throughput (messages per second) and ETA (seconds) if it runs"""
+    db.session.refresh(broadcast)
+    done = broadcast.sent + broadcast.failed + broadcast.blocked
+    progress = {
+        'id': broadcast.id, 'status': broadcast.status, 'instance': broadcast.instance, 'total': broadcast.total,
+        'sent': broadcast.sent, 'failed': broadcast.failed, 'blocked': broadcast.blocked,
+        'last user id': broadcast.last_user_id, 'rate': None, 'eta': None,
+    }
+    if broadcast.status == 'running':
+        job = running.get(broadcast.id)
+        if job is not None:
+            rate = job.rate
+        else:  # sent by another process, average since it was created
+            rate = done / max((broadcast.heartbeat_at or broadcast.created_at) - broadcast.created_at, 1)
+        progress['rate'] = round(rate, 1)
+        progress['eta'] = round(max(broadcast.total - done, 0) / rate) if rate else None
+    return progress
+
+
+def unblock_chat(chat_id):
+    """the chat has sent /start again, it gets the next broadcasts"""
+    if BlockedChat.query.filter_by(chat_id=chat_id).delete(synchronize_session=False):
+        db.session.commit()
@@ -0,0 +1,423 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from app import logger
+
+CACHE_URL = os.getenv('CACHE_URL', 'memory://')  # memory://, sqlite:////path/to/cache.db or redis://host:port/db
+CACHE_TTL = int(os.getenv('CACHE_TTL', 24 * 3600))  # seconds an item is kept by the shared backends
+CACHE_NEAR_TTL = float(os.getenv('CACHE_NEAR_TTL', 5))  # seconds items of a shared backend are kept in the process
+CACHE_TIMEOUT = float(os.getenv('CACHE_TIMEOUT', 1))  # seconds to wait for the Redis server
+COMPRESS_MIN_SIZE = 512  # bytes, smaller values are not compressed
+
+missing = object()
+
+
+# name -> slotted class whose instances the shared caches store, see `register_type`
+serializable_types = {}
+
+
+def register_type(cls):
+    """let the shared caches store instances of the slotted class, as the data of their slots"""
+    serializable_types[cls.__name__] = cls
+    return cls
+
+
+def _encode(value):
+    """return the JSON form of the value, tuples, dicts and registered objects are tagged"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, tuple):
+        return {'t': [_encode(item) for item in value]}
+    if isinstance(value, dict):
+        return {'d': [[_encode(key), _encode(item)] for key, item in value.items()]}
+    cls = type(value)
+    if serializable_types.get(cls.__name__) is not cls:
+        raise TypeError(f'{cls.__name__} is not registered to be stored in a shared cache')
+    return {'o': cls.__name__, 'v': [_encode(getattr(value, slot)) for slot in cls.__slots__]}
+
+
+def _decode(data):
+    if isinstance(data, list):
+        return [_decode(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    if 't' in data:
+        return tuple(_decode(item) for item in data['t'])
+    if 'd' in data:
+        return {_decode(key): _decode(item) for key, item in data['d']}
+    cls = serializable_types[data['o']]
+    if len(data['v']) != len(cls.__slots__):
+        raise ValueError(f'{cls.__name__} has other fields than the cached one')
+    value = object.__new__(cls)  # the slots are restored as stored, __init__ is not run again
+    for slot, item in zip(cls.__slots__, data['v']):
+        setattr(value, slot, _decode(item))
+    return value
+
+
+def serialize(value):
+    """encode the value as JSON, compressed if that makes it smaller. The first byte tells which.
+    Only data is stored (no pickle), so whoever can write to the shared backend cannot run code in the bot
+    """
+    data = json.dumps(_encode(value), separators=(',', ':')).encode()
+    if len(data) >= COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data):
+            return b'z' + compressed
+    return b'j' + data
+
+
+def deserialize(data):
+    """return the value, `missing` if the data is not a serialized value (e.g. stored by an older version)"""
+    try:
+        if data[:1] == b'z':
+            data = b'j' + zlib.decompress(data[1:])
+        if data[:1] != b'j':
+            return missing
+        return _decode(json.loads(data[1:]))
+    except (ValueError, KeyError, TypeError, zlib.error) as e:
+        logger.warning(f'Cached value is not readable\n{repr(e)}')
+        return missing
+
+
+class LruCache:
+    """thread-safe mapping that keeps at most `maxsize` recently used items"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def get_many(self, keys):
+        """return {key: value} of the keys found"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    found[key] = self._items[key]
+        return found
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def set_many(self, items):
+        with self._lock:
+            for key, value in items.items():
+                self._set(key, value)
+
+    def _set(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._items.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SqliteCache:
+    """cache in a SQLite file shared by the processes of the host, values are serialized.
+    Items expire after `ttl` seconds, the oldest ones are deleted once there are more than `maxsize`
+    """
+    trim_every = 100  # sets between two trims
+    query_chunk_size = 500  # keys per query, SQLite takes at most 999 parameters
+
+    def __init__(self, path, name, maxsize, ttl=CACHE_TTL):
+        self.path = path
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._sets = 0
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (name TEXT, key TEXT, value BLOB, stored REAL, '
+                               'PRIMARY KEY (name, key)) WITHOUT ROWID')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = {repr(key): key for key in keys}
+        names = list(keys)
+        found = {}
+        for start in range(0, len(names), self.query_chunk_size):
+            chunk = names[start:start + self.query_chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._connect().execute(
+                f'SELECT key, value FROM cache WHERE name = ? AND stored > ? AND key IN ({placeholders})',
+                (self.name, time.time() - self.ttl, *chunk)).fetchall()
+            for key, data in rows:
+                value = deserialize(data)
+                if value is not missing:
+                    found[keys[key]] = value
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO cache (name, key, value, stored) VALUES (?, ?, ?, ?)',
+                                   [(self.name, repr(key), serialize(value), now) for key, value in items.items()])
+        self._sets += len(items)
+        if self._sets >= self.trim_every:
+            self._sets = 0
+            self.trim()
+
+    def trim(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache WHERE name = ? AND (stored <= ? OR key IN (SELECT key FROM cache '
+                               'WHERE name = ? ORDER BY stored DESC LIMIT -1 OFFSET ?))',
+                               (self.name, time.time() - self.ttl, self.name, self.maxsize))
+
+    def pop(self, key, default=None):
+        value = self.get(key, missing)
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache WHERE name = ? AND key = ?', (self.name, repr(key)))
+        return default if value is missing else value
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM cache WHERE name = ?', (self.name,))
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM cache WHERE name = ?', (self.name,)).fetchone()[0]
+
+
+class RedisError(Exception):
+    """error reply of the Redis server"""
+
+
+class RedisConnection:
+    """minimal client of the Redis protocol (RESP), commands are pipelined: one round-trip per call of `execute`"""
+
+    def __init__(self, host, port, db=0, timeout=CACHE_TIMEOUT):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile('rb')
+        if db:
+            self.execute(('SELECT', db))
+
+    def execute(self, *commands):
+        """send the commands and return their replies, a RedisError reply is returned, not raised"""
+        self._socket.sendall(b''.join(self._encode(command) for command in commands))
+        return [self._read() for _ in commands]
+
+    @staticmethod
+    def _encode(command):
+        parts = [arg if isinstance(arg, bytes) else str(arg).encode() for arg in command]
+        return b'*%d\r\n' % len(parts) + b''.join(b'$%d\r\n%s\r\n' % (len(part), part) for part in parts)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError('Connection to the Redis server has been closed')
+        kind, value = line[:1], line[1:-2]
+        if kind == b'+':
+            return value.decode()
+        if kind == b'-':
+            return RedisError(value.decode())
+        if kind == b':':
+            return int(value)
+        if kind == b'$':
+            if value == b'-1':
+                return None
+            data = self._file.read(int(value) + 2)
+            return data[:-2]
+        if kind == b'*':
+            if value == b'-1':
+                return None
+            return [self._read() for _ in range(int(value))]
+        raise ConnectionError(f'Unexpected reply from the Redis server: {line!r}')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+class RedisCache:
+    """cache in a Redis server (or anything speaking its protocol) shared by every process and host.
+    Items expire after `ttl` seconds, the size is left to the server (maxmemory). The cache is best effort:
+    while the server is unreachable every key is missing and nothing is stored
+    """
+
+    retry_after = 5  # seconds without trying to connect once the server is unreachable
+
+    def __init__(self, url, name, maxsize, ttl=CACHE_TTL):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.db = int(parts.path.strip('/') or 0)
+        self.prefix = f'weatherbot:{name}:'
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._down_until = 0
+
+    def _execute(self, *commands):
+        """return the replies, None if the server is unreachable"""
+        if time.monotonic() < self._down_until:
+            return None
+        for attempt in (1, 2):  # a connection closed by the server is opened again once
+            connection = getattr(self._local, 'connection', None)
+            try:
+                if connection is None:
+                    connection = self._local.connection = RedisConnection(self.host, self.port, self.db)
+                return connection.execute(*commands)
+            except OSError as e:
+                self._local.connection = None
+                if connection is not None:
+                    connection.close()
+                if attempt == 2 or connection is None:
+                    logger.warning(f'Redis cache is unavailable for {self.retry_after} s\n{repr(e)}')
+                    self._down_until = time.monotonic() + self.retry_after
+                    return None
+
+    def _key(self, key):
+        return self.prefix + repr(key)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        replies = self._execute(('MGET', *map(self._key, keys)))
+        if replies is None or isinstance(replies[0], RedisError):
+            return {}
+        found = {}
+        for key, data in zip(keys, replies[0]):
+            value = missing if data is None else deserialize(data)
+            if value is not missing:
+                found[key] = value
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        if items:
+            self._execute(*(('SET', self._key(key), serialize(value), 'PX', int(self.ttl * 1000))
+                            for key, value in items.items()))
+
+    def pop(self, key, default=None):
+        replies = self._execute(('GET', self._key(key)), ('DEL', self._key(key)))
+        if not replies or not isinstance(replies[0], bytes):
+            return default
+        value = deserialize(replies[0])
+        return default if value is missing else value
+
+    def clear(self):
+        cursor = b'0'
+        while True:
+            replies = self._execute(('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 1000))
+            if not replies or not isinstance(replies[0], list):
+                return
+            cursor, keys = replies[0]
+            if keys:
+                self._execute(('DEL', *keys))
+            if cursor == b'0':
+                return
+
+    def __len__(self):
+        return 0  # unknown, the keys of the server are not counted
+
+
+class NearCache:
+    """shared cache with a copy of the recently used items in the process for `near_ttl` seconds,
+    so hot keys do not cost a round-trip and a deserialization on every get
+    """
+
+    def __init__(self, backend, near_size, near_ttl=CACHE_NEAR_TTL):
+        self.backend = backend
+        self.near_ttl = near_ttl
+        self._near = LruCache(near_size)  # key -> (value, time it was read)
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        for key, (value, read_at) in self._near.get_many(keys).items():
+            if now - read_at < self.near_ttl:
+                found[key] = value
+        remote = [key for key in keys if key not in found]
+        if remote:
+            fetched = self.backend.get_many(remote)
+            self._near.set_many({key: (value, now) for key, value in fetched.items()})
+            found.update(fetched)
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        now = time.monotonic()
+        self._near.set_many({key: (value, now) for key, value in items.items()})
+        self.backend.set_many(items)
+
+    def pop(self, key, default=None):
+        self._near.pop(key)
+        return self.backend.pop(key, default)
+
+    def clear(self):
+        self._near.clear()
+        self.backend.clear()
+
+    def __len__(self):
+        return len(self._near)
+
+
+def get_cache(name, maxsize, ttl=CACHE_TTL, url=CACHE_URL):
+    """return the cache `name` of the backend configured by CACHE_URL. Every backend has get, get_many, set,
+    set_many, pop and clear, the values of the shared ones are serialized, so they have to be built of None, bool,
+    numbers, strings, lists, tuples, dicts and the classes of `register_type`
+    """
+    scheme = urlsplit(url).scheme
+    if scheme == 'memory':
+        return LruCache(maxsize)
+    if scheme == 'sqlite':
+        backend = SqliteCache(url[len('sqlite:///'):], name, maxsize, ttl)
+    elif scheme == 'redis':
+        backend = RedisCache(url, name, maxsize, ttl)
+    else:
+        raise ValueError(f'Unknown cache backend {url}')
+    return NearCache(backend, maxsize)
@@ -0,0 +1,100 @@
+import threading
+from collections import Counter
+
+from app import logger
+from app.data.emoji_conditions import cond_emoji, cond_emoji_night, cond_trans, cond_trans_reversed
+from app.data.localization import phenomenon_aliases
+from app.metrics import Counter as MetricCounter
+
+unknown_conditions = Counter()  # condition -> times seen
+unknown_conditions_lock = threading.Lock()
+unknown_conditions_total = MetricCounter('weatherbot_unknown_conditions_total',
+                                         'Conditions missing from the emoji tables')
+collecting = threading.local()  # .conditions: unknown conditions met in `collect_unknown_conditions`, not counted
+
+# lang -> {condition code: name}, conditions are shown as read from the website in the other languages
+condition_names = {'ru': cond_trans}
+
+
+def compile_condition_index():
+    """return {(condition, is daylight): (emoji, code)} for every lowercase en/ru condition name and code.
+    The code is the english name used as a key in cond_emoji
+    """
+    names = {code: code for code in cond_emoji}
+    for ru_name, code in cond_trans_reversed.items():
+        names.setdefault(ru_name, code)
+
+    index = {}
+    for name, code in names.items():
+        if code not in cond_emoji:
+            continue
+        index[name, True] = (cond_emoji[code], code)
+        index[name, False] = (cond_emoji_night.get(code, cond_emoji[code]), code)
+    return index
+
+
+def compile_phenomenon_conditions():
+    """return {phenomenon: frozenset of condition codes} from the aliases of every language in phenomenon_aliases.
+    Raise ValueError on an alias that is not a known condition, it would never match
+    """
+    unknown = [alias for langs in phenomenon_aliases.values() for aliases in langs.values() for alias in aliases
+               if (alias.lower(), True) not in condition_index]
+    if unknown:
+        raise ValueError(f'Phenomenon aliases are not known conditions: {", ".join(unknown)}')
+    return {phenomenon: frozenset(condition_index[alias.lower(), True][1]
+                                  for aliases in langs.values() for alias in aliases)
+            for phenomenon, langs in phenomenon_aliases.items()}
+
+
+condition_index = compile_condition_index()
+phenomenon_conditions = compile_phenomenon_conditions()
+
+
+def normalize_condition(condition):
+    """return the code of an en/ru condition or None if it is unknown, unknown conditions are counted"""
+    entry = condition_index.get((condition.lower(), True))
+    if entry is not None:
+        return entry[1]
+
+    conditions = getattr(collecting, 'conditions', None)
+    if conditions is not None:
+        conditions.append(condition)
+    else:
+        count_unknown_conditions([condition])
+    return None
+
+
+def count_unknown_conditions(conditions):
+    """count the unknown conditions and log the first occurrence of each"""
+    for condition in conditions:
+        with unknown_conditions_lock:
+            unknown_conditions[condition] += 1
+            first_seen = unknown_conditions[condition] == 1
+        unknown_conditions_total.inc()
+        if first_seen:
+            logger.warning(f'Condition has not been found: {condition}')
+
+
+def collect_unknown_conditions(function, *args):
+    """return (function(*args), the unknown conditions it has met) without counting them.
+    The parse processes run the parsers through it, so the parent counts the conditions in its own metrics
+    """
+    collecting.conditions = []
+    try:
+        return function(*args), collecting.conditions
+    finally:
+        collecting.conditions = None
+
+
+def get_condition_emoji(code, is_daylight):
+    """return emoji of the condition code, empty string if the code is unknown"""
+    entry = condition_index.get((code, is_daylight))
+    return entry[0] if entry is not None else ''
+
+
+def get_condition_name(condition, code, lang):
+    """return the condition in the language, `condition` is the english name read from the website"""
+    names = condition_names.get(lang)
+    if names is None or code not in names:
+        return condition
+    return names[code].capitalize()
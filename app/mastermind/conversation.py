@@ -0,0 +1,74 @@
+import os
+import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db, logger
+from app.mastermind.caching import get_cache
+from app.models import Conversation
+
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', 900))  # seconds a chat waits for the answer to a step
+CONVERSATION_CACHE_SIZE = int(os.getenv('CONVERSATION_CACHE_SIZE', 10000))
+
+# steps
+CITY_STEP = 'city'  # the name of the user's city
+PHENOMENON_STEP = 'phenomenon'  # the value of a manual phenomenon, the payload is the phenomenon
+
+# chat id -> expiry of its step, so the table is only read for the chats at a step. With the in-process cache
+# (memory://) a worker only sees the steps it has set, CACHE_URL shares them between the workers
+step_markers = get_cache('conversation', CONVERSATION_CACHE_SIZE, ttl=CONVERSATION_TTL)
+
+
+def set_step(chat_id, step, payload=None, ttl=CONVERSATION_TTL):
+    """make the next text message of the chat the answer to `step`, instead of the step the chat was at. Commits"""
+    expires_at = int(time.time()) + ttl
+    db.session.merge(Conversation(chat_id=chat_id, step=step, payload=payload, expires_at=expires_at))
+    db.session.commit()
+    step_markers.set(chat_id, expires_at)
+
+
+def get_step(chat_id):
+    """return (step, payload) the chat is at, None if it is at none or the step has expired"""
+    row = db.session.query(Conversation.step, Conversation.payload) \
+        .filter(Conversation.chat_id == chat_id, Conversation.expires_at > time.time()).first()
+    return (row.step, row.payload) if row else None
+
+
+def has_step(chat_id):
+    """return True if the chat is at a step, the table is only read if the chat has a marker.
+    An unavailable step store (e.g. the conversation table has not been created) is logged and taken as no step,
+    so the other handlers still answer
+    """
+    if step_markers.get(chat_id, 0) <= time.time():
+        return False
+    try:
+        return get_step(chat_id) is not None
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f'Conversation step of chat {chat_id} is unavailable\n{repr(e)}')
+        return False
+
+
+def pop_step(chat_id):
+    """return (step, payload) like get_step and leave the step, with one statement if the database supports
+    DELETE ... RETURNING. Commits
+    """
+    table = Conversation.__table__
+    delete = table.delete().where(table.c.chat_id == chat_id)
+    if db.engine.dialect.implicit_returning:
+        row = db.session.execute(delete.returning(table.c.step, table.c.payload, table.c.expires_at)).first()
+    else:
+        row = db.session.query(Conversation.step, Conversation.payload, Conversation.expires_at) \
+            .filter(Conversation.chat_id == chat_id).first()
+        if row is not None:
+            db.session.execute(delete)
+    db.session.commit()
+    step_markers.pop(chat_id)
+    if row is None or row.expires_at <= time.time():
+        return None
+    return row.step, row.payload
+
+
+def expired_steps():
+    """query of the chat ids whose step has expired"""
+    return db.session.query(Conversation.chat_id).filter(Conversation.expires_at <= time.time())
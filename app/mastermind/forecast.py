@@ -0,0 +1,160 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app import logger
+from app.mastermind.breaker import CircuitBreaker, CircuitOpen
+from app.mastermind.caching import LruCache, get_cache, register_type
+from app.metrics import Counter, Gauge
+from app.mastermind.parsing import get_city_snapshot
+
+FORECAST_TTL = int(os.getenv('FORECAST_TTL', 600))  # seconds
+FORECAST_MIN_TTL = int(os.getenv('FORECAST_MIN_TTL', 300))
+FORECAST_MAX_TTL = int(os.getenv('FORECAST_MAX_TTL', 3600))
+FORECAST_STALE_TTL = int(os.getenv('FORECAST_STALE_TTL', 3 * 3600))  # how long an expired forecast may be served
+FORECAST_HOT_HITS = int(os.getenv('FORECAST_HOT_HITS', 5))  # requests per refresh that make a city hot
+FORECAST_REFRESH_WORKERS = int(os.getenv('FORECAST_REFRESH_WORKERS', 4))
+FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', 2048))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', 20))  # last upstream calls the failure rate is computed on
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_SLOW_CALL = float(os.getenv('BREAKER_SLOW_CALL', 4))  # seconds after which a call counts as failed
+BREAKER_OPEN_TIME = float(os.getenv('BREAKER_OPEN_TIME', 30))  # seconds without upstream calls once open
+BREAKER_PROBES = int(os.getenv('BREAKER_PROBES', 3))
+
+fetchers = {
+    'snapshot': get_city_snapshot,
+}
+
+forecasts = get_cache('forecast', FORECAST_CACHE_SIZE)  # shared by the processes unless CACHE_URL is memory://
+hits = LruCache(FORECAST_CACHE_SIZE)  # requests of this process since the last fetch, by key
+
+# only network errors, timeouts, overload and captcha answers count, a wrong city name does not
+upstream_breaker = CircuitBreaker(
+    'Weather website', failure_rate=BREAKER_FAILURE_RATE, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS,
+    slow_call_seconds=BREAKER_SLOW_CALL, open_seconds=BREAKER_OPEN_TIME, probes=BREAKER_PROBES,
+    is_failure=lambda exception: isinstance(exception, requests.RequestException))
+last_known_good = Counter('weatherbot_forecast_fallback_total',
+                          'Expired forecasts served because the weather website is unavailable')
+
+refresh_executor = ThreadPoolExecutor(max_workers=FORECAST_REFRESH_WORKERS, thread_name_prefix='forecast-refresh')
+refreshing = set()  # keys being refreshed in the background
+refreshing_lock = threading.Lock()
+
+Gauge('weatherbot_forecast_cache_size', 'Forecasts in the cache', func=lambda: len(forecasts))
+Gauge('weatherbot_forecast_refresh_queue', 'Forecasts waiting for or being refreshed', func=lambda: len(refreshing))
+Gauge('weatherbot_upstream_circuit_state', 'Circuit of the weather website: 0 closed, 1 half-open, 2 open',
+      func=lambda: upstream_breaker.state)
+Counter('weatherbot_upstream_rejected_total', 'Upstream calls rejected by the open circuit',
+        func=lambda: upstream_breaker.rejected)
+
+
+@register_type
+class ForecastEntry:
+    __slots__ = ('forecast', 'version', 'fetched_at', 'ttl')
+
+    def __init__(self, forecast, version, fetched_at, ttl):
+        self.forecast = forecast
+        self.version = version
+        self.fetched_at = fetched_at
+        self.ttl = ttl
+
+
+def new_version():
+    """random 63-bit version, unique across the processes sharing the cache"""
+    return random.getrandbits(63)
+
+
+def get_forecast(kind, city_name):
+    """return (forecast, version, as of) of the city, forecasts do not depend on the language of the user.
+    An expired forecast is still returned for up to FORECAST_STALE_TTL seconds while it is refreshed in the background.
+    While the weather website is unavailable the last fetched forecast is returned whatever its age, `as of` is then
+    the time it was fetched, otherwise None.
+    The version is unique across all cities and changes only when a fetched forecast differs from the cached one
+    """
+    key = (kind, city_name)
+    entry = forecasts.get(key)
+    if entry is None:
+        return (*_fetch(key, None), None)
+
+    hits.set(key, hits.get(key, 0) + 1)
+    age = time.time() - entry.fetched_at
+    if age < entry.ttl:
+        return entry.forecast, entry.version, None
+
+    if not upstream_breaker.is_closed:  # the background refresh probes the website
+        _refresh_in_background(key, entry)
+        return _get_last_known_good(entry)
+    if age >= FORECAST_STALE_TTL:
+        try:
+            return (*_fetch(key, entry), None)
+        except (CircuitOpen, requests.RequestException) as e:
+            logger.warning(f'Last known forecast is served for {key}\n{repr(e)}')
+            return _get_last_known_good(entry)
+    _refresh_in_background(key, entry)
+    return entry.forecast, entry.version, None
+
+
+def get_snapshot(city_name):
+    """return (CitySnapshot, version, as of) of the city, every view is rendered from it in every language"""
+    return get_forecast('snapshot', city_name)
+
+
+def prefetch(city_names, kind='snapshot'):
+    """load the forecasts of the cities from the cache in one round-trip, the next get_forecast of them is local"""
+    forecasts.get_many([(kind, city_name) for city_name in set(city_names)])
+
+
+def _get_last_known_good(entry):
+    last_known_good.inc()
+    return entry.forecast, entry.version, entry.fetched_at
+
+
+def _fetch(key, entry):
+    kind, city_name = key
+    forecast = upstream_breaker.call(fetchers[kind], city_name)
+    now = time.time()
+
+    if entry is None:
+        version = new_version()
+        ttl = FORECAST_TTL
+    else:
+        changed = entry.forecast != forecast
+        version = new_version() if changed else entry.version
+        ttl = _get_next_ttl(key, entry, changed)
+    forecasts.set(key, ForecastEntry(forecast, version, now, ttl))
+    hits.pop(key)
+    return forecast, version
+
+
+def _get_next_ttl(key, entry, changed):
+    """refresh a city more often while its forecast keeps changing and less often while it is stable.
+    Hot cities are never kept longer than FORECAST_TTL
+    """
+    ttl = entry.ttl / 2 if changed else entry.ttl * 2
+    max_ttl = FORECAST_TTL if hits.get(key, 0) >= FORECAST_HOT_HITS else FORECAST_MAX_TTL
+    return min(max(ttl, FORECAST_MIN_TTL), max_ttl)
+
+
+def _refresh_in_background(key, entry):
+    with refreshing_lock:
+        if key in refreshing:
+            return
+        refreshing.add(key)
+    refresh_executor.submit(_refresh, key, entry)
+
+
+def _refresh(key, entry):
+    try:
+        _fetch(key, entry)
+    except CircuitOpen:
+        pass
+    except Exception as e:
+        logger.error(f'Forecast refresh failed for {key}\n{repr(e)}')
+    finally:
+        with refreshing_lock:
+            refreshing.discard(key)
@@ -1,15 +1,31 @@
+import os
 from datetime import datetime
-from typing import Dict
 
+import pytz
+import requests
 import transliterate
 from transliterate.exceptions import LanguageDetectionError
 
 from app import logger
-from app.data import emoji_conditions
-from app.data.localization import hints, info, phenomenon_button_names, phenomenon_aliases
-from app.data.utils import get_city_data
-from app.mastermind.parsing import get_weather_info, get_extended_info, get_extended_info_for_week
-from app.models import Phenomenon
+from app.data.localization import day_part_names, duration_units, hints, month_names, phenomenon_button_names, \
+    wind_directions
+from app.data.utils import get_city_data, get_city_name
+from app.mastermind.alerts import get_rules
+from app.mastermind.caching import get_cache
+from app.mastermind.conditions import get_condition_emoji, get_condition_name
+from app.metrics import Gauge, render_cache, render_seconds
+from app.mastermind.breaker import CircuitOpen
+from app.mastermind.forecast import get_snapshot
+from app.mastermind.templates import day_part_titles, labels, templates
+
+RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', 4096))
+TIME_ZONE_MSK = pytz.timezone('Europe/Moscow')
+
+upstream_errors = (CircuitOpen, requests.RequestException)  # the weather website is unavailable
+
+# rendered replies keyed by (city, lang, view, day part, forecast version)
+rendered_messages = get_cache('render', RENDER_CACHE_SIZE)
+Gauge('weatherbot_render_cache_size', 'Rendered replies in the cache', func=lambda: len(rendered_messages))
 
 
 def get_start(first_name, lang):
@@ -50,296 +66,269 @@ def get_day_part(ts, sunrise, sunset):  # timestamp in Unix time
         return 'day'
 
 
-def get_condition(cond, day_part):
-    """"return emoji from the dictionary"""
-    daylight_time = ['morning', 'day', 'утром', 'днём']
+def format_temp(temp):
+    """5 -> '+5', -3 -> '−3'"""
+    if temp > 0:
+        return f'+{temp}'
+    if temp < 0:
+        return f'−{-temp}'
+    return '0'
 
-    if day_part.lower() not in daylight_time:
-        try:
-            condition = emoji_conditions.cond_emoji_night[cond.lower()]
-            return condition.title()
-        except KeyError as e:
-            logger.warning(f'Condition has not been found\n{e}')
-            try:
-                translated = emoji_conditions.cond_trans_reversed[cond.lower()]
-                condition = emoji_conditions.cond_emoji_night[translated.lower()]
-                return condition.title()
-            except KeyError as e:
-                logger.warning(f'Condition has not been found\n{e}')
 
-    try:
-        condition = emoji_conditions.cond_emoji[cond.lower()]
-    except KeyError as e:
-        logger.warning(f'Condition has not been found\n{e}')
-        try:
-            translated = emoji_conditions.cond_trans_reversed[cond.lower()]
-            condition = emoji_conditions.cond_emoji[translated.lower()]
-        except KeyError as e:
-            logger.warning(f'Condition has not been found\n{e}')
-            return ''
-    return condition.title()
+def format_temp_range(temp_min, temp_max):
+    if temp_min == temp_max:
+        return f'{format_temp(temp_min)}°'
+    return f'{format_temp(temp_min)}°…{format_temp(temp_max)}°'
 
 
-def get_today_weather_info(city_name, lang, cur_timestamp):
-    """basic function to get weather info for today"""
+def format_wind(wind_speed, wind_direction, lang, with_direction=True):
+    """return wind speed with unit and direction or 'calm'"""
+    if wind_speed is None:
+        return labels[lang]['CALM']
+    speed = f'{wind_speed:g}'
+    if lang == 'ru':
+        speed = speed.replace('.', ',')
+    if with_direction and wind_direction:
+        direction = wind_directions[wind_direction][lang] if wind_direction in wind_directions else wind_direction
+        return f'{speed} {labels[lang]["M_S"]}, {direction}'
+    return f'{speed} {labels[lang]["M_S"]}'
 
-    transliterated_city = transliterate_name(city_name)
 
-    try:
-        weather_info = get_weather_info(transliterated_city, lang)
-    except AttributeError as e:
-        logger.error(f'Wrong city name\n{e}')
-        return info[lang][0]
-    else:
-        weather_rest_info = get_extended_info(transliterated_city, 'today', lang)  # type: Dict
+def format_day_part(name, lang):
+    """'morning' -> 'утром'"""
+    return day_part_names[name][lang] if name in day_part_names else name
+
+
+def format_day_part_title(name, lang):
+    """'morning' -> 'Утром'"""
+    return day_part_titles[lang][name] if name in day_part_names else name.title()
 
-    daypart_message = ''
-    for i in range(1, 5):
-        daypart_info = weather_rest_info["part" + str(i)]  # type: Dict[str, str]
-        daypart = daypart_info["weather_daypart"]
-        daypart_temp = daypart_info["weather_daypart_temp"]
-        daypart_cond = daypart_info["weather_daypart_condition"]
-        daypart_cond_emoji = get_condition(daypart_cond, daypart)
 
-        wind_speed_and_direction = daypart_info["wind_speed_and_direction"]
-        if wind_speed_and_direction != info[lang][7]:
-            wind_speed_and_direction = wind_speed_and_direction.split(', ')[0]
+def format_date(day_forecast, lang):
+    """'20 October' or '20 октября'"""
+    return f'{day_forecast.day} {month_names[lang][day_forecast.month - 1]}'
 
-        daypart_message += f'{daypart.title()}: {daypart_temp}; {info[lang][2]}: {wind_speed_and_direction} ' \
-                           f'{daypart_cond_emoji}\n\n'
 
-    header = weather_info["header"]
-    temp = weather_info["temperature"]
-    wind_speed_and_direction = weather_info["wind_speed_and_direction"]
-    humidity = weather_info["humidity"]
-    cond = weather_info["condition"]
-    feels_like = weather_info["feels_like"]
-    daylight_hours = weather_info["daylight_hours"]
-    sunrise = weather_info["sunrise"]
-    sunset = weather_info["sunset"]
+def format_duration(minutes, lang):
+    """631 -> '10 h 31 min'"""
+    if minutes is None:
+        return ''
+    hours_unit, minutes_unit = duration_units[lang]
+    return f'{minutes // 60} {hours_unit} {minutes % 60} {minutes_unit}'
 
-    day_time = get_day_part(cur_timestamp, sunrise, sunset)
-    weather_cond = get_condition(cond, day_time)
 
-    message_part1 = f'<i>{header}</i>\n\n' \
-                    f'<b>{info[lang][1]}: {temp}°; {info[lang][3]}: {feels_like}\n' \
-                    f'{info[lang][2]}: {wind_speed_and_direction}; {phenomenon_button_names["humidity"][lang]}:' \
-                    f' {humidity}\n' \
-                    f'{cond} {weather_cond}</b> \n\n'
+def _get_rendered(key, render, *args):
+    """return the rendered message from the cache or render and store it"""
+    message = rendered_messages.get(key)
+    if message is None:
+        render_cache.inc('miss')
+        with render_seconds.time(key[2]):
+            message = render(*args)
+        rendered_messages.set(key, message)
+    else:
+        render_cache.inc('hit')
+    return message
+
 
-    message_part2 = f'{info[lang][4]}: {daylight_hours}\n' \
-                    f'{info[lang][5]}: {sunrise} - {sunset}\n'
+def format_as_of(as_of, lang):
+    """return the line marking a forecast served while the weather website is unavailable"""
+    if as_of is None:
+        return ''
+    return templates[lang]['as of'].render(time=datetime.fromtimestamp(as_of, TIME_ZONE_MSK).strftime('%H:%M'))
 
-    response_message = message_part1 + daypart_message + message_part2
 
-    return response_message
+def get_today_weather_info(city_name, lang, cur_timestamp):
+    """basic function to get weather info for today"""
 
+    transliterated_city = transliterate_name(city_name)
 
-def get_next_day(city_name, lang, phenomenon_info=False):
+    try:
+        snapshot, version, as_of = get_snapshot(transliterated_city)
+        today = snapshot.today
+    except (AttributeError, IndexError) as e:
+        logger.error(f'Wrong city name or incomplete forecast\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+    except upstream_errors as e:
+        logger.warning(f'Weather website is unavailable\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+
+    weather_info = snapshot.current
+    day_time = get_day_part(cur_timestamp, weather_info.sunrise, weather_info.sunset)
+    key = (transliterated_city, lang, 'today', day_time, version)
+    message = _get_rendered(key, _render_today_weather_info, weather_info, today, day_time, lang)
+    return message + format_as_of(as_of, lang)
+
+
+def _render_today_weather_info(weather_info, weather_rest_info, day_time, lang):
+    day_part_template = templates[lang]['today day part']
+    day_parts = ''.join(day_part_template.render(
+        day_part=format_day_part_title(daypart.name, lang),
+        temp=format_temp_range(daypart.temp_min, daypart.temp_max),
+        wind=format_wind(daypart.wind_speed, daypart.wind_direction, lang, with_direction=False),
+        emoji=get_condition_emoji(daypart.condition_code, daypart.is_daylight),
+    ) for daypart in weather_rest_info.parts[:4])
+
+    return templates[lang]['today'].render(
+        city=get_city_name(weather_info.city, lang),
+        temperature=format_temp(weather_info.temperature),
+        feels_like=format_temp(weather_info.feels_like),
+        wind=format_wind(weather_info.wind_speed, weather_info.wind_direction, lang),
+        humidity=str(weather_info.humidity),
+        condition=get_condition_name(weather_info.condition, weather_info.condition_code, lang),
+        emoji=get_condition_emoji(weather_info.condition_code, day_time == 'day'),
+        day_parts=day_parts,
+        daylight=format_duration(weather_info.daylight_minutes, lang),
+        sunrise=weather_info.sunrise,
+        sunset=weather_info.sunset,
+    )
+
+
+def get_next_day(city_name, lang):
     """get tomorrow's weather info"""
     transliterated_city = transliterate_name(city_name)
-    extended_info = get_extended_info(transliterated_city, 'tomorrow', lang)  # type: Dict
-    if phenomenon_info:
-        response_dict = {}
-        daypart = 1
-        for weather_val in extended_info.values():
-            daypart_temp = weather_val["weather_daypart_temp"]
-            daypart_condition = weather_val["weather_daypart_condition"]
-            daypart_wind = weather_val["wind_speed_and_direction"].split(info[lang][10])[0].strip()
-            daypart_humidity = weather_val["weather_daypart_humidity"]
-
-            temp_daypart_dict = {
-                'daypart_temp': daypart_temp,
-                'daypart_condition': daypart_condition,
-                'daypart_wind': daypart_wind,
-                'daypart_humidity': daypart_humidity,
-            }
-            response_dict['part' + str(daypart)] = temp_daypart_dict
-            daypart += 1
-            if daypart > 4:
-                break
-        return response_dict
-
-    response_message = f'<i>{extended_info["weather_city"]} {info[lang][6]} {extended_info["weather_date"]}</i>\n\n'
-    for num in range(1, 5):
-        daypart_info = extended_info["part" + str(num)]  # type: Dict[str, str]
-        cond = daypart_info["weather_daypart_condition"]
-        weather_daypart = daypart_info["weather_daypart"]
-        daypart_temp = daypart_info["weather_daypart_temp"]
-        wind_speed_and_direction = daypart_info["wind_speed_and_direction"]
-        response_message += f'<b>{weather_daypart.title()}</b>, {daypart_temp} ' \
-                            f'{info[lang][2]}: {wind_speed_and_direction}' \
-                            f'\n{cond} {get_condition(cond, weather_daypart)}\n\n'
-
-    daylight_hours = f'{info[lang][4]}: {extended_info["daylight_hours"]}\n' \
-                     f'{info[lang][5]}: {extended_info["sunrise"]} - {extended_info["sunset"]}\n'
-    response_message += daylight_hours
-
-    return response_message
+    try:
+        snapshot, version, as_of = get_snapshot(transliterated_city)
+        tomorrow = snapshot.tomorrow
+    except (AttributeError, IndexError) as e:
+        logger.error(f'Wrong city name or incomplete forecast\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+    except upstream_errors as e:
+        logger.warning(f'Weather website is unavailable\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+    key = (transliterated_city, lang, 'tomorrow', None, version)
+    return _get_rendered(key, _render_next_day, tomorrow, lang) + format_as_of(as_of, lang)
+
+
+def _render_next_day(extended_info, lang):
+    day_part_template = templates[lang]['tomorrow day part']
+    day_parts = ''.join(day_part_template.render(
+        day_part=format_day_part_title(daypart.name, lang),
+        temp=format_temp_range(daypart.temp_min, daypart.temp_max),
+        wind=format_wind(daypart.wind_speed, daypart.wind_direction, lang),
+        condition=get_condition_name(daypart.condition, daypart.condition_code, lang),
+        emoji=get_condition_emoji(daypart.condition_code, daypart.is_daylight),
+    ) for daypart in extended_info.parts[:4])
+
+    return templates[lang]['tomorrow'].render(
+        city=get_city_name(extended_info.city, lang),
+        date=format_date(extended_info, lang),
+        day_parts=day_parts,
+        daylight=format_duration(extended_info.daylight_minutes, lang),
+        sunrise=extended_info.sunrise,
+        sunset=extended_info.sunset,
+    )
 
 
 def get_next_week(city, lang):
     """get next 7 day's weather info"""
     transliterated_city = transliterate_name(city)
-    extended_info = get_extended_info_for_week(transliterated_city, lang)
-    response_message = ''
-    weather_city = extended_info.pop('weather_city')
-    for day in extended_info.values():
-        day_info_message = ''
-        for day_part_key, day_part_value in day.items():
-            if 'part' not in day_part_key:
-                continue
-
-            weather_daypart = day_part_value['weather_daypart'].title()
-            weather_daypart_temp = day_part_value['weather_daypart_temp']
-            weather_daypart_condition = day_part_value['weather_daypart_condition']
-            wind_speed_and_direction = day_part_value['wind_speed_and_direction']
-            weather_cond = get_condition(weather_daypart_condition, weather_daypart)
-            day_info_message += f'{weather_daypart}: {weather_daypart_temp}; ' \
-                                f' {wind_speed_and_direction} {weather_cond}\n'
-
-        weather_date = day['weather_date']
-        day_info_message = f'\n<i><b>{weather_date}</b></i>\n{day_info_message}'  # date + weather info
-        response_message += day_info_message
-
-    response_message = f'<i>{weather_city}. {info[lang][8]}</i>\n{response_message}'
-
-    return response_message
+    try:
+        snapshot, version, as_of = get_snapshot(transliterated_city)
+        week = snapshot.week
+    except (AttributeError, IndexError) as e:
+        logger.error(f'Wrong city name or incomplete forecast\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+    except upstream_errors as e:
+        logger.warning(f'Weather website is unavailable\n{repr(e)}')
+        return labels[lang]['TRY_AGAIN']
+    key = (transliterated_city, lang, 'week', None, version)
+    return _get_rendered(key, _render_next_week, week, lang) + format_as_of(as_of, lang)
+
+
+def _render_next_week(extended_info, lang):
+    day_template = templates[lang]['week day']
+    day_part_template = templates[lang]['week day part']
+    days = ''.join(day_template.render(
+        date=format_date(day, lang),
+        day_parts=''.join(day_part_template.render(
+            day_part=format_day_part_title(daypart.name, lang),
+            temp=format_temp_range(daypart.temp_min, daypart.temp_max),
+            wind=format_wind(daypart.wind_speed, daypart.wind_direction, lang),
+            emoji=get_condition_emoji(daypart.condition_code, daypart.is_daylight),
+        ) for daypart in day.parts),
+    ) for day in extended_info)
+
+    city = get_city_name(extended_info[0].city, lang) if extended_info else ''
+    return templates[lang]['week'].render(city=city, days=days)
 
 
 def get_daily(city_name, lang):
     """daily info"""
     transliterated_city = transliterate_name(city_name)
-    extended_info = get_extended_info(transliterated_city, 'daily', lang)
-    response_message = f'{extended_info["part1"]["weather_daypart"]},\n' \
-                       f'{extended_info["part1"]["weather_daypart_temp"]},\n' \
-                       f'{extended_info["part1"]["weather_daypart_condition"]},\n' \
-                       f'{extended_info["part1"]["weather_daypart_wind"]},\n' \
-                       f'{extended_info["part1"]["weather_daypart_direction"]},\n'
-    return response_message
+    snapshot, _, _ = get_snapshot(transliterated_city)
+    daypart = snapshot.today.parts[0]
+    return templates[lang]['daily'].render(
+        day_part=format_day_part(daypart.name, lang),
+        temp=format_temp_range(daypart.temp_min, daypart.temp_max),
+        condition=get_condition_name(daypart.condition, daypart.condition_code, lang),
+        wind=format_wind(daypart.wind_speed, daypart.wind_direction, lang),
+    )
 
 
 def get_phenomenon_info(user):
     """Handle phenomenon reminder (sending a reminder)"""
-    next_day_max_val = {'temp_min': None, 'temp_max': None, 'condition': [], 'wind': 0, 'humidity': 0}
-    user_id = user.id
     lang = user.language
-    all_phenomena = Phenomenon.query.filter_by(user_id=user_id).all()
-    next_day_info = get_next_day(user.city_name, lang, phenomenon_info=True)
-
-    for day_part_info in next_day_info.values():
-        temp = day_part_info['daypart_temp'].split('…')
-        temp_min = temp[0].replace('°', '')
-        try:
-            temp_max = temp[1].replace('°', '')
-        except IndexError as e:
-            logger.warning(f'Only one value\n{repr(e)}')
-            temp_max = temp_min
-
-        if next_day_max_val['temp_min'] is None:
-            next_day_max_val['temp_min'] = temp_min
-            next_day_max_val['temp_max'] = temp_max
-        else:
-            if temp_min < next_day_max_val['temp_min']:
-                next_day_max_val['temp_min'] = temp_min
-            elif temp_max > next_day_max_val['temp_max']:
-                next_day_max_val['temp_max'] = temp_max
-
-        condition = day_part_info['daypart_condition']  # condition
-        next_day_max_val['condition'] += [condition.lower()]
-
-        wind = float(day_part_info['daypart_wind'].replace(',', '.'))  # wind
-        if wind > next_day_max_val['wind']:
-            next_day_max_val['wind'] = wind
-
-        humidity = int(day_part_info['daypart_humidity'].replace('%', ''))  # humidity
-        if humidity > next_day_max_val['humidity']:
-            next_day_max_val['humidity'] = humidity
-
-    temp_min = next_day_max_val['temp_min']
-    temp_max = next_day_max_val['temp_max']
-    condition = next_day_max_val['condition']
-    wind = next_day_max_val['wind']
-    humidity = next_day_max_val['humidity']
-
-    text = ''
-    # checking if phenomena expected tomorrow
-    phenomena_list = [ph for ph in all_phenomena if ph.is_manually is False]
-    for phenomenon in phenomena_list:
-        existing_ph = phenomenon_button_names[phenomenon.phenomenon][lang].lower()
-        if existing_ph not in text and phenomenon.phenomenon in phenomenon_aliases.keys():
-            for cond in condition:
-                if cond in phenomenon_aliases[phenomenon.phenomenon][lang]:
-                    text += f'\n{cond.capitalize()}'
-                    break
-            continue
-        elif existing_ph == phenomenon_button_names["strong wind"][lang].lower():
-            if 29 >= wind >= 12:
-                val_and_unit = f'{wind} {info[lang][10]}'
-                pass
-            else:
-                continue
-        elif existing_ph == phenomenon_button_names["hurricane"][lang].lower():
-            if wind >= 30:
-                val_and_unit = f'{wind} {info[lang][10]}'
-                pass
-            else:
-                continue
-        elif existing_ph == phenomenon_button_names["intense heat"][lang].lower():
-            if int(temp_max) >= 30:
-                val_and_unit = f'+{temp_max}°C'
-                pass
-            else:
-                continue
-        else:
-            continue
-        text += f'\n{existing_ph.capitalize()} {val_and_unit}'
-
-    # checking if manual phenomena expected tomorrow
-    man_phenomena_list = [ph for ph in all_phenomena if ph.is_manually is True]
-    for man_ph in man_phenomena_list:
-        ph = phenomenon_button_names[man_ph.phenomenon][lang].lower()
-        val = int(man_ph.value)
-        if ph == phenomenon_button_names['temperature more'][lang].lower() \
-                or ph == phenomenon_button_names['temperature less'][lang].lower():
-            if ph == phenomenon_button_names['temperature more'][lang].lower():
-                if val <= int(temp_max):
-                    pass
-                else:
-                    continue
-            elif ph == phenomenon_button_names['temperature less'][lang].lower():
-                if val >= int(temp_min):
-                    pass
-                else:
-                    continue
-            if '°C' not in text:
-                if temp_min != temp_max:
-                    val_and_unit = f'{temp_min}°C...{temp_max}°C'
-                else:
-                    val_and_unit = f'{temp_min}°C'
-            else:
-                continue
-            ph = info[lang][11]
-        elif ph == phenomenon_button_names['wind speed'][lang].lower():
-            if val <= wind:
-                val_and_unit = f'{wind} {info[lang][10]}'
-                pass
-            else:
-                continue
-        elif ph == phenomenon_button_names['humidity'][lang].lower():
-            if val <= humidity:
-                val_and_unit = f'{humidity}%'
-                pass
-            else:
-                continue
-        else:
-            continue
-
-        text += f'\n{ph.capitalize()}: {val_and_unit}'
+    rules = get_rules(user.id, lang)
+    transliterated_city = transliterate_name(user.city_name)
+    snapshot, _, as_of = get_snapshot(transliterated_city)
 
+    text = rules.evaluate(transliterated_city, snapshot.tomorrow)
     if text:
-        response_msg = f'<b>{hints["phenomenon tomorrow"][lang]}</b>'
-        response_msg += text
-        return response_msg
+        return templates[lang]['phenomenon'].render(text=text) + format_as_of(as_of, lang)
     else:
         return None
+
+
+def format_forecast_change(last_forecast, forecast, phenomena, lang):
+    """return the alert of the day parts of tomorrow whose temperature, wind or condition differ from the last
+    forecast, followed by the phenomena expected. None if none of them has changed
+    """
+    day_part_template = templates[lang]['forecast change day part']
+    change_template = templates[lang]['change']
+    last_parts = {daypart.name: daypart for daypart in last_forecast.parts[:4]}
+    day_parts = ''
+    for daypart in forecast.parts[:4]:
+        last = last_parts.get(daypart.name)
+        if last is None:
+            continue
+        changes = [change_template.render(old=old, new=new) for old, new in (
+            (format_temp_range(last.temp_min, last.temp_max), format_temp_range(daypart.temp_min, daypart.temp_max)),
+            (format_wind(last.wind_speed, last.wind_direction, lang),
+             format_wind(daypart.wind_speed, daypart.wind_direction, lang)),
+            (get_condition_name(last.condition, last.condition_code, lang),
+             get_condition_name(daypart.condition, daypart.condition_code, lang)),
+        ) if old != new]
+        if changes:
+            day_parts += day_part_template.render(day_part=format_day_part_title(daypart.name, lang),
+                                                  changes='; '.join(changes))
+    if not day_parts:
+        return None
+    return templates[lang]['forecast change'].render(day_parts=day_parts, phenomena=phenomena)
+
+
+def format_time(hours, minutes):
+    """7, 0 -> '07:00'"""
+    return f'{hours:02d}:{minutes:02d}'
+
+
+def get_settings_info(reminders, phenomena, manual_phenomena, phenomenon_reminder, lang):
+    """Handle button 'info': the daily reminders, the phenomena and the phenomenon reminder of the user"""
+    line_template = templates[lang]['line']
+    not_set = templates[lang]['not set'].render()
+
+    manual_template = templates[lang]['manual phenomenon']
+    units = {'wind speed': f' {labels[lang]["M_S"]}', 'humidity': '%'}  # the other ones are temperatures
+    manual_lines = [manual_template.render(name=phenomenon_button_names[phenomenon.phenomenon][lang],
+                                           value=str(phenomenon.value),
+                                           unit=units.get(phenomenon.phenomenon, '°C'))
+                    for phenomenon in manual_phenomena]
+
+    return templates[lang]['settings'].render(
+        reminders=''.join(line_template.render(text=format_time(reminder.hours, reminder.minutes))
+                          for reminder in reminders) or not_set,
+        phenomena=''.join(line_template.render(text=phenomenon_button_names[phenomenon.phenomenon][lang])
+                          for phenomenon in phenomena) or not_set,
+        manual_phenomena=''.join(manual_lines) or not_set,
+        phenomenon_time=format_time(phenomenon_reminder.hours, phenomenon_reminder.minutes)
+        if phenomenon_reminder is not None else not_set,
+    )
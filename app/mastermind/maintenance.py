@@ -0,0 +1,78 @@
+import os
+
+from sqlalchemy import Column, MetaData, String, Table
+
+from app import db, logger
+from app.mastermind.alerts import invalidate_rules
+from app.mastermind.conversation import expired_steps
+from app.metrics import Counter
+from app.models import Conversation, User, Reminder, Phenomenon
+
+MAINTENANCE_INTERVAL = int(os.getenv('MAINTENANCE_INTERVAL', 3600))  # seconds
+MAINTENANCE_BATCH_SIZE = int(os.getenv('MAINTENANCE_BATCH_SIZE', 500))  # rows deleted per transaction
+
+maintenance_deleted = Counter('weatherbot_maintenance_deleted_total', 'Rows deleted by the maintenance job', ['kind'])
+
+# jobs of the APScheduler job store reminders were kept in before the timing wheel, nothing reads them anymore
+apscheduler_jobs = Table('apscheduler_jobs', MetaData(), Column('id', String(191), primary_key=True))
+
+
+def delete_in_batches(id_query, id_column, batch_size):
+    """delete the rows whose ids `id_query` returns, `batch_size` rows per transaction. Return the deleted ids"""
+    deleted = []
+    while True:
+        ids = [row_id for row_id, in id_query.limit(batch_size)]
+        if not ids:
+            break
+        db.session.query(id_column.class_).filter(id_column.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted.extend(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+def delete_apscheduler_jobs(batch_size):
+    if not db.engine.dialect.has_table(db.engine, apscheduler_jobs.name):
+        return 0
+    deleted = 0
+    while True:
+        ids = [job_id for job_id, in db.session.execute(apscheduler_jobs.select().limit(batch_size))]
+        if not ids:
+            break
+        db.session.execute(apscheduler_jobs.delete().where(apscheduler_jobs.c.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            break
+    return deleted
+
+
+def clean_up(batch_size=MAINTENANCE_BATCH_SIZE):
+    """delete reminders without a time, reminders and phenomena of deleted users, expired conversation steps
+    and leftover APScheduler jobs.
+    Return ({kind: number of deleted rows}, ids of the deleted reminders)
+    """
+    incomplete_ids = delete_in_batches(Reminder.incomplete().with_entities(Reminder.id), Reminder.id, batch_size)
+    orphaned_ids = delete_in_batches(
+        db.session.query(Reminder.id).outerjoin(User, Reminder.user_id == User.id).filter(User.id.is_(None)),
+        Reminder.id, batch_size)
+    orphaned_query = db.session.query(Phenomenon.id).outerjoin(User, Phenomenon.user_id == User.id) \
+        .filter(User.id.is_(None))
+    orphaned_users = [user_id for user_id, in orphaned_query.with_entities(Phenomenon.user_id).distinct()]
+    orphaned_phenomena = delete_in_batches(orphaned_query, Phenomenon.id, batch_size)
+    for user_id in orphaned_users:
+        invalidate_rules(user_id)
+
+    report = {
+        'incomplete reminders': len(incomplete_ids),
+        'orphaned reminders': len(orphaned_ids),
+        'orphaned phenomena': len(orphaned_phenomena),
+        'expired conversations': len(delete_in_batches(expired_steps(), Conversation.chat_id, batch_size)),
+        'apscheduler jobs': delete_apscheduler_jobs(batch_size),
+    }
+    for kind, count in report.items():
+        if count:
+            maintenance_deleted.inc(kind, amount=count)
+    logger.info(f'Maintenance: {", ".join(f"{count} {kind}" for kind, count in report.items())} deleted')
+    return report, incomplete_ids + orphaned_ids
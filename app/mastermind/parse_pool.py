@@ -0,0 +1,78 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import logger
+from app.logs import LOG_FORMAT
+from app.metrics import Counter
+
+parse_fallbacks = Counter('weatherbot_parse_fallback_total',
+                          'Pages parsed in the calling thread instead of the parse processes', ['reason'])
+
+
+def init_worker(warm_up):
+    """log warnings to stderr (the queue of the parent is not read in the worker) and warm the parsers up"""
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logging.getLogger().handlers[:] = [handler]
+    if warm_up is not None:
+        warm_up()
+
+
+class ParsePool:
+    """runs CPU-bound parsing in `workers` processes, so the threads serving requests do not wait for the GIL.
+    The processes are started and warmed up with `warm_up` when the pool is created.
+    At most `queue_size` pages wait for a process, further pages are parsed in the calling thread, and so are the
+    pages of a broken pool (a killed process), which is restarted for the next ones.
+    Functions and their arguments and results are pickled, so they have to be module level functions and records
+    """
+
+    def __init__(self, workers, queue_size, start_method, warm_up=None):
+        self.workers = workers
+        self.warm_up = warm_up
+        self.pending = 0  # pages submitted and not parsed yet
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._executor = self._start()
+
+    def _start(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                       initializer=init_worker, initargs=(self.warm_up,))
+        for future in [executor.submit(int) for _ in range(self.workers)]:
+            future.result()  # every process is started before the first page
+        return executor
+
+    def run(self, function, *args):
+        """return function(*args), computed in a process unless the queue is full or the pool is broken"""
+        if not self._slots.acquire(blocking=False):
+            parse_fallbacks.inc('queue full')
+            return function(*args)
+        with self._lock:
+            self.pending += 1
+        executor = self._executor
+        try:
+            return executor.submit(function, *args).result()
+        except BrokenProcessPool as e:
+            logger.error(f'Parse processes have failed\n{repr(e)}')
+            parse_fallbacks.inc('broken pool')
+            self._restart(executor)
+            return function(*args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def _restart(self, broken):
+        with self._restart_lock:
+            if self._executor is not broken:
+                return  # restarted by another thread
+            broken.shutdown(wait=False)
+            self._executor = self._start()
+
+    def shutdown(self):
+        self._executor.shutdown()
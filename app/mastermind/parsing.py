@@ -1,16 +1,127 @@
+import codecs
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
 import requests
 from bs4 import BeautifulSoup
 
 from app import logger
-from app.data.localization import info
+from app.credentials import WEATHER_URL
+from app.metrics import Gauge, parse_seconds, unchanged_pages, upstream_seconds
+from app.mastermind.caching import LruCache
+from app.mastermind.conditions import collect_unknown_conditions, count_unknown_conditions
+from app.mastermind.parse_pool import ParsePool
+from app.mastermind.records import CitySnapshot, CurrentWeather, DayForecast, DayPart, parse_city, parse_duration, \
+    parse_humidity, parse_month, parse_temp, parse_temp_range, parse_wind_speed
+
+DETAILS_CHUNK_SIZE = 16 * 1024
+PAGE_WORKERS = int(os.getenv('PAGE_WORKERS', 8))  # /pogoda pages downloaded while /details is parsed
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 5))  # seconds to connect and between received bytes
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', 0))  # processes parsing the pages, 0 parses them in the threads
+PARSE_QUEUE_SIZE = int(os.getenv('PARSE_QUEUE_SIZE', 32))  # pages waiting for a process, more are parsed in the thread
+PARSE_START_METHOD = os.getenv('PARSE_START_METHOD', 'fork')  # 'spawn' re-imports the main module in the processes
+PAGE_CACHE_SIZE = int(os.getenv('PAGE_CACHE_SIZE', 4096))  # pages whose hash and parsed records are kept
+WEATHER_DOMAIN = 'com'  # the pages are read in english whatever the language of the user
+
+weather_url = WEATHER_URL.format(WEATHER_DOMAIN)
+
+void_elements = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+
+
+page_executor = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix='page')
+
+# parsed pages keyed by (page, city name, *parse arguments)
+parsed_pages = LruCache(PAGE_CACHE_SIZE)
+Gauge('weatherbot_parsed_pages', 'Parsed weather pages kept to skip parsing them again', func=lambda: len(parsed_pages))
+
+
+class UpstreamBlocked(requests.RequestException):
+    """the weather website answered with a captcha instead of the page"""
+
 
+def check_response(source):
+    """raise for the answers of an overloaded or blocking website, a missing city is left to the parser"""
+    if 'showcaptcha' in source.url:
+        raise UpstreamBlocked(f'Captcha instead of {source.request.url}', response=source)
+    if source.status_code == 429 or source.status_code >= 500:
+        source.raise_for_status()
 
-def get_weather_info(city_name, lang):
+
+class ParsedPage:
+    """records parsed from a page with its validators and the hash of the first `size` bytes (the whole body if None)"""
+    __slots__ = ('etag', 'last_modified', 'digest', 'size', 'result')
+
+    def __init__(self, source, digest, size, result):
+        self.etag = source.headers.get('ETag')
+        self.last_modified = source.headers.get('Last-Modified')
+        self.digest = digest
+        self.size = size
+        self.result = result
+
+
+def get_digest(content):
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def get_conditional_headers(parsed_page):
+    """return the headers asking the website to answer 304 Not Modified if the page has not changed"""
+    headers = {}
+    if parsed_page is not None:
+        if parsed_page.etag:
+            headers['If-None-Match'] = parsed_page.etag
+        if parsed_page.last_modified:
+            headers['If-Modified-Since'] = parsed_page.last_modified
+    return headers
+
+
+def get_parsed_page(key, url, function, *args):
+    """download the page and return function(body, *args).
+    The result of the last download is returned without parsing if the website answers 304 Not Modified
+    or the body has the same hash
+    """
+    page = key[0]
+    parsed_page = parsed_pages.get(key)
+    with upstream_seconds.time(page):
+        source = requests.get(url, headers=get_conditional_headers(parsed_page), timeout=UPSTREAM_TIMEOUT)
+    check_response(source)
+
+    if parsed_page is not None and source.status_code == 304:
+        unchanged_pages.inc(page, 'not modified')
+        return parsed_page.result
+    digest = get_digest(source.content)
+    if parsed_page is not None and parsed_page.digest == digest and parsed_page.size is None:
+        unchanged_pages.inc(page, 'same hash')
+        parsed_pages.set(key, ParsedPage(source, digest, None, parsed_page.result))  # new validators
+        return parsed_page.result
+
+    with parse_seconds.time(page):
+        result = parse(function, source.content, *args)
+    parsed_pages.set(key, ParsedPage(source, digest, None, result))
+    return result
+
+
+def parse(function, *args):
+    """return function(*args) computed in the parse processes if there are any"""
+    if parse_pool is None:
+        return function(*args)
+    result, conditions = parse_pool.run(collect_unknown_conditions, function, *args)
+    count_unknown_conditions(conditions)
+    return result
+
+
+def get_weather_info(city_name):
     """return the current weather info"""
-    url_ending = 'ru' if lang == 'ru' else 'com'
-    source = requests.get(f'https://yandex.{url_ending}/pogoda/{city_name}')
+    return get_parsed_page(('now', city_name), f'{weather_url}/pogoda/{city_name}', parse_weather_page)
+
 
-    soup = BeautifulSoup(source.content, 'html.parser')
+def parse_weather_page(content):
+    """return CurrentWeather of the /pogoda page"""
+    soup = BeautifulSoup(content, 'html.parser')
     weather_soup = soup.find('div', attrs={'class': 'fact'})
 
     header = weather_soup.find('div', attrs={'class': 'header-title'})
@@ -19,14 +130,17 @@ def get_weather_info(city_name, lang):
     temperature = weather_soup.find('div', attrs={'class': 'fact__temp-wrap'})
     temperature = temperature.find(attrs={'class': 'temp__value'}).text
 
-    wind_speed_and_direction = weather_soup.find('div', attrs={'class': 'fact__props'})
+    wind_soup = weather_soup.find('div', attrs={'class': 'fact__props'})
     try:
-        wind_speed = wind_speed_and_direction.find('span', attrs={'class': 'wind-speed'}).text  # wind speed
-        wind_direction = wind_speed_and_direction.find('span', attrs={'class': 'fact__unit'}).text  # wind unit, direct
-        wind_speed_and_direction = f"{wind_speed} {wind_direction}"
+        wind_speed = wind_soup.find('span', attrs={'class': 'wind-speed'}).text  # wind speed
+        wind_unit = wind_soup.find('span', attrs={'class': 'fact__unit'}).text  # wind unit, direction
     except AttributeError as e:
         logger.warning(f'No wind\n{repr(e)}')
-        wind_speed_and_direction = info[lang][7]
+        wind_speed = None
+        wind_direction = ''
+    else:
+        wind_speed = parse_wind_speed(wind_speed)
+        wind_direction = wind_unit.split(', ')[-1] if ', ' in wind_unit else ''
 
     humidity = weather_soup.find('div', attrs={'class': 'fact__humidity'})
     humidity = humidity.find('div', attrs={'class': 'term__value'}).text  # humidity percentage
@@ -43,125 +157,290 @@ def get_weather_info(city_name, lang):
     sunrise = daylight_soup.find('div', attrs={'class': 'sun-card__sunrise-sunset-info_value_rise-time'}).text[-5:]
     sunset = daylight_soup.find('div', attrs={'class': 'sun-card__sunrise-sunset-info_value_set-time'}).text[-5:]
 
-    response_message = {
-        'header': header,
-        'temperature': temperature,
-        'wind_speed_and_direction': wind_speed_and_direction,
-        'humidity': humidity,
-        'condition': condition,
-        'feels_like': feels_like,
-        'daylight_hours': daylight_hours,
-        'sunrise': sunrise,
-        'sunset': sunset,
-    }
-    return response_message
-
-
-def get_day_info(weather_rows, unit, lang):
-    """Parse day parts of the extended info"""
-    daypart_dict = dict()
-    row_count = 0
-    for row in weather_rows:
-        weather_daypart = row.find('div', attrs={'class': 'weather-table__daypart'}).text
-        weather_daypart_temp = row.find('div', attrs={'class': 'weather-table__temp'}).text
-        weather_daypart_humidity = row.find('td', attrs={
-            'class': 'weather-table__body-cell weather-table__body-cell_type_humidity'}).text
-        weather_daypart_condition = row.find('td', attrs={'class': 'weather-table__body-cell_type_condition'}).text
-        try:
-            weather_daypart_wind = row.find('span', attrs={'class': 'weather-table__wind'}).text
-            weather_unit = unit
-            weather_daypart_direction = row.find('abbr', attrs={'class': 'icon-abbr'}).text
-            wind_speed_and_direction = f'{weather_daypart_wind} {weather_unit}, {weather_daypart_direction}'
-        except AttributeError as e:
-            logger.warning(f'No wind\n{repr(e)}')
-            wind_speed_and_direction = info[lang][7]
-
-        temp_daypart_dict = {
-            'weather_daypart': weather_daypart,
-            'weather_daypart_temp': weather_daypart_temp,
-            'weather_daypart_humidity': weather_daypart_humidity,
-            'weather_daypart_condition': weather_daypart_condition,
-            'wind_speed_and_direction': wind_speed_and_direction,
-        }
-        row_count += 1
-        daypart_dict['part' + str(row_count)] = temp_daypart_dict
-    return daypart_dict
-
-
-def _get_extended_info_soup(city_name, lang):
-    url_ending = 'ru' if lang == 'ru' else 'com'
-    source = requests.get(f'https://yandex.{url_ending}/pogoda/{city_name}/details')
-
-    soup = BeautifulSoup(source.content, 'html.parser')
-    weather_unit = info[lang][10]
-    return soup, weather_unit
-
-
-def _get_extended_info_for_day(soup, weather_table, weather_unit, lang):
-    weather_city = soup.find('h1', attrs={'class': 'title title_level_1 header-title__title'}).text
-    weather_city = weather_city.split()[-1]
-
-    daylight_soup = weather_table.find('div', attrs={'class': 'forecast-details__right-column'})
-    daylight_hours = daylight_soup.find('dl', attrs={
-        'class': 'sunrise-sunset__description sunrise-sunset__description_value_duration'})
-    daylight_hours = daylight_hours.find('dd', attrs={
-        'class': 'sunrise-sunset__value'}).text  # daylight duration
-    sunrise = daylight_soup.find('dl', attrs={
-        'class': 'sunrise-sunset__description sunrise-sunset__description_value_sunrise'}).text[-5:]
-    sunset = daylight_soup.find('dl', attrs={
-        'class': 'sunrise-sunset__description sunrise-sunset__description_value_sunset'}).text[-5:]
-
-    weather_day = weather_table.find('strong', attrs={'class': 'forecast-details__day-number'}).text
-    weather_month = weather_table.find('span', attrs={'class': 'forecast-details__day-month'}).text
-    weather_date = f'{weather_day} {weather_month}'
-    weather_rows = weather_table.find_all('tr', attrs={'class': 'weather-table__row'})
-
-    daypart_dict = get_day_info(weather_rows, weather_unit, lang)
-    daypart_dict['weather_date'] = weather_date
-    daypart_dict['weather_city'] = weather_city
-    daypart_dict['daylight_hours'] = daylight_hours
-    daypart_dict['sunrise'] = sunrise
-    daypart_dict['sunset'] = sunset
-
-    return daypart_dict
-    
-
-def get_extended_info_for_week(city_name, lang):
-    """return the extended weather info of the current day for daily cast.
-    Handling 'for a week' button
-    """
-    soup, weather_unit = _get_extended_info_soup(city_name, lang)
+    return CurrentWeather(
+        city=parse_city(header),
+        temperature=parse_temp(temperature),
+        feels_like=parse_temp(feels_like),
+        condition=condition,
+        wind_speed=wind_speed,
+        wind_direction=wind_direction,
+        humidity=parse_humidity(humidity),
+        daylight_minutes=parse_duration(daylight_hours),
+        sunrise=sunrise,
+        sunset=sunset,
+    )
+
 
-    days_dict = dict()
+class DetailsComplete(Exception):
+    """raised by DetailsParser once the last requested card has been parsed"""
+
+
+class DetailsParser(HTMLParser):
+    """Event-driven parser of the /details page.
+    Every card (one day of the forecast) becomes a DayForecast as soon as its closing tag is read
+    """
+    card_fields = {
+        ('strong', 'forecast-details__day-number'): 'day',
+        ('span', 'forecast-details__day-month'): 'month',
+        ('dl', 'sunrise-sunset__description_value_sunrise'): 'sunrise',
+        ('dl', 'sunrise-sunset__description_value_sunset'): 'sunset',
+    }
+    row_fields = {
+        ('div', 'weather-table__daypart'): 'name',
+        ('div', 'weather-table__temp'): 'temp',
+        ('td', 'weather-table__body-cell_type_humidity'): 'humidity',
+        ('td', 'weather-table__body-cell_type_condition'): 'condition',
+        ('span', 'weather-table__wind'): 'wind',
+        ('abbr', 'icon-abbr'): 'direction',
+    }
 
-    weather_tables = soup.find_all('div', attrs={'class': 'card'})[2:]
-    for day_count, weather_day in enumerate(weather_tables):
-        if day_count >= 7:  # output 7 days for the button 'for a week'
+    def __init__(self, first_card, last_card):
+        super().__init__()
+        self.first_card = first_card
+        self.last_card = last_card
+        self.days = []  # parsed (card index, DayForecast) not yet taken by pop_days
+        self._page = {}  # fields found outside of the cards
+        self._stack = []  # names of the open tags
+        self._captures = []  # [target dict, field, level, text parts]
+        self._card_count = 0
+        self._card = None
+        self._row = None
+        self._duration_level = None  # level of the open daylight duration description
+
+    def pop_days(self):
+        days, self.days = self.days, []
+        return days
+
+    def handle_starttag(self, tag, attrs):
+        if tag in void_elements:
+            return
+        self._stack.append(tag)
+        level = len(self._stack)
+
+        classes = ()
+        for name, value in attrs:
+            if name == 'class' and value:
+                classes = value.split()
+        if not classes:
+            return
+
+        if tag == 'h1' and 'header-title__title' in classes:
+            self._capture(self._page, 'city', level)
+        elif tag == 'div' and 'card' in classes:
+            index = self._card_count
+            self._card_count += 1
+            if self._card is None and self.first_card <= index <= self.last_card:
+                self._card = {'index': index, 'level': level, 'parts': []}
+            return
+
+        card = self._card
+        if card is None:
+            return
+        if tag == 'tr' and 'weather-table__row' in classes:
+            self._row = {'level': level}
+            return
+        if tag == 'dl' and 'sunrise-sunset__description_value_duration' in classes:
+            self._duration_level = level
+        elif tag == 'dd' and 'sunrise-sunset__value' in classes and self._duration_level is not None:
+            self._capture(card, 'daylight_hours', level)
+
+        if self._row is not None:
+            fields, target = self.row_fields, self._row
+        else:
+            fields, target = self.card_fields, card
+        for class_name in classes:
+            field = fields.get((tag, class_name))
+            if field is not None:
+                self._capture(target, field, level)
+
+    def handle_endtag(self, tag):
+        stack = self._stack
+        for idx in range(len(stack) - 1, -1, -1):
+            if stack[idx] == tag:
+                break
+        else:
+            return  # stray end tag
+        del stack[idx:]
+        self._close_elements(idx)
+
+    def handle_data(self, data):
+        for capture in self._captures:
+            capture[3].append(data)
+
+    def _capture(self, target, field, level):
+        if field not in target:  # the first matching element wins, like soup.find
+            self._captures.append([target, field, level, []])
+
+    def _close_elements(self, level):
+        """finish everything opened deeper than `level`"""
+        if self._captures:
+            captures = []
+            for capture in self._captures:
+                if capture[2] > level:
+                    capture[0][capture[1]] = ''.join(capture[3])
+                else:
+                    captures.append(capture)
+            self._captures = captures
+        if self._duration_level is not None and self._duration_level > level:
+            self._duration_level = None
+        if self._row is not None and self._row['level'] > level:
+            self._card['parts'].append(self._get_day_part(self._row))
+            self._row = None
+        if self._card is not None and self._card['level'] > level:
+            card, self._card = self._card, None
+            if 'day' in card:  # skip cards which are not a forecast
+                self.days.append((card['index'], self._get_day_forecast(card)))
+            if card['index'] >= self.last_card:
+                raise DetailsComplete
+
+    def _get_day_forecast(self, card):
+        return DayForecast(
+            city=parse_city(self._page.get('city', '')),
+            day=int(card['day']),
+            month=parse_month(card['month']),
+            daylight_minutes=parse_duration(card['daylight_hours']) if 'daylight_hours' in card else None,
+            sunrise=card.get('sunrise', '')[-5:],
+            sunset=card.get('sunset', '')[-5:],
+            parts=card['parts'],
+        )
+
+    @staticmethod
+    def _get_day_part(row):
+        if 'wind' in row:
+            wind_speed = parse_wind_speed(row['wind'])
+            wind_direction = row.get('direction', '')
+        else:
+            logger.warning('No wind')
+            wind_speed = None
+            wind_direction = ''
+
+        temp_min, temp_max = parse_temp_range(row['temp'])
+        return DayPart(
+            name=row['name'].strip(),
+            temp_min=temp_min,
+            temp_max=temp_max,
+            condition=row['condition'].strip(),
+            wind_speed=wind_speed,
+            wind_direction=wind_direction,
+            humidity=parse_humidity(row['humidity']),
+        )
+
+
+def read_prefix(chunks, size):
+    """return (the first `size` bytes of the chunks, the rest of the last chunk read), all of them if `size` is None"""
+    parts = []
+    length = 0
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk)
+        if size is not None and length >= size:
             break
+    content = b''.join(parts)
+    if size is None:
+        return content, b''
+    return content[:size], content[size:]
 
-        daypart_dict = _get_extended_info_for_day(soup, weather_day, weather_unit, lang)
-        days_dict['day' + str(day_count)] = daypart_dict
 
-    try:
-        days_dict['weather_city'] = days_dict['day0']['weather_city']
-    except KeyError:
-        days_dict['weather_city'] = ''
+def iter_extended_info(city_name, first_card, last_card):
+    """yield (card index, DayForecast) of the /details page one day at a time.
+    The page is not downloaded and parsed any further once the last requested card is complete.
+    If the page has been parsed before, the part of it that was parsed is downloaded first and the days
+    found in it are yielded without parsing it again when its hash has not changed
+    """
+    key = ('details', city_name, first_card, last_card)
+    parsed_page = parsed_pages.get(key)
+    parser = DetailsParser(first_card, last_card)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    days = []
+    is_complete = False
+
+    download_time = parse_time = 0.0
+    start = time.perf_counter()
+    url = f'{weather_url}/pogoda/{city_name}/details'
+    headers = get_conditional_headers(parsed_page)
+    with requests.get(url, headers=headers, stream=True, timeout=UPSTREAM_TIMEOUT) as source:
+        check_response(source)
+        chunks = source.iter_content(chunk_size=DETAILS_CHUNK_SIZE)
+        if parsed_page is not None:
+            if source.status_code == 304:
+                check = 'not modified'
+            else:
+                prefix, rest = read_prefix(chunks, parsed_page.size)
+                is_same = parsed_page.size is None or len(prefix) == parsed_page.size
+                check = 'same hash' if is_same and get_digest(prefix) == parsed_page.digest else None
+                chunks = itertools.chain((prefix, rest), chunks)
+            if check is not None:
+                upstream_seconds.observe(time.perf_counter() - start, 'details')
+                unchanged_pages.inc('details', check)
+                parsed_pages.set(key, ParsedPage(source, parsed_page.digest, parsed_page.size, parsed_page.result))
+                yield from parsed_page.result
+                return
 
-    return days_dict
+        try:
+            for chunk in chunks:
+                parse_start = time.perf_counter()
+                download_time += parse_start - start
+                digest.update(chunk)
+                size += len(chunk)
+                try:
+                    parser.feed(decoder.decode(chunk))
+                finally:
+                    parse_time += time.perf_counter() - parse_start
+                for day in parser.pop_days():
+                    days.append(day)
+                    yield day
+                start = time.perf_counter()
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+        except DetailsComplete:
+            is_complete = True
+        finally:
+            upstream_seconds.observe(download_time, 'details')
+            parse_seconds.observe(parse_time, 'details')
+    rest = parser.pop_days()
+    days.extend(rest)
+    # the days depend on the bytes read until the last card, or on the whole page if it has ended before it
+    parsed_pages.set(key, ParsedPage(source, digest.digest(), size if is_complete else None, tuple(days)))
+    yield from rest
+
+
+def parse_details_page(content, first_card, last_card):
+    """return [(card index, DayForecast)] of the whole /details page"""
+    parser = DetailsParser(first_card, last_card)
+    try:
+        parser.feed(content.decode('utf-8', errors='replace'))
+        parser.close()
+    except DetailsComplete:
+        pass
+    return parser.pop_days()
 
 
-def get_extended_info(city_name, command, lang):
-    """return the extended weather info of the current day for daily cast.
-    Handling 'daily', 'tomorrow', 'today' buttons
+def get_extended_info(city_name, first_card, last_card):
+    """return [(card index, DayForecast)] of the /details page.
+    Without parse processes the page is parsed while it is downloaded, otherwise it is downloaded and then
+    parsed in a process
     """
-    soup, weather_unit = _get_extended_info_soup(city_name, lang)
+    if parse_pool is None:
+        return list(iter_extended_info(city_name, first_card, last_card))
+    return get_parsed_page(('details', city_name, first_card, last_card), f'{weather_url}/pogoda/{city_name}/details',
+                           parse_details_page, first_card, last_card)
+
+
+def get_city_snapshot(city_name):
+    """return the CitySnapshot of the city, the /pogoda page is downloaded while /details is being parsed"""
+    current = page_executor.submit(get_weather_info, city_name)
+    days = get_extended_info(city_name, CitySnapshot.today_card, CitySnapshot.week_cards[-1])
+    return CitySnapshot(current.result(), days)
+
+
+def warm_up():
+    """import and run the parsers once in a new parse process"""
+    parse_details_page(b'<div class="card"></div>', 0, 0)
+    BeautifulSoup(b'<div class="fact"></div>', 'html.parser')
 
-    if command == 'daily':  # button daily
-        weather_table = soup.find('div', attrs={'class': 'card'})
-    elif command == 'tomorrow':  # button tomorrow
-        weather_table = soup.find_all('div', attrs={'class': 'card'})[2]
-    else:
-        weather_table = soup.find_all('div', attrs={'class': 'card'})[0]
 
-    daypart_dict = _get_extended_info_for_day(soup, weather_table, weather_unit, lang)
-    return daypart_dict
+parse_pool = ParsePool(PARSE_WORKERS, PARSE_QUEUE_SIZE, PARSE_START_METHOD, warm_up) if PARSE_WORKERS else None
+Gauge('weatherbot_parse_pending', 'Pages waiting for or being parsed in the parse processes',
+      func=lambda: parse_pool.pending if parse_pool is not None else 0)
@@ -0,0 +1,48 @@
+import os
+
+from app import db
+from app.mastermind.caching import get_cache, register_type
+from app.metrics import Gauge
+from app.models import User
+
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', 10000))
+QUERY_CHUNK_SIZE = 500  # ids per query, SQLite takes at most 999 parameters
+
+profiles = get_cache('profile', PROFILE_CACHE_SIZE)  # user id -> Profile
+Gauge('weatherbot_profile_cache_size', 'User profiles in the cache', func=lambda: len(profiles))
+
+
+@register_type
+class Profile:
+    """the settings of a user the reminders are sent with"""
+    __slots__ = ('id', 'chat_id', 'city_name', 'language')
+
+    def __init__(self, id, chat_id, city_name, language):
+        self.id = id
+        self.chat_id = chat_id
+        self.city_name = city_name
+        self.language = language
+
+
+def get_profiles(user_ids):
+    """return {user id: Profile}, the users missing from the cache are read in bulk. Deleted users are left out"""
+    found = profiles.get_many(user_ids)
+    missing_ids = [user_id for user_id in set(user_ids) if user_id not in found]
+    for start in range(0, len(missing_ids), QUERY_CHUNK_SIZE):
+        rows = db.session.query(User.id, User.chat_id, User.city_name, User.language) \
+            .filter(User.id.in_(missing_ids[start:start + QUERY_CHUNK_SIZE])).all()
+        loaded = {row.id: Profile(*row) for row in rows}
+        profiles.set_many(loaded)
+        found.update(loaded)
+    return found
+
+
+def get_profile(user_id):
+    return get_profiles([user_id]).get(user_id)
+
+
+def invalidate_profile(user_id):
+    """forget the cached profile of the user, call it after changing the city or the language of the user.
+    Other processes may serve the old one for up to CACHE_NEAR_TTL seconds
+    """
+    profiles.pop(user_id)
@@ -0,0 +1,160 @@
+import re
+
+from app.mastermind.caching import register_type
+from app.mastermind.conditions import normalize_condition
+
+daylight_parts = ('morning', 'day')
+month_numbers = {name: number for number, name in enumerate(
+    ('january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october', 'november',
+     'december'), 1)}
+
+
+class Record:
+    """base class for slotted forecast records, compared by field values"""
+    __slots__ = ()
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+
+@register_type
+class DayPart(Record):
+    """one row of the extended forecast table (morning, day, evening, night).
+    The records hold the english values of the website, they are translated when a reply is rendered
+    """
+    __slots__ = ('name', 'is_daylight', 'temp_min', 'temp_max', 'condition', 'condition_code',
+                 'wind_speed', 'wind_direction', 'humidity')
+
+    def __init__(self, name, temp_min, temp_max, condition, wind_speed, wind_direction, humidity):
+        self.name = name.lower()
+        self.is_daylight = self.name in daylight_parts
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.condition = condition
+        self.condition_code = normalize_condition(condition)
+        self.wind_speed = wind_speed  # None when calm
+        self.wind_direction = wind_direction
+        self.humidity = humidity
+
+
+@register_type
+class DayForecast(Record):
+    """extended forecast of a single day"""
+    __slots__ = ('city', 'day', 'month', 'daylight_minutes', 'sunrise', 'sunset', 'parts')
+
+    def __init__(self, city, day, month, daylight_minutes, sunrise, sunset, parts):
+        self.city = city
+        self.day = day
+        self.month = month
+        self.daylight_minutes = daylight_minutes  # None when missing
+        self.sunrise = sunrise
+        self.sunset = sunset
+        self.parts = tuple(parts)
+
+    @property
+    def date(self):
+        return self.month, self.day
+
+
+@register_type
+class CurrentWeather(Record):
+    """current weather conditions"""
+    __slots__ = ('city', 'temperature', 'feels_like', 'condition', 'condition_code', 'wind_speed',
+                 'wind_direction', 'humidity', 'daylight_minutes', 'sunrise', 'sunset')
+
+    def __init__(self, city, temperature, feels_like, condition, wind_speed, wind_direction, humidity,
+                 daylight_minutes, sunrise, sunset):
+        self.city = city
+        self.temperature = temperature
+        self.feels_like = feels_like
+        self.condition = condition
+        self.condition_code = normalize_condition(condition)
+        self.wind_speed = wind_speed  # None when calm
+        self.wind_direction = wind_direction
+        self.humidity = humidity
+        self.daylight_minutes = daylight_minutes
+        self.sunrise = sunrise
+        self.sunset = sunset
+
+
+@register_type
+class CitySnapshot(Record):
+    """everything known about the weather of a city from one fetch of the /pogoda and /details pages, in any language.
+    `days` are (card index, DayForecast) of the /details cards, the views are projections of it
+    """
+    __slots__ = ('current', 'days')
+
+    today_card = 0
+    tomorrow_card = 2  # the second card is not a forecast
+    week_cards = range(2, 9)
+
+    def __init__(self, current, days):
+        self.current = current
+        self.days = tuple(days)
+
+    def get_day(self, card):
+        for index, day in self.days:
+            if index == card:
+                return day
+        raise IndexError(f'No forecast card {card}')
+
+    @property
+    def today(self):
+        return self.get_day(self.today_card)
+
+    @property
+    def tomorrow(self):
+        return self.get_day(self.tomorrow_card)
+
+    @property
+    def week(self):
+        return [day for index, day in self.days if index in self.week_cards]
+
+
+def parse_temp(text):
+    """'+5°' -> 5, '−3' -> -3"""
+    return int(text.replace('°', '').replace('−', '-').strip())
+
+
+def parse_temp_range(text):
+    """'+5°…+7°' -> (5, 7), '+5°' -> (5, 5)"""
+    values = text.split('…')
+    temp_min = parse_temp(values[0])
+    temp_max = parse_temp(values[-1])
+    return temp_min, temp_max
+
+
+def parse_wind_speed(text):
+    """'4,5' -> 4.5"""
+    return float(text.replace(',', '.').strip())
+
+
+def parse_humidity(text):
+    """'81%' -> 81"""
+    return int(text.replace('%', '').strip())
+
+
+def parse_duration(text):
+    """'10 h 31 min' -> 631 (minutes)"""
+    hours, minutes = re.findall(r'\d+', text)[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_month(text):
+    """'October' -> 10"""
+    return month_numbers[text.strip().lower()]
+
+
+def parse_city(text):
+    """'Weather in Moscow' -> 'Moscow'"""
+    return text.rpartition(' in ')[2].strip()
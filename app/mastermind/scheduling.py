@@ -1,58 +1,428 @@
+import fcntl
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-import pytz
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
+from app import bot, db, logger, server, sharding
+from app.metrics import Gauge, scheduler_jobs, scheduler_lag_seconds, scheduler_running, scheduler_slot_seconds
+from app.profiling import profiled
+from app.mastermind.alerts import CHANGE_ALERT, get_rules
+from app.mastermind.broadcast import BROADCAST_LEASE, resume_broadcasts
+from app.mastermind.forecast import get_snapshot, prefetch
+from app.mastermind.formating import TIME_ZONE_MSK, format_forecast_change, get_today_weather_info, \
+    get_phenomenon_info, transliterate_name
+from app.mastermind.maintenance import MAINTENANCE_INTERVAL, clean_up
+from app.mastermind.profiles import QUERY_CHUNK_SIZE, get_profile, get_profiles
+from app.mastermind.timing_wheel import TimingWheel, get_minute_of_day
+from app.models import User, Reminder, Phenomenon
 
-from app import bot, db
-from app.mastermind.formating import get_today_weather_info, get_phenomenon_info
-from app.models import User, Reminder
+REMINDER_RESYNC_INTERVAL = int(os.getenv('REMINDER_RESYNC_INTERVAL', 3600))  # seconds between reloads of the table
+REMINDER_MISFIRE_GRACE = int(os.getenv('REMINDER_MISFIRE_GRACE', 5))  # minutes a late tick still catches up
+ALERT_CHECK_INTERVAL = int(os.getenv('ALERT_CHECK_INTERVAL', 600))  # seconds between checks of tomorrow's forecasts
+REMINDER_WORKERS = int(os.getenv('REMINDER_WORKERS', 16))  # reminders sent concurrently
+REMINDER_QUEUE_SIZE = int(os.getenv('REMINDER_QUEUE_SIZE', 1000))  # reminders waiting for a worker
+REMINDER_POLL_OVERLAP = int(os.getenv('REMINDER_POLL_OVERLAP', 200))  # ids below the highest one read again by a poll
+DYNO = os.getenv('DYNO')  # set by Heroku, e.g. 'web.2'
+# one process of the host holding the lock of this file sends the reminders and runs the periodic tasks
+SCHEDULER_LOCK_PATH = os.getenv('SCHEDULER_LOCK_PATH', os.path.join(tempfile.gettempdir(), 'weatherbot-scheduler.lock'))
 
-TIME_ZONE_MSK = pytz.timezone('Europe/Moscow')
 
-jobstores = {
-    'default': SQLAlchemyJobStore(url=os.getenv("DATABASE_URL"))
-}
-scheduler = BackgroundScheduler()
-scheduler.configure(jobstores=jobstores, timezone=TIME_ZONE_MSK)
-if scheduler.state == 0:
-    scheduler.start()
+class ReminderDispatcher:
+    """sends reminders on a pool of `workers` threads.
+    Every reminder runs in its own app context, so it gets a fresh database session that is removed afterwards,
+    and a failing reminder is only counted and logged. Submitting blocks while `queue_size` reminders are waiting
+    """
+
+    def __init__(self, workers=REMINDER_WORKERS, queue_size=REMINDER_QUEUE_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reminder')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def dispatch(self, tick, set_time, batch):
+        """send a batch of (reminder id, (user id, is phenomenon)) due at the tick (minutes since the epoch)"""
+        slot = {'left': len(batch), 'errors': 0}
+        slot_lock = threading.Lock()
+
+        def done(is_ok):
+            with slot_lock:
+                slot['left'] -= 1
+                slot['errors'] += not is_ok
+                if slot['left']:
+                    return
+            elapsed = time.time() - tick * 60
+            scheduler_slot_seconds.observe(elapsed)
+            logger.info(f'Reminders of {set_time.replace(".", ":")} have been sent in {elapsed:.1f} s: '
+                        f'{len(batch) - slot["errors"]} ok, {slot["errors"]} failed')
+
+        self._prefetch(batch)
+        for reminder_id, (user_id, is_phenomenon) in batch:
+            self._slots.acquire()
+            scheduler_running.inc()
+            self._executor.submit(self._send, tick, set_time, reminder_id, user_id, is_phenomenon, done)
+
+    @staticmethod
+    def _prefetch(batch):
+        """load the profiles of the batch and the forecasts of their cities into the caches, one round-trip each"""
+        try:
+            with server.app_context():
+                user_profiles = get_profiles([user_id for _, (user_id, _) in batch])
+            prefetch(transliterate_name(profile.city_name) for profile in user_profiles.values() if profile.city_name)
+        except Exception as e:
+            logger.error(f'Reminders have not been prefetched\n{repr(e)}')
+
+    def _send(self, tick, set_time, reminder_id, user_id, is_phenomenon, done):
+        job_name = get_job_name(is_phenomenon)
+        scheduler_lag_seconds.observe(time.time() - tick * 60, job_name)
+        is_ok = False
+        try:
+            with server.app_context():
+                if is_phenomenon:
+                    send_phenomenon_reminder(user_id)
+                else:
+                    send_daily_reminder(user_id, set_time)
+            is_ok = True
+        except Exception as e:
+            logger.error(f'Reminder {reminder_id} has failed\n{repr(e)}')
+        finally:
+            scheduler_jobs.inc(job_name, 'ok' if is_ok else 'error')
+            scheduler_running.dec()
+            self._slots.release()
+            done(is_ok)
+
+
+class ReminderScheduler:
+    """sends the reminders of the Reminder table from a timing wheel, one tick per minute.
+    Every gunicorn worker starts a scheduler, only the one holding the lock of `lock_path` runs (the leader),
+    the others wait to take over if its process exits. The lock is per host: without shards only the first
+    Heroku web dyno runs one, with shards every instance sends the reminders of its own shards.
+    The wheel is loaded from the table on start and reloaded every REMINDER_RESYNC_INTERVAL seconds. Reminders
+    added by any process are read every tick (see `poll`), and a due reminder deleted from the table is dropped
+    before it is sent, `add` and `remove` only make the changes of the leader's own process immediate.
+    Periodic tasks (`add_periodic`) run on their own threads, so a slow one does not hold the ticks back
+    """
+
+    def __init__(self, timezone, dispatcher, resync_interval=REMINDER_RESYNC_INTERVAL,
+                 misfire_grace=REMINDER_MISFIRE_GRACE, lock_path=SCHEDULER_LOCK_PATH):
+        self.timezone = timezone
+        self.dispatcher = dispatcher
+        self.misfire_grace = misfire_grace
+        self.lock_path = lock_path
+        self.is_leader = False
+        self.wheel = TimingWheel()
+        self.shards = None  # shards whose reminders are loaded, None without sharding
+        self.last_id = 0  # highest reminder id read from the table
+        self._lock_file = None
+        self._load_lock = threading.Lock()
+        self._periodic = []  # [next run (monotonic), interval, function, future of the last run]
+        self._periodic_executor = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.add_periodic(resync_interval, self.load, delay=resync_interval)
+
+    def add_periodic(self, interval, function, delay=0):
+        """run `function` every `interval` seconds, the first time after `delay` seconds.
+        A run is skipped while the previous one has not finished
+        """
+        self._periodic.append([time.monotonic() + delay, interval, function, None])
+
+    def add(self, reminder):
+        if not self.is_leader:
+            return  # read from the table by the leader
+        if reminder.hours is None or reminder.minutes is None:
+            return
+        if sharding.shard_map is not None and not sharding.is_local(reminder.telegram_user.chat_id):
+            return  # sent by the instance of its shard
+        minute = get_minute_of_day(reminder.hours, reminder.minutes)
+        self.wheel.add(reminder.id, minute, (reminder.user_id, bool(reminder.is_phenomenon)))
+
+    def remove(self, reminder_id):
+        self.wheel.remove(reminder_id)
+
+    def load(self):
+        with self._load_lock:
+            self._load()
+
+    def _load(self):
+        self.wheel.begin_load()  # changes committed while the table is read are replayed on top of it
+        shards = None
+        try:
+            if sharding.shard_map is not None:
+                shards = sharding.shard_map.get_owned_shards()
+            rows, last_id = self._read_reminders(shards)
+        except Exception:
+            self.wheel.cancel_load()
+            raise
+        finally:
+            db.session.remove()
+        self.wheel.load((reminder_id, get_minute_of_day(hours, minutes), (user_id, bool(is_phenomenon)))
+                        for reminder_id, hours, minutes, user_id, is_phenomenon in rows)
+        self.shards = shards
+        self.last_id = max(self.last_id, last_id)
+        logger.info(f'{len(self.wheel)} reminders are scheduled')
+
+    def _read_reminders(self, shards, after_id=0):
+        """return the complete reminders of the shards with an id above `after_id` and the highest id read"""
+        query = db.session.query(Reminder.id, Reminder.hours, Reminder.minutes, Reminder.user_id,
+                                 Reminder.is_phenomenon) \
+            .filter(Reminder.id > after_id)
+        if shards is not None:
+            query = query.join(User, Reminder.user_id == User.id).add_columns(User.chat_id)
+        rows = query.all()
+        last_id = max((row[0] for row in rows), default=after_id)
+        rows = [row[:5] for row in rows if row.hours is not None and row.minutes is not None and
+                (shards is None or sharding.get_shard(row[5]) in shards)]
+        return rows, last_id
+
+    def poll(self):
+        """schedule the reminders added to the table since the last read, by any process.
+        Ids are not committed in order, so the last REMINDER_POLL_OVERLAP ids read are read again: a reminder
+        committed after a higher id is picked up by the next poll, the reminders already in the wheel are kept
+        """
+        with self._load_lock:
+            rows, last_id = self._read_reminders(self.shards, max(self.last_id - REMINDER_POLL_OVERLAP, 0))
+            self.last_id = max(self.last_id, last_id)
+        for reminder_id, hours, minutes, user_id, is_phenomenon in rows:
+            if reminder_id not in self.wheel:
+                self.wheel.add(reminder_id, get_minute_of_day(hours, minutes), (user_id, bool(is_phenomenon)))
+
+    def _drop_deleted(self, batch):
+        """return the reminders of the batch still in the table, the others are removed from the wheel"""
+        ids = {reminder_id for reminder_id, _ in batch}
+        existing = set()
+        id_list = list(ids)
+        for start in range(0, len(id_list), QUERY_CHUNK_SIZE):
+            existing.update(reminder_id for reminder_id, in db.session.query(Reminder.id)
+                            .filter(Reminder.id.in_(id_list[start:start + QUERY_CHUNK_SIZE])))
+        for reminder_id in ids - existing:
+            self.wheel.remove(reminder_id)
+        return [item for item in batch if item[0] in existing]
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._stop.set()
+
+    def _elect(self):
+        """take the lock of the host without waiting, return True if this process holds it.
+        A POSIX lock is released when the process exits and is not inherited by the parse processes
+        """
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _run(self):
+        if sharding.shard_map is None and DYNO and DYNO != 'web.1':
+            logger.warning(f'Reminders are sent by dyno web.1, not by {DYNO}: several dynos need shards')
+            return
+        while not self._elect():
+            if self._stop.wait(60):
+                return
+        self.is_leader = True
+        self._periodic_executor = ThreadPoolExecutor(max_workers=len(self._periodic), thread_name_prefix='periodic')
+        logger.info(f'Reminders are sent by process {os.getpid()}')
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f'Reminders have not been loaded\n{repr(e)}')
+        last_tick = int(time.time() // 60)
+
+        while not self._stop.wait(60 - time.time() % 60):
+            current_tick = int(time.time() // 60)
+            first_tick = max(last_tick + 1, current_tick - self.misfire_grace)
+            self._run_periodic(self.poll)
+            for tick in range(last_tick + 1, first_tick):
+                self._count_missed(tick)
+            for tick in range(first_tick, current_tick + 1):
+                self._tick(tick)
+            last_tick = max(last_tick, current_tick)
+
+            for task in self._periodic:
+                next_run, interval, function, future = task
+                if time.monotonic() >= next_run and (future is None or future.done()):
+                    task[0] = time.monotonic() + interval
+                    task[3] = self._periodic_executor.submit(self._run_periodic, function)
+
+    def _run_periodic(self, function):
+        try:
+            function()
+        except Exception as e:
+            logger.error(f'Periodic task {function.__name__} has failed\n{repr(e)}')
+        finally:
+            db.session.remove()
+
+    def run_maintenance(self):
+        if not sharding.is_primary():
+            return  # the tables are shared, one instance cleans them up
+        _, deleted_ids = clean_up()
+        for reminder_id in deleted_ids:
+            self.remove(reminder_id)
+
+    def _get_minute_of_day(self, tick):
+        local_time = datetime.fromtimestamp(tick * 60, self.timezone)
+        return get_minute_of_day(local_time.hour, local_time.minute)
+
+    def _count_missed(self, tick):
+        for _, (_, is_phenomenon) in self.wheel.get_due(self._get_minute_of_day(tick)):
+            scheduler_jobs.inc(get_job_name(is_phenomenon), 'missed')
+
+    def _tick(self, tick):
+        minute = self._get_minute_of_day(tick)
+        batch = self.wheel.get_due(minute)
+        if batch:
+            try:
+                batch = self._drop_deleted(batch)
+            except Exception as e:
+                logger.error(f'Deleted reminders have not been checked\n{repr(e)}')
+            finally:
+                db.session.remove()
+        if not batch:
+            return
+        set_time = f'{minute // 60:02}.{minute % 60:02}'
+        self.dispatcher.dispatch(tick, set_time, batch)
+
+
+def get_job_name(is_phenomenon):
+    return send_phenomenon_reminder.__name__ if is_phenomenon else send_daily_reminder.__name__
+
+
+reminder_scheduler = ReminderScheduler(TIME_ZONE_MSK, ReminderDispatcher())
+Gauge('weatherbot_scheduled_reminders', 'Reminders in the timing wheel', func=lambda: len(reminder_scheduler.wheel))
 
 
 # Handle '/daily' (setting a daily reminder)
-def set_daily(new_reminder, hours, minutes, ):
-    job = scheduler.add_job(send_daily_reminder, args=[new_reminder.user_id, f'{hours}.{minutes}'],
-                            trigger='cron', hour=hours, minute=minutes)
-    new_reminder.job_id = job.id
+def set_daily(new_reminder):
     db.session.commit()
+    reminder_scheduler.add(new_reminder)
 
 
 # Handle '/daily' (sending a reminder)
+@profiled
 def send_daily_reminder(user_id, set_time):
-    user = User.query.filter_by(id=user_id).first()
-    response_msg = get_today_weather_info(user.city_name, user.language, set_time)
+    profile = get_profile(user_id)
+    response_msg = get_today_weather_info(profile.city_name, profile.language, set_time)
+
+    bot.send_message(profile.chat_id, text=response_msg, parse_mode='html')
+
 
-    bot.send_message(user.chat_id, text=response_msg, parse_mode='html')
+# Handle '/daily' (removing every daily reminder)
+def remove_all_daily(user_id):
+    """delete the daily reminders of the user in one transaction and unschedule them"""
+    removed_ids = Reminder.delete_for_user(user_id, is_phenomenon=False)
+    db.session.commit()
+    for reminder_id in removed_ids:
+        reminder_scheduler.remove(reminder_id)
+    return removed_ids
 
 
 # Handle phenomenon reminder
-def set_phenomenon_time(new_reminder, hours, minutes):
-    job = scheduler.add_job(send_phenomenon_reminder, args=[new_reminder.user_id],
-                            trigger='cron', hour=hours, minute=minutes)
-    new_reminder.job_id = job.id
+def replace_phenomenon_time(user_id, hours=None, minutes=None):
+    """replace the phenomenon reminders of the user with one at hours:minutes (none if not given)
+    in one transaction and reschedule them
+    """
+    removed_ids = Reminder.delete_for_user(user_id, is_phenomenon=True)
+    new_reminder = None
+    if hours is not None:
+        new_reminder = Reminder(user_id=user_id, hours=hours, minutes=minutes, is_phenomenon=True)
+        db.session.add(new_reminder)
     db.session.commit()
 
+    for reminder_id in removed_ids:
+        reminder_scheduler.remove(reminder_id)
+    if new_reminder is not None:
+        reminder_scheduler.add(new_reminder)
+    return new_reminder
+
 
 # Handle '/phenomena' (sending a phenomenon reminder)
+@profiled
 def send_phenomenon_reminder(user_id):
-    user = User.query.filter_by(id=user_id).first()
-    response_msg = get_phenomenon_info(user)
+    profile = get_profile(user_id)
+    response_msg = get_phenomenon_info(profile)
     if response_msg:
-        bot.send_message(user.chat_id, text=response_msg, parse_mode='html')
+        bot.send_message(profile.chat_id, text=response_msg, parse_mode='html')
+
+
+# Handle the 'forecast changes' phenomenon
+last_alerts = {}  # user id -> (city, tomorrow's DayForecast) of the last check
+
+
+def check_forecast_changes():
+    """alert the users of the 'forecast changes' mode when tomorrow's forecast of their city differs from the last
+    check, with the changed day parts and the phenomena they have chosen that are expected.
+    The first check of a user and the first one of a new day are not alerted
+    """
+    subscribers = db.session.query(User.id, User.chat_id, User.city_name, User.language) \
+        .join(Phenomenon, Phenomenon.user_id == User.id) \
+        .filter(Phenomenon.phenomenon == CHANGE_ALERT, User.city_name.isnot(None)).all()
+    cities = {}  # city name -> (city, tomorrow's DayForecast), None if unavailable
+    local_ids = set()
+    alerted = 0
+    for user_id, chat_id, city_name, lang in subscribers:
+        if not sharding.is_local(chat_id):
+            continue
+        local_ids.add(user_id)
+        if city_name not in cities:
+            cities[city_name] = get_tomorrow(city_name)
+        if cities[city_name] is None:
+            continue
+        city, forecast = cities[city_name]
+
+        last = last_alerts.get(user_id)
+        if last == (city, forecast):
+            continue
+        last_alerts[user_id] = (city, forecast)
+        if last is None or last[0] != city or last[1].date != forecast.date:
+            continue
+        text = format_forecast_change(last[1], forecast, get_rules(user_id, lang).evaluate(city, forecast), lang)
+        if text is None:  # only values the alert does not show have changed
+            continue
+        try:
+            bot.send_message(chat_id, text=text, parse_mode='html')
+            alerted += 1
+        except Exception as e:
+            logger.error(f'Forecast change alert has failed for user {user_id}\n{repr(e)}')
+    for user_id in last_alerts.keys() - local_ids:  # unsubscribed, deleted or moved to another shard
+        del last_alerts[user_id]
+    if alerted:
+        logger.info(f'Forecast change alerts: {alerted} sent, {len(subscribers)} subscribers')
+
+
+def get_tomorrow(city_name):
+    city = transliterate_name(city_name)
+    if city is None:
+        return None
+    try:
+        snapshot, _, _ = get_snapshot(city)
+        return city, snapshot.tomorrow
+    except Exception as e:
+        logger.error(f'Tomorrow forecast is unavailable for {city}\n{repr(e)}')
+        return None
+
+
+# Handle a shard move (scripts/shards.py)
+def reload_shards(force=False):
+    """reschedule the reminders once the shards of the instance have changed, `force` reads the shard table now"""
+    if force:
+        sharding.shard_map.reload()
+    shards = sharding.shard_map.get_owned_shards()
+    if shards != reminder_scheduler.shards:
+        logger.info(f'Shards of {sharding.INSTANCE_NAME} have changed to {sorted(shards)}')
+        reminder_scheduler.load()
 
 
-# Handle delete phenomenon reminder
-def delete_ph_time_jobs(user_id):
-    ph_reminders = Reminder.query.filter_by(user_id=user_id, is_phenomenon=True).all()
-    for reminder in ph_reminders:
-        scheduler.remove_job(job_id=reminder.job_id, jobstore='default')
+reminder_scheduler.add_periodic(MAINTENANCE_INTERVAL, reminder_scheduler.run_maintenance)
+if sharding.shard_map is not None:
+    reminder_scheduler.add_periodic(sharding.SHARD_MAP_TTL, reload_shards, delay=sharding.SHARD_MAP_TTL)
+reminder_scheduler.add_periodic(ALERT_CHECK_INTERVAL, check_forecast_changes)
+reminder_scheduler.add_periodic(BROADCAST_LEASE, resume_broadcasts)
+reminder_scheduler.start()
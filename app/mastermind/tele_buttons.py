@@ -1,6 +1,7 @@
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton, ReplyKeyboardMarkup
 
 from app.data.localization import phenomenon_button_names, button_names
+from app.mastermind.alerts import CHANGE_ALERT
 from app.models import Phenomenon, User, Reminder
 
 temp_buttons = ['temp_btn1', 'temp_btn2', 'temp_btn3', 'temp_btn4']
@@ -66,6 +67,10 @@ def gen_markup_phenomena(user_id, lang):
         tick = '✅ '
     else:
         tick = '✖'
+    if Phenomenon.query.filter_by(user_id=user_id, phenomenon=CHANGE_ALERT).first():
+        change_tick = '✅ '
+    else:
+        change_tick = '✖'
     markup.add(
         InlineKeyboardButton(
             f"{tick}{phenomenon_button_names[phenomena_list[-1]][lang]}", callback_data='phenomenon intense heat'),
@@ -73,6 +78,8 @@ def gen_markup_phenomena(user_id, lang):
         InlineKeyboardButton(f"{phenomenon_button_names['all phenomena'][lang]}", callback_data='all phenomena'),
         InlineKeyboardButton(f"{phenomenon_button_names['set time'][lang]}", callback_data='set time phenomena')
     )
+    markup.add(InlineKeyboardButton(f"{change_tick}{phenomenon_button_names[CHANGE_ALERT][lang]}",
+                                    callback_data=f'phenomenon {CHANGE_ALERT}'))
     return markup
 
 
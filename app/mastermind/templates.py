@@ -0,0 +1,94 @@
+from string import Formatter
+
+from app.data.localization import button_names, day_part_names, hints, info, phenomenon_button_names
+
+# layouts of the replies, shared by every language. Upper case fields are the labels of the language,
+# they are filled in once when the layouts are compiled, lower case fields are filled in by `render`
+layouts = {
+    'today': '<i>{WEATHER_IN} {city}</i>\n\n'
+             '<b>{NOW}: {temperature}°; {FEELS_LIKE}: {feels_like}\n'
+             '{WIND}: {wind}; {HUMIDITY}: {humidity}%\n'
+             '{condition} {emoji}</b> \n\n'
+             '{day_parts}'
+             '{DAYLIGHT}: {daylight}\n'
+             '{SUNRISE_SUNSET}: {sunrise} - {sunset}\n',
+    'today day part': '{day_part}: {temp}; {WIND}: {wind} {emoji}\n\n',
+    'tomorrow': '<i>{city} {ON} {date}</i>\n\n'
+                '{day_parts}'
+                '{DAYLIGHT}: {daylight}\n'
+                '{SUNRISE_SUNSET}: {sunrise} - {sunset}\n',
+    'tomorrow day part': '<b>{day_part}</b>, {temp} {WIND}: {wind}\n{condition} {emoji}\n\n',
+    'week': '<i>{city}. {WEEK}</i>\n{days}',
+    'week day': '\n<i><b>{date}</b></i>\n{day_parts}',
+    'week day part': '{day_part}: {temp};  {wind} {emoji}\n',
+    'daily': '{day_part},\n{temp},\n{condition},\n{wind},\n',
+    'phenomenon': '<b>{PHENOMENON_TOMORROW}</b>{text}',
+    'forecast change': '<b>{FORECAST_CHANGED}</b>\n{day_parts}{phenomena}',
+    'forecast change day part': '{day_part}: {changes}\n',
+    'change': '{old} → {new}',
+    'as of': '\n<i>{AS_OF} {time}</i>',
+    'settings': '<b>{DAILY}:</b>\n<b>{TIME}:</b>\n{reminders}'
+                '\n<b>{PHENOMENA}:</b>\n{phenomena}'
+                '\n<b>{MANUALLY}:</b>\n{manual_phenomena}'
+                '\n<b>{TIME}:</b>\n{phenomenon_time}',
+    'line': '{text}\n',
+    'not set': '{NOT_SET}\n',
+    'manual phenomenon': '{name}: {value}{unit}\n',
+}
+
+
+# names of the items of `info`, in order
+info_labels = ('TRY_AGAIN', 'NOW', 'WIND', 'FEELS_LIKE', 'DAYLIGHT', 'SUNRISE_SUNSET', 'ON', 'CALM', 'WEEK', 'SETTINGS',
+               'M_S', 'TEMPERATURE', 'TIME', 'NOT_SET')
+
+
+def get_labels(lang):
+    """labels of the layouts in the language"""
+    names = dict(zip(info_labels, info[lang]))
+    names.update({
+        'HUMIDITY': phenomenon_button_names['humidity'][lang], 'MANUALLY': phenomenon_button_names['manually'][lang],
+        'DAILY': button_names['daily'][lang], 'PHENOMENA': button_names['phenomena'][lang],
+        'WEATHER_IN': hints['weather in'][lang], 'PHENOMENON_TOMORROW': hints['phenomenon tomorrow'][lang],
+        'AS_OF': hints['as of'][lang], 'FORECAST_CHANGED': hints['forecast changed'][lang],
+    })
+    return names
+
+
+class Template:
+    """layout with the labels of a language filled in, `render` fills in the fields with one join"""
+    __slots__ = ('parts', 'fields')
+
+    def __init__(self, layout, labels):
+        self.parts = []  # literal text, None where a field goes
+        self.fields = []  # (index in parts, field name)
+        text = ''
+        for literal, field, spec, conversion in Formatter().parse(layout):
+            text += literal
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f'Format specs are not supported: {layout!r}')
+            if field.isupper():
+                text += labels[field]
+                continue
+            if text:
+                self.parts.append(text)
+                text = ''
+            self.fields.append((len(self.parts), field))
+            self.parts.append(None)
+        if text:
+            self.parts.append(text)
+
+    def render(self, **values):
+        parts = self.parts.copy()
+        for index, field in self.fields:
+            parts[index] = values[field]
+        return ''.join(parts)
+
+
+labels = {lang: get_labels(lang) for lang in info}
+# lang -> layout name -> Template, compiled once: adding a language only takes its labels in app.data.localization
+templates = {lang: {name: Template(layout, labels[lang]) for name, layout in layouts.items()} for lang in info}
+
+# 'morning' -> 'Morning' / 'Утром' as the day parts start a line
+day_part_titles = {lang: {name: names[lang].title() for name, names in day_part_names.items()} for lang in info}
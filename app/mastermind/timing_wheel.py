@@ -0,0 +1,84 @@
+import threading
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def get_minute_of_day(hours, minutes):
+    return int(hours) * 60 + int(minutes)
+
+
+class TimingWheel:
+    """daily events in one bucket per minute of the day.
+    Buckets map a key to its value, so adding, removing and taking a bucket do not depend on the number of events
+    """
+
+    def __init__(self):
+        self.buckets = [{} for _ in range(MINUTES_PER_DAY)]
+        self.minutes = {}  # key -> minute of the day
+        self._journal = None  # changes made while a reload is being built
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __contains__(self, key):
+        return key in self.minutes
+
+    def add(self, key, minute, value):
+        with self._lock:
+            self._add(key, minute, value)
+            if self._journal is not None:
+                self._journal.append((True, key, minute, value))
+
+    def remove(self, key):
+        """return True if the key was in the wheel"""
+        with self._lock:
+            found = self._remove(key)
+            if self._journal is not None:
+                self._journal.append((False, key, None, None))
+        return found
+
+    def get_due(self, minute):
+        """return [(key, value)] of the events at the minute of the day"""
+        with self._lock:
+            return list(self.buckets[minute].items())
+
+    def begin_load(self):
+        """start recording changes, they are applied on top of the next `load`"""
+        with self._lock:
+            self._journal = []
+
+    def cancel_load(self):
+        with self._lock:
+            self._journal = None
+
+    def load(self, items):
+        """replace the content with (key, minute, value) items.
+        The buckets are built without the lock, changes made meanwhile (after `begin_load`) are replayed
+        """
+        buckets = [{} for _ in range(MINUTES_PER_DAY)]
+        minutes = {}
+        for key, minute, value in items:
+            buckets[minute][key] = value
+            minutes[key] = minute
+
+        with self._lock:
+            self.buckets, self.minutes = buckets, minutes
+            for is_added, key, minute, value in self._journal or ():
+                if is_added:
+                    self._add(key, minute, value)
+                else:
+                    self._remove(key)
+            self._journal = None
+
+    def _add(self, key, minute, value):
+        self._remove(key)
+        self.buckets[minute][key] = value
+        self.minutes[key] = minute
+
+    def _remove(self, key):
+        minute = self.minutes.pop(key, None)
+        if minute is None:
+            return False
+        del self.buckets[minute][key]
+        return True
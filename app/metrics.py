@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+from sqlalchemy import event
+
+from app import profiling
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+registry = []
+
+
+class Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> value
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _format_labels(self, label_values, extra=''):
+        labels = [f'{name}="{value}"' for name, value in zip(self.labelnames, label_values)]
+        if extra:
+            labels.append(extra)
+        return '{' + ','.join(labels) + '}' if labels else ''
+
+    def collect(self):
+        """return lines of the text exposition format"""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            lines.append(f'{self.name}{self._format_labels(label_values)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    """a value that only goes up; `func` (a running total kept elsewhere) is called on every scrape if given"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        if self.func is not None:
+            with self._lock:
+                self._values[()] = self.func()
+        return super().collect()
+
+
+class Gauge(Metric):
+    """a value that goes up and down; `func` is called on every scrape if given"""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), func=None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def collect(self):
+        if self.func is not None:
+            self.set(self.func())
+        return super().collect()
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][idx] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = self._format_labels(label_values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = self._format_labels(label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render():
+    """return all metrics in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+webhook_seconds = Histogram('weatherbot_webhook_seconds', 'Time spent handling a webhook update')
+handler_seconds = Histogram('weatherbot_handler_seconds', 'Time spent in a bot handler', ['handler'])
+handler_errors = Counter('weatherbot_handler_errors_total', 'Bot handlers that raised an exception', ['handler'])
+upstream_seconds = Histogram('weatherbot_upstream_seconds', 'Time spent downloading a weather page', ['page'])
+parse_seconds = Histogram('weatherbot_parse_seconds', 'Time spent parsing a weather page', ['page'])
+unchanged_pages = Counter('weatherbot_unchanged_pages_total', 'Weather pages not parsed because they have not '
+                          'changed', ['page', 'check'])
+render_seconds = Histogram('weatherbot_render_seconds', 'Time spent rendering a reply', ['view'])
+render_cache = Counter('weatherbot_render_cache_total', 'Rendered reply cache lookups', ['result'])
+db_seconds = Histogram('weatherbot_db_seconds', 'Time spent executing database statements',
+                       buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+telegram_seconds = Histogram('weatherbot_telegram_seconds', 'Time spent calling the Telegram Bot API', ['method'])
+telegram_errors = Counter('weatherbot_telegram_errors_total', 'Failed Telegram Bot API calls', ['method'])
+scheduler_lag_seconds = Histogram('weatherbot_scheduler_lag_seconds',
+                                  'Delay between the scheduled time of a job and its start', ['job'])
+scheduler_jobs = Counter('weatherbot_scheduler_jobs_total', 'Finished scheduler jobs', ['job', 'result'])
+scheduler_running = Gauge('weatherbot_scheduler_running_jobs', 'Scheduler jobs submitted and not finished yet')
+scheduler_slot_seconds = Histogram('weatherbot_scheduler_slot_seconds',
+                                   'Time from the scheduled minute until every reminder of it has been sent',
+                                   buckets=(1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+
+def timed_handler(function):
+    """measure a bot handler and count its errors, a sample of the calls is profiled if profiling is on"""
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return profiling.call(name, function, *args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name)
+
+    return wrapper
+
+
+def instrument_db(engine):
+    """measure every statement executed by the engine (or all engines if the Engine class is given)"""
+    # the start is kept on the execution context of the statement, which a failed statement leaves behind
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, 'query_start', None)
+        if start is not None:
+            db_seconds.observe(time.perf_counter() - start)
+
+
+def instrument_telegram(apihelper):
+    """measure every request made through telebot.apihelper"""
+    make_request = apihelper._make_request
+
+    @wraps(make_request)
+    def _make_request(token, method_name, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception:
+            telegram_errors.inc(method_name)
+            raise
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, method_name)
+
+    apihelper._make_request = _make_request
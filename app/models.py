@@ -52,6 +52,27 @@ class Reminder(db.Model):
     def __repr__(self):
         return f"ReminderTime {self.hours}:{self.minutes} (is phenomenon - {self.is_phenomenon})\n"
 
+    @staticmethod
+    def delete_for_user(user_id, is_phenomenon):
+        """delete the daily or phenomenon reminders of the user with one statement, return their ids.
+        The caller commits
+        """
+        ids = [reminder_id for reminder_id, in
+               db.session.query(Reminder.id).filter_by(user_id=user_id, is_phenomenon=is_phenomenon)]
+        if ids:
+            Reminder.query.filter(Reminder.id.in_(ids)).delete(synchronize_session=False)
+        return ids
+
+    @staticmethod
+    def incomplete():
+        """query of the reminders without an hour or a minute"""
+        return Reminder.query.filter(db.or_(Reminder.hours.is_(None), Reminder.minutes.is_(None)))
+
+    @staticmethod
+    def delete_incomplete(user_id):
+        """delete the reminders of the user without an hour or a minute, return how many. The caller commits"""
+        return Reminder.incomplete().filter(Reminder.user_id == user_id).delete(synchronize_session=False)
+
 
 class Phenomenon(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -62,3 +83,79 @@ class Phenomenon(db.Model):
 
     def __repr__(self):
         return f"Phenomenon {self.phenomenon} is set to {self.value}\n"
+
+    @staticmethod
+    def add_missing(user_id, phenomena):
+        """insert the phenomena the user does not have yet with one statement, return how many were added.
+        The caller commits
+        """
+        existing = {name for name, in db.session.query(Phenomenon.phenomenon).filter_by(user_id=user_id)}
+        rows = [{'user_id': user_id, 'phenomenon': phenomenon, 'is_manually': False}
+                for phenomenon in phenomena if phenomenon not in existing]
+        if rows:
+            db.session.execute(Phenomenon.__table__.insert(), rows)
+        return len(rows)
+
+    @staticmethod
+    def query_for_user(user_id, phenomena=None, **filters):
+        """query of the phenomena of the user matching the filters, only the named ones if `phenomena` is given"""
+        query = Phenomenon.query.filter_by(user_id=user_id, **filters)
+        if phenomena is not None:
+            query = query.filter(Phenomenon.phenomenon.in_(phenomena))
+        return query
+
+    @staticmethod
+    def delete_for_user(user_id, phenomena=None, **filters):
+        """delete the phenomena of the user matching the filters with one statement. The caller commits"""
+        return Phenomenon.query_for_user(user_id, phenomena, **filters).delete(synchronize_session=False)
+
+
+class Shard(db.Model):
+    """instance serving the users of a shard, see app.sharding"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # shard number
+    instance = db.Column(db.String(64), nullable=False)
+    url = db.Column(db.String, nullable=False)  # base url of the instance, its webhook is {url}/{TOKEN}
+
+    def __repr__(self):
+        return f"Shard {self.id} is served by {self.instance}"
+
+
+class Conversation(db.Model):
+    """step a chat is in: its next text message answers the question of the step, see app.mastermind.conversation"""
+    chat_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    step = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.String(64))  # what the step is about, e.g. the phenomenon a value is asked for
+    expires_at = db.Column(db.Integer, nullable=False, index=True)  # unix time
+
+    def __repr__(self):
+        return f"Chat {self.chat_id} is at step {self.step} ({self.payload})"
+
+
+class Broadcast(db.Model):
+    """announcement sent to every user by app.mastermind.broadcast.
+    Users are sent it in id order and the progress is saved after every chunk, so it resumes after a restart
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    parse_mode = db.Column(db.String(16))
+    status = db.Column(db.String(16), nullable=False, default='running')  # running, paused, cancelled or done
+    last_user_id = db.Column(db.Integer, nullable=False, default=0)  # every user up to this id has been done
+    total = db.Column(db.Integer, nullable=False, default=0)  # users when it was started
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    blocked = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.Integer, nullable=False)  # unix time
+    instance = db.Column(db.String(64))  # instance sending it
+    heartbeat_at = db.Column(db.Integer)  # unix time of its last checkpoint
+
+    def __repr__(self):
+        return f"Broadcast {self.id} is {self.status}: {self.sent} sent of {self.total}"
+
+
+class BlockedChat(db.Model):
+    """chat that has blocked the bot, broadcasts skip it until it sends /start again"""
+    chat_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    blocked_at = db.Column(db.Integer, nullable=False)  # unix time
+
+    def __repr__(self):
+        return f"Chat {self.chat_id} has blocked the bot"
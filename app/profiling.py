@@ -0,0 +1,145 @@
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from app import logger
+
+PROFILE_RATE = float(os.getenv('PROFILE_RATE', 0))  # fraction of handler calls and jobs to profile
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))  # seconds between stack samples
+
+rate = PROFILE_RATE
+
+profiles = {}  # handler name -> HandlerProfile
+profiles_lock = threading.Lock()
+
+active_threads = {}  # thread id -> handler name, threads running a profiled call
+sampler_wakeup = threading.Event()
+sampler_thread = None
+local = threading.local()
+
+
+class HandlerProfile:
+    __slots__ = ('calls', 'stats', 'stacks')
+
+    def __init__(self):
+        self.calls = 0
+        self.stats = None  # pstats.Stats of all profiled calls
+        self.stacks = Counter()  # collapsed stack -> samples
+
+
+def set_rate(new_rate):
+    """set the fraction of calls to profile, 0 turns profiling off"""
+    global rate
+    rate = min(max(float(new_rate), 0.0), 1.0)
+    logger.info(f'Profiling rate is set to {rate}')
+
+
+def reset():
+    with profiles_lock:
+        profiles.clear()
+
+
+def call(name, function, *args, **kwargs):
+    """call the function, profiling it with the probability of `rate`"""
+    if not rate or random.random() >= rate or getattr(local, 'active', False):
+        return function(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    thread_id = threading.get_ident()
+    local.active = True
+    active_threads[thread_id] = name
+    _start_sampler()
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        del active_threads[thread_id]
+        local.active = False
+        with profiles_lock:
+            handler_profile = profiles.setdefault(name, HandlerProfile())
+            handler_profile.calls += 1
+            if handler_profile.stats is None:
+                handler_profile.stats = pstats.Stats(profile)
+            else:
+                handler_profile.stats.add(profile)
+
+
+def profiled(function):
+    """profile a sample of the function calls under the function name"""
+    name = function.__name__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        return call(name, function, *args, **kwargs)
+
+    return wrapper
+
+
+def get_summary():
+    with profiles_lock:
+        handlers = {name: {'calls': profile.calls, 'samples': sum(profile.stacks.values())}
+                    for name, profile in profiles.items()}
+    return {'rate': rate, 'interval': PROFILE_INTERVAL, 'handlers': handlers}
+
+
+def get_pstats(name):
+    """return the aggregated profile of the handler in the format of pstats.Stats.dump_stats or None"""
+    with profiles_lock:
+        profile = profiles.get(name)
+        if profile is None or profile.stats is None:
+            return None
+        return marshal.dumps(profile.stats.stats)
+
+
+def get_collapsed_stacks(name):
+    """return sampled stacks of the handler in the collapsed format used by flamegraph.pl or None"""
+    with profiles_lock:
+        profile = profiles.get(name)
+        if profile is None:
+            return None
+        stacks = list(profile.stacks.items())
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+
+def _start_sampler():
+    global sampler_thread
+    sampler_wakeup.set()
+    if sampler_thread is None or not sampler_thread.is_alive():
+        sampler_thread = threading.Thread(target=_sample_stacks, name='profiling-sampler', daemon=True)
+        sampler_thread.start()
+
+
+def _sample_stacks():
+    """sample the stacks of the threads running a profiled call, sleep while there are none"""
+    while True:
+        sampler_wakeup.wait()
+        if not active_threads:
+            sampler_wakeup.clear()
+            if not active_threads:  # a call could start right before the clear
+                continue
+
+        frames = sys._current_frames()
+        samples = []
+        for thread_id, name in list(active_threads.items()):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                samples.append((name, _collapse(frame)))
+        with profiles_lock:
+            for name, stack in samples:
+                profiles.setdefault(name, HandlerProfile()).stacks[stack] += 1
+        time.sleep(PROFILE_INTERVAL)
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{frame.f_globals.get('__name__', '?')}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
@@ -0,0 +1,53 @@
+"""Router of the webhook updates in sharding mode, it keeps no state besides the cached shard table.
+
+    SHARD_COUNT=64 gunicorn app.router:router_app
+
+Telegram posts the updates to the router (/setwebhook points the webhook at it), every update is passed to the
+instance serving the shard of its chat. Updates of unassigned shards and updates the instance has not accepted are
+answered with an error, so Telegram sends them again later
+"""
+import json
+
+from flask import Flask, Response, request
+
+from app import bot, logger, metrics, sharding
+from app.credentials import DEBUG, HEROKU_DEPLOY_DOMAIN, NGROK_DEPLOY_DOMAIN, SHARD_COUNT, TOKEN
+
+if not SHARD_COUNT:
+    raise RuntimeError('The router needs SHARD_COUNT')
+
+router_app = Flask(__name__)
+
+routed_updates = metrics.Counter('weatherbot_routed_updates_total', 'Updates routed to the instances',
+                                 ['instance', 'result'])
+
+
+@router_app.route('/setwebhook', methods=['GET'])
+def set_webhook():
+    bot.remove_webhook()
+    if bot.set_webhook(f'{NGROK_DEPLOY_DOMAIN if DEBUG else HEROKU_DEPLOY_DOMAIN}/{TOKEN}'):
+        return "webhook setup ok"
+    return "webhook setup failed"
+
+
+@router_app.route(f'/{TOKEN}', methods=['POST'])
+def route_update():
+    """pass the update to the instance of its shard, updates without a chat go to the instance of shard 0"""
+    raw_update = request.stream.read().decode("utf-8")
+    chat_id = sharding.get_update_chat_id(json.loads(raw_update))
+    shard = sharding.get_shard(chat_id) if chat_id is not None else 0
+    owner = sharding.shard_map.get_owners().get(shard)
+    if owner is None:
+        logger.error(f'Shard {shard} is not assigned to an instance')
+        routed_updates.inc('', 'unassigned')
+        return "unassigned shard", 503
+
+    instance, url = owner
+    status = sharding.forward_update(url, raw_update, sender=None)
+    routed_updates.inc(instance, 'ok' if status < 400 else 'error')
+    return "ok" if status < 400 else "instance error", (200 if status < 400 else 502)
+
+
+@router_app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+import zlib
+
+import requests
+
+from app import db, logger, server
+from app.credentials import INSTANCE_NAME, SHARD_COUNT, TOKEN
+from app.metrics import Counter, Gauge
+from app.models import Shard
+
+SHARD_MAP_TTL = int(os.getenv('SHARD_MAP_TTL', 10))  # seconds the shard table is cached
+FORWARD_TIMEOUT = float(os.getenv('FORWARD_TIMEOUT', 10))  # seconds to pass an update to the instance of its shard
+
+FORWARDED_HEADER = 'X-Shard-Forwarded'  # set on forwarded updates, they are handled wherever they arrive
+
+forwarded_updates = Counter('weatherbot_forwarded_updates_total', 'Updates passed to the instance of their shard',
+                            ['result'])
+
+
+def get_shard(chat_id, shard_count=SHARD_COUNT):
+    """stable shard of a chat, the same in every process and language: crc32 of the decimal chat id"""
+    return zlib.crc32(str(chat_id).encode()) % shard_count
+
+
+def get_update_chat_id(update):
+    """return the chat id of a raw update (a dict), the sender id if it has no chat and None if it has neither"""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        if value.get('from'):
+            return value['from']['id']
+    return None
+
+
+class ShardMap:
+    """owners of the shards read from the Shard table, cached for `ttl` seconds"""
+
+    def __init__(self, instance=INSTANCE_NAME, ttl=SHARD_MAP_TTL):
+        self.instance = instance
+        self.ttl = ttl
+        self._owners = {}  # shard -> (instance, url)
+        self._owned = frozenset()  # shards of `instance`
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def get_owners(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._load()
+            return self._owners
+
+    def reload(self):
+        with self._lock:
+            self._load()
+            return self._owners
+
+    def _load(self):
+        with db.get_engine(server).connect() as connection:  # the router is another Flask app
+            rows = connection.execute(Shard.__table__.select()).fetchall()
+        self._owners = {row.id: (row.instance, row.url) for row in rows}
+        self._owned = frozenset(shard for shard, (owner, _) in self._owners.items() if owner == self.instance)
+        self._loaded_at = time.monotonic()
+
+    def get_owner(self, chat_id):
+        """return (instance, url) serving the chat, None if its shard is not assigned"""
+        return self.get_owners().get(get_shard(chat_id))
+
+    def get_owned_shards(self):
+        self.get_owners()
+        return self._owned
+
+
+shard_map = ShardMap() if SHARD_COUNT else None
+Gauge('weatherbot_owned_shards', 'Shards served by this instance',
+      func=lambda: len(shard_map.get_owned_shards()) if shard_map is not None else 0)
+
+
+def is_local(chat_id):
+    """return True if this instance serves the chat, always without sharding"""
+    return shard_map is None or get_shard(chat_id) in shard_map.get_owned_shards()
+
+
+def is_primary():
+    """return True if this instance runs the jobs shared by every shard (it serves shard 0), always without sharding"""
+    return shard_map is None or 0 in shard_map.get_owned_shards()
+
+
+def get_remote_owner(raw_update):
+    """return (instance, url) serving the update if it is not this instance, otherwise None"""
+    chat_id = get_update_chat_id(json.loads(raw_update))
+    if chat_id is None or is_local(chat_id):
+        return None
+    return shard_map.get_owner(chat_id)
+
+
+def forward_update(url, raw_update, sender=INSTANCE_NAME):
+    """post a raw update to the webhook of the instance at `url`, return the status code (502 if unreachable).
+    Updates forwarded by an instance (`sender`) are handled by the receiver even if its shard table says otherwise,
+    the ones of the router (no sender) are checked again
+    """
+    headers = {'Content-Type': 'application/json'}
+    if sender:
+        headers[FORWARDED_HEADER] = sender
+    try:
+        response = requests.post(f'{url}/{TOKEN}', data=raw_update.encode('utf-8'), headers=headers,
+                                 timeout=FORWARD_TIMEOUT)
+    except requests.RequestException as e:
+        logger.error(f'Update has not been forwarded to {url}\n{repr(e)}')
+        forwarded_updates.inc('error')
+        return 502
+    forwarded_updates.inc('ok' if response.ok else 'error')
+    return response.status_code
@@ -1,16 +1,26 @@
+from functools import wraps
+
 import telebot
-from flask import request
+from flask import abort, jsonify, request, Response
 from sqlalchemy.orm.exc import UnmappedInstanceError
 from telebot.apihelper import ApiException
 
-from app import server, bot
-from app.credentials import HEROKU_DEPLOY_DOMAIN, NGROK_DEPLOY_DOMAIN, TOKEN, DEBUG
-from app.data.localization import button_names
+from app import server, bot, metrics, profiling, sharding
+from app.capture import update_recorder
+from app.credentials import HEROKU_DEPLOY_DOMAIN, NGROK_DEPLOY_DOMAIN, TOKEN, DEBUG, ADMIN_TOKEN
+from app.data.localization import button_names, info
+from app.mastermind import conversation
+from app.mastermind.alerts import invalidate_rules
+from app.mastermind.broadcast import MAX_MESSAGE_LENGTH, broadcast_actions, get_progress, start_broadcast, \
+    unblock_chat
 from app.mastermind.formating import *
-from app.mastermind.scheduling import delete_ph_time_jobs, set_phenomenon_time, set_daily, scheduler
+from app.mastermind.profiles import invalidate_profile
+from app.mastermind.scheduling import replace_phenomenon_time, reload_shards, remove_all_daily, set_daily, \
+    reminder_scheduler
 from app.mastermind.tele_buttons import phenomena_list, gen_markup_minutes, gen_markup_hours, gen_markup_phenomena, \
     gen_markup_language, call_main_keyboard, call_settings_keyboard, gen_markup_phenomena_manually, \
     ph_manual_list
+from app.metrics import timed_handler
 from app.models import *
 
 
@@ -21,6 +31,7 @@ def get_message_handler_func(button_key):
 
 def view_pre_process_actions(check_city_present=False):
     def decorator(function):
+        @wraps(function)
         def wrapper(message):
             data = User.get_or_create_user_data(message)
             if check_city_present and (not data['user'] or not data['city_name']):
@@ -52,20 +63,141 @@ def set_webhook():
 @server.route(f'/{TOKEN}', methods=['POST'])
 def get_update():
     """handle incoming messages"""
-    bot.process_new_updates([telebot.types.Update.de_json(request.stream.read().decode("utf-8"))])
+    with metrics.webhook_seconds.time():
+        raw_update = request.stream.read().decode("utf-8")
+        if sharding.shard_map is not None and sharding.FORWARDED_HEADER not in request.headers:
+            owner = sharding.get_remote_owner(raw_update)  # the router has sent it before a shard move
+            if owner is not None:
+                return "forwarded", sharding.forward_update(owner[1], raw_update)
+        if update_recorder is not None:
+            update_recorder.record(raw_update)
+        update = telebot.types.Update.de_json(raw_update)
+        profiling.call('get_update', bot.process_new_updates, [update])
     return "ok", 200
 
 
+@server.route('/metrics', methods=['GET'])
+def get_metrics():
+    """expose metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def admin_required(function):
+    """allow the route only with the ADMIN_TOKEN passed in the 'X-Admin-Token' header or the 'token' argument"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        token = request.headers.get('X-Admin-Token') or request.args.get('token')
+        if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+            abort(403)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+@server.route('/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def admin_profiling():
+    """show profiled handlers; POST with 'rate' sets the profiled fraction of calls, with 'reset' drops profiles"""
+    if request.method == 'POST':
+        if 'rate' in request.values:
+            try:
+                profiling.set_rate(request.values['rate'])
+            except ValueError:
+                abort(400)
+        if 'reset' in request.values:
+            profiling.reset()
+    return jsonify(profiling.get_summary())
+
+
+@server.route('/admin/shards', methods=['GET', 'POST'])
+@admin_required
+def admin_shards():
+    """show the shards of the instance; POST reloads the shard table and reschedules the reminders if they changed"""
+    if sharding.shard_map is None:
+        abort(404)
+    if request.method == 'POST':
+        reload_shards(force=True)
+    return jsonify({'instance': sharding.INSTANCE_NAME, 'shard count': sharding.SHARD_COUNT,
+                    'shards': sorted(sharding.shard_map.get_owned_shards())})
+
+
+@server.route('/admin/broadcasts', methods=['GET', 'POST'])
+@admin_required
+def admin_broadcasts():
+    """show the last broadcasts; POST with 'text' (and 'parse_mode') starts sending it to every user"""
+    if request.method == 'POST':
+        text = request.values.get('text', '')
+        if not text or len(text) > MAX_MESSAGE_LENGTH:
+            abort(400)
+        broadcast = start_broadcast(text, request.values.get('parse_mode'))
+        return jsonify(get_progress(broadcast)), 201
+    return jsonify([get_progress(broadcast) for broadcast in Broadcast.query.order_by(Broadcast.id.desc()).limit(20)])
+
+
+@server.route('/admin/broadcasts/<int:broadcast_id>', methods=['GET', 'POST'])
+@admin_required
+def admin_broadcast(broadcast_id):
+    """show a broadcast with its throughput and ETA; POST with 'action' pause, resume or cancel changes it"""
+    broadcast = Broadcast.query.get_or_404(broadcast_id)
+    if request.method == 'POST':
+        action = broadcast_actions.get(request.values.get('action'))
+        if action is None:
+            abort(400)
+        if not action(broadcast):
+            abort(409)
+    return jsonify(get_progress(broadcast))
+
+
+@server.route('/admin/profiling/<handler>.pstats', methods=['GET'])
+@admin_required
+def admin_profiling_pstats(handler):
+    """download the profile of the handler, open it with pstats.Stats"""
+    data = profiling.get_pstats(handler)
+    if data is None:
+        abort(404)
+    return Response(data, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={handler}.pstats'})
+
+
+@server.route('/admin/profiling/<handler>.collapsed', methods=['GET'])
+@admin_required
+def admin_profiling_collapsed(handler):
+    """download sampled stacks of the handler, feed them to flamegraph.pl"""
+    data = profiling.get_collapsed_stacks(handler)
+    if data is None:
+        abort(404)
+    return Response(data, mimetype='text/plain')
+
+
+# registered first: while a chat is at a step, its text messages answer the step, whatever they are
+@bot.message_handler(func=lambda message: conversation.has_step(message.chat.id))
+@timed_handler
+def conversation_step(message):
+    """Handle the answer to the step the chat is at (a city name, a phenomenon value)"""
+    state = conversation.pop_step(message.chat.id)
+    if state is None:  # another worker has handled the answer
+        return
+    step, payload = state
+    if step == conversation.CITY_STEP:
+        return add_city(message)
+    if step == conversation.PHENOMENON_STEP:
+        return add_phenomenon_manually(message, payload)
+    logger.warning(f'Unknown conversation step {step}')
+
+
 @bot.message_handler(commands=['start'])
+@timed_handler
 @view_pre_process_actions()
 def command_start(message, data):
     """Handle '/start'"""
+    unblock_chat(data['chat_id'])
     response = get_start(data['username'], data['lang'])
     bot.send_message(data['chat_id'], text=response,
                      reply_markup=call_main_keyboard(data['lang']), parse_mode='html')
 
 
 @bot.message_handler(func=get_message_handler_func('weather now'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_weather_now(message, data):
     """Handle button 'weather now'"""
@@ -74,14 +206,16 @@ def button_weather_now(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('for tomorrow'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_tomorrow(message, data):
     """Handle button 'for tomorrow'"""
-    response = get_next_day(data['city_name'], data['lang'], phenomenon_info=False)
+    response = get_next_day(data['city_name'], data['lang'])
     bot.send_message(chat_id=data['chat_id'], text=response, parse_mode='html')
 
 
 @bot.message_handler(func=get_message_handler_func('for a week'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_week(message, data):
     """Handle button 'for a week'"""
@@ -90,6 +224,7 @@ def button_week(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('settings'))
+@timed_handler
 @view_pre_process_actions()
 def button_settings(message, data):
     """Handle button 'settings'"""
@@ -97,19 +232,18 @@ def button_settings(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('daily'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_daily(message, data):
     """Handle button 'daily'"""
-    reminders = Reminder.query.filter_by(is_phenomenon=False).all()
-    for reminder in reminders:
-        if reminder.hours is None or reminder.minutes is None:
-            db.session.delete(reminder)
-            db.session.commit()
+    if Reminder.delete_incomplete(data['user'].id):  # the rest is cleaned by the maintenance job
+        db.session.commit()
     response = hints['time daily'][data['lang']]
     bot.send_message(data['chat_id'], text=response, reply_markup=gen_markup_daily(data['user'].id))
 
 
 @bot.message_handler(func=get_message_handler_func('phenomena'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_phenomena(message, data):
     """Handle button 'phenomena'"""
@@ -118,6 +252,7 @@ def button_phenomena(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('city'))
+@timed_handler
 def button_city(message, intro=True):
     """Handle button 'city'"""
     data = User.get_or_create_user_data(message)
@@ -132,8 +267,8 @@ def button_city(message, intro=True):
     else:  # if user types incorrect city name
         text = info[data['lang']][0]
 
-    msg = bot.send_message(chat_id=data['chat_id'], text=text)
-    bot.register_next_step_handler(message=msg, callback=add_city)
+    bot.send_message(chat_id=data['chat_id'], text=text)
+    conversation.set_step(data['chat_id'], conversation.CITY_STEP)
 
 
 def add_city(message):
@@ -151,6 +286,7 @@ def add_city(message):
     if info[data['lang']][0] not in response:
         data['user'].city_name = city
         db.session.commit()
+        invalidate_profile(data['user'].id)
         return bot.send_message(chat_id=data['chat_id'], text=f"{hints['city added'][data['lang']]}")
     else:
         bot.send_message(chat_id=data['chat_id'], text=f"{hints['city fail'][data['lang']]}")
@@ -158,6 +294,7 @@ def add_city(message):
 
 
 @bot.message_handler(func=get_message_handler_func('language'))
+@timed_handler
 @view_pre_process_actions()
 def button_language(message, data):
     """Handle button 'language'"""
@@ -166,69 +303,27 @@ def button_language(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('info'))
+@timed_handler
 @view_pre_process_actions(check_city_present=True)
 def button_info(message, data):
     """Handle button 'info'"""
-    all_phenomena = Phenomenon.query.filter_by(user_id=data['user'].id, is_manually=False).all()
-    all_manual_phenomena = Phenomenon.query.filter_by(user_id=data['user'].id, is_manually=True).all()
-    all_daily = Reminder.query.filter_by(user_id=data['user'].id, is_phenomenon=False).all()
-
-    daily_text = ''
-    for daily in all_daily:
-        hours = daily.hours
-        minutes = daily.minutes
-        if len(str(hours)) == 1:
-            hours = f'{0}{hours}'
-        if minutes == 0:
-            minutes = '00'
-        daily_text += f'{hours}:{minutes}\n'
-    if not daily_text:
-        daily_text = f"{info[data['lang']][13]}\n"
-
-    ph_text = ''
-    for ph in all_phenomena:
-        ph_text += f'{phenomenon_button_names[ph.phenomenon][data["lang"]]}\n'
-    if not ph_text:
-        ph_text = f"{info[data['lang']][13]}\n"
-
-    man_ph_text = ''
-    for man_ph in all_manual_phenomena:
-        if man_ph.phenomenon == phenomenon_button_names['wind speed']['en'].lower():
-            unit = f' {info[data["lang"]][10]}'  # m/s
-        elif man_ph.phenomenon == phenomenon_button_names['humidity']['en'].lower():
-            unit = '%'
-        else:  # temperature
-            unit = '°C'
-        man_ph_text += f'{phenomenon_button_names[man_ph.phenomenon][data["lang"]]}: {man_ph.value}{unit}\n'
-    if not man_ph_text:
-        man_ph_text = f"{info[data['lang']][13]}\n"
-
-    daily_btn = button_names["daily"][data['lang']]
-    ph_btn = button_names["phenomena"][data['lang']]
-    man_ph_btn = phenomenon_button_names["manually"][data['lang']]
-    ph_time = Reminder.query.filter_by(user_id=data['user'].id, is_phenomenon=True).first()
-
-    try:
-        hours = ph_time.hours
-        minutes = ph_time.minutes
-        if len(str(hours)) == 1:
-            hours = f'{0}{hours}'
-        if minutes == 0:
-            minutes = '00'
-        ph_time = f'{hours}:{minutes}'
-    except AttributeError as e:
-        logger.warning(f'Time was not set\n{repr(e)}')
-        ph_time = f"{info[data['lang']][13]}\n"
-
-    response = f'<b>{daily_btn}:</b>\n<b>{info[data["lang"]][12]}:</b>\n{daily_text}' \
-               f'\n<b>{ph_btn}:</b>\n{ph_text}' \
-               f'\n<b>{man_ph_btn}:</b>\n{man_ph_text}' \
-               f'\n<b>{info[data["lang"]][12]}:</b>\n{ph_time}'
+    user_id = data['user'].id
+    reminders = Reminder.query.filter_by(user_id=user_id).filter(
+        Reminder.hours.isnot(None), Reminder.minutes.isnot(None)).order_by(Reminder.id).all()
+    phenomena = Phenomenon.query.filter_by(user_id=user_id).order_by(Phenomenon.id).all()
+
+    response = get_settings_info(
+        reminders=[reminder for reminder in reminders if not reminder.is_phenomenon],
+        phenomena=[phenomenon for phenomenon in phenomena if not phenomenon.is_manually],
+        manual_phenomena=[phenomenon for phenomenon in phenomena if phenomenon.is_manually],
+        phenomenon_reminder=next((reminder for reminder in reminders if reminder.is_phenomenon), None),
+        lang=data['lang'])
     bot.send_message(chat_id=message.chat.id, text=response, parse_mode='html')
 
 
 @bot.message_handler(commands=['help'])
 @bot.message_handler(func=get_message_handler_func('help'))
+@timed_handler
 @view_pre_process_actions()
 def button_help(message, data):
     """Handle button 'help'"""
@@ -237,6 +332,7 @@ def button_help(message, data):
 
 
 @bot.message_handler(func=get_message_handler_func('menu'))
+@timed_handler
 @view_pre_process_actions()
 def button_menu(message, data):
     """Handle button 'menu'"""
@@ -244,6 +340,7 @@ def button_menu(message, data):
 
 
 @bot.message_handler(content_types=["sticker", "text"])
+@timed_handler
 @view_pre_process_actions()
 def respond(message, data):
     """Handle all other messages with content_type 'sticker' and 'text' (content_types defaults to ['text'])"""
@@ -261,11 +358,13 @@ def respond(message, data):
             if not data['city_name']:
                 data['user'].city_name = city
                 db.session.commit()
+                invalidate_profile(data['user'].id)
 
         return bot.send_message(chat_id=data['chat_id'], text=response, parse_mode='html')
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_hours_ph" or call.data == "set time phenomena")
+@timed_handler
 def callback_phenomenon_time(call):
     """handle phenomenon inline keyboard time setting (hours)"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -276,6 +375,7 @@ def callback_phenomenon_time(call):
 
 
 @bot.callback_query_handler(func=lambda call: 'hr_ph' in call.data)
+@timed_handler
 def callback_phenomenon_hr(call):
     """handle phenomenon inline keyboard time setting (minutes)"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -287,6 +387,7 @@ def callback_phenomenon_hr(call):
 
 
 @bot.callback_query_handler(func=lambda call: 'min_ph' in call.data)
+@timed_handler
 def callback_phenomenon_min(call):
     """
     handle phenomenon inline keyboard
@@ -300,19 +401,11 @@ def callback_phenomenon_min(call):
     phenomenon = Reminder.query.filter_by(
         user_id=user.id, hours=phenomenon_hours, minutes=phenomenon_minutes, is_phenomenon=True).first()
 
-    delete_ph_time_jobs(user.id)
-    ph_reminders = Reminder.query.filter_by(user_id=user.id, is_phenomenon=True).all()
-    for reminder in ph_reminders:
-        db.session.delete(reminder)
-    db.session.commit()
-
-    if phenomenon:
+    if phenomenon:  # the same time again unsets it
+        replace_phenomenon_time(user.id)
         text = f"{hints['schedule delete'][user.language]}"
     else:
-        new_phenomenon = Reminder(user_id=user.id, hours=phenomenon_hours, minutes=phenomenon_minutes,
-                                  is_phenomenon=True)
-        db.session.add(new_phenomenon)  # commits in set_phenomenon_time func
-        set_phenomenon_time(new_phenomenon, new_phenomenon.hours, new_phenomenon.minutes)
+        replace_phenomenon_time(user.id, phenomenon_hours, phenomenon_minutes)
         text = f"{hints['schedule set'][user.language]} {phenomenon_hours}:{phenomenon_minutes}"
 
     callback_phenomenon_hr(call)
@@ -320,6 +413,7 @@ def callback_phenomenon_min(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "phenomena manually")
+@timed_handler
 def callback_button_manually(call):
     """handle inline button 'manually'"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -333,31 +427,31 @@ def callback_button_manually(call):
 
 @bot.callback_query_handler(
     func=lambda call: ("manually" in call.data and call.data != "manually remove all" and call.data != "manually back"))
-def callback_phenomenon_manually(call, intro=True):
+@timed_handler
+def callback_phenomenon_manually(call):
     """handle phenomenon manually db"""
-    global callback_query_ph_manually
-    callback_query_ph_manually = call
-
     user = User.query.filter_by(chat_id=call.from_user.id).first()
+    ask_phenomenon_value(call.from_user.id, call.data[9:], user.language)
 
-    if intro:  # if callback_phenomenon_manually called first time
-        text = f"{hints['phenomena temp set'][user.language]}\n{hints['num expected'][user.language]}" \
-               f"\n{hints['how to del'][user.language]}"
+
+def ask_phenomenon_value(chat_id, ph_data, lang, intro=True):
+    """ask the chat for the value of the manual phenomenon, the answer is handled by add_phenomenon_manually"""
+    if intro:  # if the phenomenon button has been pressed
+        text = f"{hints['phenomena temp set'][lang]}\n{hints['num expected'][lang]}\n{hints['how to del'][lang]}"
     else:  # if user types incorrect msg
-        text = info[user.language][0]
+        text = info[lang][0]
 
-    msg = bot.send_message(call.from_user.id, text)
-    bot.register_next_step_handler(message=msg, callback=add_phenomenon_manually)
+    bot.send_message(chat_id, text)
+    conversation.set_step(chat_id, conversation.PHENOMENON_STEP, payload=ph_data)
 
 
-def add_phenomenon_manually(message):
+def add_phenomenon_manually(message, ph_data):
     """handle phenomenon manually db"""
     data = User.get_or_create_user_data(message)
     msg = message.text
     chat_id = data['chat_id']
     user = data['user']
     lang = data['lang']
-    ph_data = callback_query_ph_manually.data[9:]
     phenomenon = Phenomenon.query.filter_by(phenomenon=ph_data, user_id=user.id, is_manually=True).first()
 
     btns = {value[lang] for key, value in button_names.items()}
@@ -369,7 +463,7 @@ def add_phenomenon_manually(message):
         msg = int(msg)
     except:
         bot.send_message(chat_id, hints['num expected'][lang])
-        return callback_phenomenon_manually(callback_query_ph_manually, intro=False)
+        return ask_phenomenon_value(chat_id, ph_data, lang, intro=False)
 
     if msg == 0:  # delete phenomenon value
         try:
@@ -378,6 +472,7 @@ def add_phenomenon_manually(message):
             logger.error(f'The phenomenon has not been found.\n{e}')
         else:
             db.session.commit()
+            invalidate_rules(user.id)
         finally:
             return bot.send_message(
                 chat_id,
@@ -391,7 +486,7 @@ def add_phenomenon_manually(message):
                 text = f"{hints['num pos expected'][lang]}"
         if text:
             bot.send_message(chat_id, text)
-            return callback_phenomenon_manually(callback_query_ph_manually, intro=False)
+            return ask_phenomenon_value(chat_id, ph_data, lang, intro=False)
 
     try:  # add value to db
         phenomenon.value = msg
@@ -401,6 +496,7 @@ def add_phenomenon_manually(message):
         db.session.add(new_phenomenon)
     finally:
         db.session.commit()
+        invalidate_rules(user.id)
         return bot.send_message(
             chat_id,
             f'{hints["phenomenon"][lang]} "{phenomenon_button_names[ph_data][lang]}" {hints["ph manually set"][lang]} {msg}',
@@ -408,15 +504,15 @@ def add_phenomenon_manually(message):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "manually remove all")
+@timed_handler
 def callback_all_manual_phenomena(call):
     """handle all manually phenomena db
     add a manual phenomena to db"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
 
-    manual_phenomena_from_db = Phenomenon.query.filter_by(user_id=user.id, is_manually=True).all()
-    for ph in manual_phenomena_from_db:
-        db.session.delete(ph)
+    Phenomenon.delete_for_user(user.id, is_manually=True)
     db.session.commit()
+    invalidate_rules(user.id)
 
     try:
         bot.edit_message_text(
@@ -432,6 +528,7 @@ def callback_all_manual_phenomena(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "manually back")
+@timed_handler
 def callback_back_manually_phenomena(call):
     """
     handle all manually phenomena db
@@ -446,6 +543,7 @@ def callback_back_manually_phenomena(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "all phenomena")
+@timed_handler
 def callback_all_phenomena(call):
     """
     handle inline button 'all phenomena'
@@ -453,19 +551,14 @@ def callback_all_phenomena(call):
     """
     user = User.query.filter_by(chat_id=call.from_user.id).first()
 
-    all_ph_from_db = Phenomenon.query.filter_by(user_id=user.id, value=None).all()
-    if len(all_ph_from_db) == 7:
-        for ph in all_ph_from_db:
-            db.session.delete(ph)
+    if Phenomenon.query_for_user(user.id, phenomena_list, value=None).count() == len(phenomena_list):
+        Phenomenon.delete_for_user(user.id, phenomena_list, value=None)
         text = hints['all untick'][user.language]
     else:
-        for ph in phenomena_list:
-            new_phenomenon = Phenomenon.query.filter_by(phenomenon=ph, user_id=user.id).first()
-            if new_phenomenon is None:
-                new_phenomenon = Phenomenon(user_id=user.id, phenomenon=ph)
-                db.session.add(new_phenomenon)
+        Phenomenon.add_missing(user.id, phenomena_list)
         text = hints['all tick'][user.language]
     db.session.commit()
+    invalidate_rules(user.id)
 
     bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
                           text=hints['phenomena intro'][user.language],
@@ -474,6 +567,7 @@ def callback_all_phenomena(call):
 
 
 @bot.callback_query_handler(func=lambda call: 'phenomenon' in call.data)
+@timed_handler
 def callback_phenomenon(call):
     """
     handle phenomenon db
@@ -495,6 +589,7 @@ def callback_phenomenon(call):
         text = hints['phenomenon delete'][user.language]
 
     db.session.commit()
+    invalidate_rules(user.id)
     bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
                           text=hints['phenomena intro'][user.language],
                           reply_markup=gen_markup_phenomena(user.id, user.language))
@@ -505,6 +600,7 @@ def callback_phenomenon(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_ph")
+@timed_handler
 def callback_inline_back_ph(call):
     """handle back to phenomenon button"""
     user = User.query.filter_by(chat_id=call.message.chat.id).first()
@@ -521,6 +617,7 @@ def gen_markup_daily(user_id):
 
 
 @bot.callback_query_handler(func=lambda call: "hr" in call.data)
+@timed_handler
 def callback_inline_daily_min(call):
     """handle daily inline keyboard (minutes)"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -533,6 +630,7 @@ def callback_inline_daily_min(call):
 
 
 @bot.callback_query_handler(func=lambda call: 'min' in call.data)
+@timed_handler
 def callback_inline_daily(call):
     """writing time to db"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -544,7 +642,7 @@ def callback_inline_daily(call):
     existing_reminder = Reminder.query.filter_by(
         user_id=user_id, hours=reminder_hours, minutes=reminder_minutes, is_phenomenon=False).first()
     if existing_reminder:  # if reminder exists
-        scheduler.remove_job(job_id=existing_reminder.job_id, jobstore='default')  # remove the time from schedule
+        reminder_scheduler.remove(existing_reminder.id)  # remove the time from schedule
         db.session.delete(existing_reminder)  # remove the time from db
         db.session.commit()
         text = f"{hints['schedule delete'][lang]}"
@@ -553,7 +651,7 @@ def callback_inline_daily(call):
             user_id=user_id, hours=reminder_hours, minutes=reminder_minutes, is_phenomenon=False)
         db.session.add(new_reminder)
         db.session.commit()
-        set_daily(new_reminder, reminder_hours, reminder_minutes)
+        set_daily(new_reminder)
         text = f"{hints['schedule set'][lang]} {reminder_hours}:{reminder_minutes}"
 
     callback_inline_daily_min(call)
@@ -561,6 +659,7 @@ def callback_inline_daily(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "back_to_hours")
+@timed_handler
 def callback_inline_back(call):
     """handle back to hours button"""
     user = User.query.filter_by(chat_id=call.from_user.id).first()
@@ -572,14 +671,10 @@ def callback_inline_back(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "daily remove all")
+@timed_handler
 def callback_remove_all_daily(call):
     user = User.query.filter_by(chat_id=call.from_user.id).first()
-    all_reminders = Reminder.query.filter_by(user_id=user.id, is_phenomenon=False).all()
-
-    for reminder in all_reminders:
-        scheduler.remove_job(job_id=reminder.job_id, jobstore='default')  # remove the time from schedule
-        db.session.delete(reminder)  # remove the time from db
-    db.session.commit()
+    remove_all_daily(user.id)
     try:
         bot.edit_message_text(
             chat_id=call.message.chat.id,
@@ -594,12 +689,14 @@ def callback_remove_all_daily(call):
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "english" or call.data == "russian")
+@timed_handler
 def callback_inline_language(call):
     """Handle button 'language'"""
     user = User.query.filter_by(chat_id=call.message.chat.id).first()
     new_lang = call.data[:2]
     user.language = new_lang
     db.session.commit()
+    invalidate_profile(user.id)
 
     try:
         bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id,
@@ -0,0 +1,66 @@
+"""Benchmark of the page parsing throughput in the request threads and in 1..N parse processes.
+
+    python scripts/bench_parse_pool.py [pages] [max processes]   (400 pages, every core by default)
+
+The fixture pages are parsed by 16 threads like the ones serving requests during a reminder slot,
+half of them /pogoda pages and half /details pages.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('TOKEN', '0:bench')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app.mastermind.parse_pool import ParsePool  # noqa: E402
+from app.mastermind.parsing import PARSE_START_METHOD, parse_details_page, parse_weather_page, \
+    warm_up  # noqa: E402
+from app.mastermind.records import CitySnapshot  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BASE_DIR, 'scripts', 'fixtures')
+THREADS = 16
+
+
+def get_jobs(pages):
+    with open(os.path.join(FIXTURES_DIR, 'pogoda.html'), 'rb') as f:
+        pogoda = f.read()
+    with open(os.path.join(FIXTURES_DIR, 'details.html'), 'rb') as f:
+        details = f.read()
+    details_args = (details, CitySnapshot.today_card, CitySnapshot.week_cards[-1])
+    return [(parse_weather_page, (pogoda,)) if idx % 2 else (parse_details_page, details_args)
+            for idx in range(pages)]
+
+
+def run(jobs, pool):
+    def parse(job):
+        function, args = job
+        return pool.run(function, *args) if pool is not None else function(*args)
+
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        start = time.perf_counter()
+        list(executor.map(parse, jobs))
+        return time.perf_counter() - start
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    jobs = get_jobs(pages)
+
+    run(jobs[:THREADS], None)
+    baseline = run(jobs, None)
+    print(f'threads only: {pages / baseline:.0f} pages/s')
+    for workers in range(1, max_workers + 1):
+        pool = ParsePool(workers, queue_size=pages, start_method=PARSE_START_METHOD, warm_up=warm_up)
+        try:
+            seconds = run(jobs, pool)
+        finally:
+            pool.shutdown()
+        print(f'{workers} processes: {pages / seconds:.0f} pages/s, x{baseline / seconds:.2f}')
+
+
+if __name__ == '__main__':
+    main()
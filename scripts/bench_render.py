@@ -0,0 +1,64 @@
+"""Micro-benchmark of the reply rendering (condition lookups included) for every view and language.
+
+    python scripts/bench_render.py [number of renders]
+"""
+import os
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('TOKEN', '0:bench')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app.data.emoji_conditions import cond_trans  # noqa: E402
+from app.mastermind.formating import _render_next_day, _render_next_week, _render_today_weather_info, \
+    get_settings_info  # noqa: E402
+from app.mastermind.records import CurrentWeather, DayForecast, DayPart  # noqa: E402
+from app.mastermind.templates import templates  # noqa: E402
+from app.models import Phenomenon, Reminder  # noqa: E402
+
+DAY_PARTS = ['morning', 'day', 'evening', 'night']
+
+
+def get_week():
+    """a week of english forecasts as read from the website, every language is rendered from it"""
+    conditions = list(cond_trans)
+    week = []
+    for day in range(7):
+        parts = []
+        for idx, name in enumerate(DAY_PARTS):
+            condition = conditions[(day * 4 + idx) % len(conditions)].capitalize()
+            parts.append(DayPart(name, -2 + idx, 3 + idx, condition, 2.5 + idx, 'NW', 70 + idx))
+        week.append(DayForecast('Moscow', 20 + day, 10, 631, '07:21', '17:52', parts))
+    return week
+
+
+def get_views():
+    """view -> function(lang) rendering it"""
+    week = get_week()
+    current = CurrentWeather('Moscow', 5, 1, 'Cloudy', 3.4, 'NW', 81, 631, '07:21', '17:52')
+    reminders = [Reminder(hours=7, minutes=0), Reminder(hours=19, minutes=30)]
+    phenomena = [Phenomenon(phenomenon='rain'), Phenomenon(phenomenon='thunderstorm')]
+    manual_phenomena = [Phenomenon(phenomenon='wind speed', value=10),
+                        Phenomenon(phenomenon='temperature less', value=-5)]
+    phenomenon_reminder = Reminder(hours=8, minutes=10)
+    return {
+        'today': lambda lang: _render_today_weather_info(current, week[0], 'day', lang),
+        'tomorrow': lambda lang: _render_next_day(week[1], lang),
+        'week': lambda lang: _render_next_week(week, lang),
+        'info': lambda lang: get_settings_info(reminders, phenomena, manual_phenomena, phenomenon_reminder, lang),
+    }
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    views = get_views()
+    for lang in templates:
+        for view, render in views.items():
+            seconds = min(timeit.repeat(lambda: render(lang), number=number, repeat=3))
+            print(f'{lang} {view}: {seconds / number * 1e6:.1f} us per render ({number} renders)')
+
+
+if __name__ == '__main__':
+    main()
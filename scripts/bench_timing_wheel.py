@@ -0,0 +1,91 @@
+"""Benchmark of the reminder timing wheel: startup from the reminder table and the cost of a tick.
+
+    python scripts/bench_timing_wheel.py [number of reminders ...]   (100000 and 1000000 by default)
+
+The reminder table is built in a temporary SQLite file, a third of the reminders are at 07:00-09:00 sharp
+to get a few large buckets like in production.
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('TOKEN', '0:bench')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from app.mastermind.timing_wheel import MINUTES_PER_DAY, TimingWheel, get_minute_of_day  # noqa: E402
+
+QUERY = 'SELECT id, hours, minutes, user_id, is_phenomenon FROM reminder WHERE hours IS NOT NULL ' \
+        'AND minutes IS NOT NULL'
+
+
+def create_table(path, count):
+    rnd = random.Random(count)
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE reminder (id INTEGER PRIMARY KEY, is_phenomenon BOOLEAN, hours INTEGER, '
+                       'minutes INTEGER, job_id VARCHAR UNIQUE, user_id INTEGER NOT NULL)')
+    rows = []
+    for reminder_id in range(1, count + 1):
+        if rnd.random() < 1 / 3:
+            hours, minutes = rnd.choice((7, 8, 9)), 0
+        else:
+            hours, minutes = rnd.randrange(24), rnd.randrange(0, 60, 5)
+        rows.append((reminder_id, rnd.random() < 0.2, hours, minutes, reminder_id % (count // 2 + 1) + 1))
+    connection.executemany('INSERT INTO reminder (id, is_phenomenon, hours, minutes, user_id) '
+                           'VALUES (?, ?, ?, ?, ?)', rows)
+    connection.commit()
+    connection.close()
+
+
+def load(path):
+    connection = sqlite3.connect(path)
+    rows = connection.execute(QUERY).fetchall()
+    connection.close()
+    wheel = TimingWheel()
+    wheel.begin_load()
+    wheel.load((reminder_id, get_minute_of_day(hours, minutes), (user_id, bool(is_phenomenon)))
+               for reminder_id, hours, minutes, user_id, is_phenomenon in rows)
+    return wheel
+
+
+def bench(count):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'reminders.db')
+        create_table(path, count)
+        start = time.perf_counter()
+        wheel = load(path)
+        startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sizes = [len(wheel.get_due(minute)) for minute in range(MINUTES_PER_DAY)]
+    tick = (time.perf_counter() - start) / MINUTES_PER_DAY
+
+    hot_minute = max(range(MINUTES_PER_DAY), key=sizes.__getitem__)
+    start = time.perf_counter()
+    wheel.get_due(hot_minute)
+    hot_tick = time.perf_counter() - start
+
+    keys = random.Random(0).sample(range(1, count + 1), 10000)
+    start = time.perf_counter()
+    for key in keys:
+        wheel.remove(key)
+        wheel.add(key, 8 * 60, (key, False))
+    update = (time.perf_counter() - start) / len(keys)
+
+    print(f'{count} reminders: startup {startup:.2f} s, tick {tick * 1e6:.0f} us on average '
+          f'({count // MINUTES_PER_DAY} reminders), largest tick {hot_tick * 1e3:.1f} ms ({sizes[hot_minute]} '
+          f'reminders), remove + add {update * 1e6:.1f} us')
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]
+    for count in counts:
+        bench(count)
+
+
+if __name__ == '__main__':
+    main()
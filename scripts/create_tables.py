@@ -0,0 +1,26 @@
+"""Creates the tables of the bot missing from the database, existing tables are left as they are.
+
+    python scripts/create_tables.py
+
+Run it with the DATABASE_URL of the bot before starting a version that adds tables (the release phase
+of the Procfile runs it on every Heroku deploy).
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import db  # noqa: E402
+from app import models  # noqa: E402,F401 the tables are those of the models
+
+
+def main():
+    existing = set(db.engine.table_names())
+    db.create_all()
+    created = sorted(set(db.engine.table_names()) - existing)
+    print(f'Created tables: {", ".join(created)}' if created else 'Every table exists')
+
+
+if __name__ == '__main__':
+    main()
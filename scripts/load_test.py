@@ -0,0 +1,198 @@
+"""Load generator for the bot webhook.
+
+Starts the Telegram and weather stand-ins (scripts/stubs.py), posts synthetic updates to the webhook at a fixed
+rate and reports throughput and reply latency per handler. The latency of an update is the time from posting it
+to the first Bot API call the bot makes for that chat. Start the bot against the stand-ins first:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} WEATHER_URL=http://127.0.0.1:8082/{} gunicorn run:run_app
+    python scripts/load_test.py --webhook http://127.0.0.1:8000/<TOKEN> --rate 50 --duration 60
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from stubs import TelegramStub, WeatherStub
+
+FIRST_CHAT_ID = 10 ** 9
+
+# scenario -> (weight, kind, text or callback data)
+SCENARIOS = {
+    'weather now': (30, 'message', '🧙🏻‍♀ Weather now'),
+    'for tomorrow': (15, 'message', '🧙🏼 For tomorrow'),
+    'for a week': (15, 'message', '🧙🏿‍♂ For a week'),
+    'city text': (15, 'message', 'Moscow'),
+    'info': (5, 'message', '👨🏻‍🔬 Info'),
+    'settings': (5, 'message', '🔮 Settings'),
+    'callback hours': (10, 'callback', '08hr'),
+    'callback phenomenon': (5, 'callback', 'phenomenon rain'),
+}
+
+
+def build_update(update_id, chat_id, kind, payload):
+    user = {'id': chat_id, 'is_bot': False, 'first_name': f'load{chat_id}', 'language_code': 'en'}
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+               'from': user, 'text': payload}
+    if kind == 'message':
+        return {'update_id': update_id, 'message': message}
+    return {'update_id': update_id, 'callback_query': {
+        'id': f'{chat_id}:{update_id}', 'from': user, 'message': message, 'chat_instance': str(chat_id),
+        'data': payload}}
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+
+class LoadTest:
+    def __init__(self, webhook, chats, timeout, concurrency):
+        self.webhook = webhook
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.update_ids = itertools.count(1)
+        self.free_chats = deque(range(FIRST_CHAT_ID, FIRST_CHAT_ID + chats))
+        self.pending = {}  # chat id -> (scenario, start time)
+        self.latencies = {}  # scenario -> [seconds]
+        self.post_latencies = []
+        self.errors = {}  # scenario -> count
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.drained = threading.Condition(self.lock)
+
+    def on_telegram_call(self, method, params):
+        """complete the pending update of the chat on the first Bot API call made for it"""
+        chat_id = params.get('chat_id') or str(params.get('callback_query_id', '')).split(':')[0]
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            pending = self.pending.pop(chat_id, None)
+            if pending is None:
+                return
+            scenario, start = pending
+            self.latencies.setdefault(scenario, []).append(now - start)
+            self.free_chats.append(chat_id)
+            self.drained.notify_all()
+
+    def send(self, chat_id, scenario):
+        _, kind, payload = SCENARIOS[scenario]
+        update = build_update(next(self.update_ids), chat_id, kind, payload)
+        start = time.perf_counter()
+        with self.lock:
+            self.pending[chat_id] = (scenario, start)
+        try:
+            response = self.session.post(self.webhook, data=json.dumps(update), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            with self.lock:
+                self.errors[scenario] = self.errors.get(scenario, 0) + 1
+                if self.pending.pop(chat_id, None) is not None:
+                    self.free_chats.append(chat_id)
+            return
+        with self.lock:
+            self.post_latencies.append(time.perf_counter() - start)
+
+    def warm_up(self):
+        """every chat sends its city first, so the users exist and have a city"""
+        with self.lock:
+            chats = list(self.free_chats)
+            self.free_chats.clear()
+        for chat_id in chats:
+            self.executor.submit(self.send, chat_id, 'city text')
+        self.wait_pending()
+        with self.lock:
+            self.latencies.clear()
+            self.post_latencies.clear()
+            self.errors.clear()
+
+    def run(self, rate, duration):
+        names = list(SCENARIOS)
+        weights = [SCENARIOS[name][0] for name in names]
+        start = time.perf_counter()
+        next_time = start
+        while next_time - start < duration:
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            next_time += 1 / rate
+            with self.lock:
+                chat_id = self.free_chats.popleft() if self.free_chats else None
+            if chat_id is None:  # every chat waits for a reply, the bot is saturated
+                self.dropped += 1
+                continue
+            self.executor.submit(self.send, chat_id, random.choices(names, weights)[0])
+        timed_out = self.wait_pending()
+        return time.perf_counter() - start, timed_out
+
+    def wait_pending(self):
+        """wait for the replies, return updates left without a reply after the timeout"""
+        deadline = time.perf_counter() + self.timeout
+        with self.lock:
+            while self.pending and time.perf_counter() < deadline:
+                self.drained.wait(timeout=max(deadline - time.perf_counter(), 0))
+            timed_out = {}
+            for chat_id, (scenario, _) in self.pending.items():
+                timed_out[scenario] = timed_out.get(scenario, 0) + 1
+                self.free_chats.append(chat_id)
+            self.pending.clear()
+        return timed_out
+
+    def report(self, elapsed, timed_out):
+        print(f'{"handler":<22}{"done":>8}{"rps":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}{"timeouts":>9}')
+        rows = sorted(self.latencies.items()) + [('all', [x for v in self.latencies.values() for x in v])]
+        for scenario, values in rows:
+            values = sorted(values)
+            if scenario == 'all':
+                errors, timeouts = sum(self.errors.values()), sum(timed_out.values())
+            else:
+                errors, timeouts = self.errors.get(scenario, 0), timed_out.get(scenario, 0)
+            print(f'{scenario:<22}{len(values):>8}{len(values) / elapsed:>8.1f}'
+                  f'{percentile(values, .5) * 1000:>9.1f}{percentile(values, .95) * 1000:>9.1f}'
+                  f'{percentile(values, .99) * 1000:>9.1f}{errors:>8}{timeouts:>9}')
+        post = sorted(self.post_latencies)
+        print(f'\nwebhook POST: p50 {percentile(post, .5) * 1000:.1f} ms, p99 {percentile(post, .99) * 1000:.1f} ms; '
+              f'updates not sent because every chat was waiting: {self.dropped}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Post synthetic Telegram updates to the bot webhook')
+    parser.add_argument('--webhook', required=True, help='http://host:port/<TOKEN>')
+    parser.add_argument('--rate', type=float, default=20, help='updates per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--chats', type=int, default=500, help='simulated users')
+    parser.add_argument('--concurrency', type=int, default=64, help='webhook requests in flight')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a reply')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--weather-port', type=int, default=8082)
+    parser.add_argument('--weather-latency', type=float, default=0.0)
+    parser.add_argument('--weather-jitter', type=float, default=0.0)
+    parser.add_argument('--weather-error-rate', type=float, default=0.0, help='share of pages failing with 503')
+    parser.add_argument('--no-warm-up', action='store_true', help='the chats already exist and have a city')
+    args = parser.parse_args()
+
+    load_test = LoadTest(args.webhook, args.chats, args.timeout, args.concurrency)
+    TelegramStub((args.host, args.telegram_port), on_call=load_test.on_telegram_call).start()
+    WeatherStub((args.host, args.weather_port), args.weather_latency, args.weather_jitter,
+               error_rate=args.weather_error_rate).start()
+
+    if not args.no_warm_up:
+        load_test.warm_up()
+    elapsed, timed_out = load_test.run(args.rate, args.duration)
+    load_test.report(elapsed, timed_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Replay updates captured with CAPTURE_UPDATES_PATH against the bot running on the local stand-ins.
+
+Updates are posted with their original spacing divided by --speed ('max' posts them as fast as --concurrency
+allows). Throughput and reply latency are reported per handler, like scripts/load_test.py does:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} WEATHER_URL=http://127.0.0.1:8082/{} gunicorn run:run_app
+    python scripts/replay.py capture.jsonl --webhook http://127.0.0.1:8000/<TOKEN> --speed 10
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from load_test import build_update, percentile
+from stubs import TelegramStub, WeatherStub
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_button_names():
+    """read the button names without importing the app package (which connects to the database)"""
+    path = os.path.join(BASE_DIR, 'app', 'data', 'localization.py')
+    spec = importlib.util.spec_from_file_location('localization', path)
+    localization = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(localization)
+    return {name: key for key, names in localization.button_names.items() for name in names.values()}
+
+
+BUTTONS = load_button_names()
+
+
+def classify(update):
+    """return the name of the handler the update goes to"""
+    if 'callback_query' in update:
+        data = re.sub(r'[\d:]', '', update['callback_query'].get('data', '')).split()
+        return f'callback {data[0] if data else ""}'.strip()
+    message = update.get('message') or update.get('edited_message') or {}
+    if 'sticker' in message:
+        return 'sticker'
+    text = message.get('text', '')
+    if text.startswith('/'):
+        return text.split()[0]
+    return BUTTONS.get(text, 'city text')
+
+
+def get_chat_id(update):
+    if 'callback_query' in update:
+        return update['callback_query']['from']['id']
+    message = update.get('message') or update.get('edited_message') or {}
+    return message.get('chat', {}).get('id')
+
+
+def read_capture(path):
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+class Replay:
+    def __init__(self, webhook, concurrency, timeout):
+        self.webhook = webhook
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.pending = {}  # chat id -> deque of (handler, start time)
+        self.pending_count = 0
+        self.latencies = {}  # handler -> [seconds]
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.drained = threading.Condition(self.lock)
+
+    def on_telegram_call(self, method, params):
+        chat_id = params.get('chat_id') or str(params.get('callback_query_id', '')).split(':')[0]
+        try:
+            chat_id = int(chat_id)
+        except ValueError:
+            return
+        now = time.perf_counter()
+        with self.lock:
+            queue = self.pending.get(chat_id)
+            if not queue:
+                return
+            handler, start = queue.popleft()
+            self.latencies.setdefault(handler, []).append(now - start)
+            self.pending_count -= 1
+            self.drained.notify_all()
+
+    def send(self, update, handler):
+        chat_id = get_chat_id(update)
+        with self.lock:
+            self.pending.setdefault(chat_id, deque()).append((handler, time.perf_counter()))
+            self.pending_count += 1
+        try:
+            self.session.post(self.webhook, data=json.dumps(update), timeout=self.timeout).raise_for_status()
+        except requests.RequestException:
+            with self.lock:
+                self.errors[handler] = self.errors.get(handler, 0) + 1
+                self.pending[chat_id].pop()
+                self.pending_count -= 1
+
+    def wait_pending(self):
+        deadline = time.perf_counter() + self.timeout
+        with self.lock:
+            while self.pending_count and time.perf_counter() < deadline:
+                self.drained.wait(timeout=max(deadline - time.perf_counter(), 0))
+            timed_out = {}
+            for queue in self.pending.values():
+                for handler, _ in queue:
+                    timed_out[handler] = timed_out.get(handler, 0) + 1
+            self.pending.clear()
+            self.pending_count = 0
+        return timed_out
+
+    def warm_up(self, records):
+        """send a city from every captured chat so that the users exist in the local database"""
+        chats = {get_chat_id(record['update']) for record in records} - {None}
+        for idx, chat_id in enumerate(chats):
+            self.executor.submit(self.send, build_update(idx + 1, chat_id, 'message', 'Moscow'), 'warm up')
+        self.wait_pending()
+        self.latencies.clear()
+        self.errors.clear()
+
+    def run(self, records, speed):
+        start = time.perf_counter()
+        first_ts = records[0]['ts'] if records else 0
+        for record in records:
+            if speed:
+                delay = start + (record['ts'] - first_ts) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.executor.submit(self.send, record['update'], classify(record['update']))
+        timed_out = self.wait_pending()
+        return time.perf_counter() - start, timed_out
+
+    def report(self, elapsed, timed_out):
+        print(f'{"handler":<22}{"done":>8}{"rps":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"errors":>8}{"timeouts":>9}')
+        handlers = sorted(set(self.latencies) | set(self.errors) | set(timed_out))
+        for handler in handlers + ['all']:
+            if handler == 'all':
+                values = [x for v in self.latencies.values() for x in v]
+                errors, timeouts = sum(self.errors.values()), sum(timed_out.values())
+            else:
+                values = self.latencies.get(handler, [])
+                errors, timeouts = self.errors.get(handler, 0), timed_out.get(handler, 0)
+            values = sorted(values)
+            print(f'{handler:<22}{len(values):>8}{len(values) / elapsed:>8.1f}'
+                  f'{percentile(values, .5) * 1000:>9.1f}{percentile(values, .95) * 1000:>9.1f}'
+                  f'{percentile(values, .99) * 1000:>9.1f}{errors:>8}{timeouts:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured Telegram updates against the bot webhook')
+    parser.add_argument('capture', help='JSONL file written with CAPTURE_UPDATES_PATH')
+    parser.add_argument('--webhook', required=True, help='http://host:port/<TOKEN>')
+    parser.add_argument('--speed', default='1', help="1, 10, ... times the captured pace or 'max'")
+    parser.add_argument('--concurrency', type=int, default=64, help='webhook requests in flight')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the replies')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--weather-port', type=int, default=8082)
+    parser.add_argument('--weather-latency', type=float, default=0.0)
+    parser.add_argument('--weather-jitter', type=float, default=0.0)
+    parser.add_argument('--weather-error-rate', type=float, default=0.0, help='share of pages failing with 503')
+    parser.add_argument('--no-warm-up', action='store_true', help='the captured users already exist')
+    args = parser.parse_args()
+    speed = None if args.speed == 'max' else float(args.speed)
+
+    records = read_capture(args.capture)
+    replay = Replay(args.webhook, args.concurrency, args.timeout)
+    TelegramStub((args.host, args.telegram_port), on_call=replay.on_telegram_call).start()
+    WeatherStub((args.host, args.weather_port), args.weather_latency, args.weather_jitter,
+               error_rate=args.weather_error_rate).start()
+
+    if not args.no_warm_up:
+        replay.warm_up(records)
+    elapsed, timed_out = replay.run(records, speed)
+    print(f'{len(records)} updates replayed in {elapsed:.1f} s')
+    replay.report(elapsed, timed_out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Shows the shards of the bot instances and moves shards between them.
+
+    python scripts/shards.py show
+    python scripts/shards.py move 0-15,32 --to bot-2 --url https://bot-2.herokuapp.com
+    python scripts/shards.py balance bot-1=https://bot-1.herokuapp.com bot-2=https://bot-2.herokuapp.com
+
+Run it with the DATABASE_URL and SHARD_COUNT of the instances. After a move the instances losing and getting
+shards are asked to reload the shard table (POST /admin/shards with ADMIN_TOKEN), the others and the router
+see it within SHARD_MAP_TTL seconds.
+"""
+import argparse
+import os
+import sys
+from collections import Counter
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from app import db  # noqa: E402
+from app.credentials import ADMIN_TOKEN, SHARD_COUNT  # noqa: E402
+from app.models import Shard, User  # noqa: E402
+from app.sharding import get_shard  # noqa: E402
+
+
+def parse_shards(text, shard_count):
+    """'0-3,8' -> [0, 1, 2, 3, 8]"""
+    shards = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        shards.extend(range(int(first), int(last or first) + 1))
+    for shard in shards:
+        if not 0 <= shard < shard_count:
+            raise SystemExit(f'Shard {shard} is not in 0-{shard_count - 1}')
+    return sorted(set(shards))
+
+
+def format_shards(shards):
+    """[0, 1, 2, 3, 8] -> '0-3,8'"""
+    ranges = []
+    for shard in sorted(shards):
+        if ranges and ranges[-1][1] == shard - 1:
+            ranges[-1][1] = shard
+        else:
+            ranges.append([shard, shard])
+    return ','.join(f'{first}-{last}' if first != last else f'{first}' for first, last in ranges)
+
+
+def count_users(shard_count):
+    return Counter(get_shard(chat_id, shard_count) for chat_id, in db.session.query(User.chat_id))
+
+
+def show(shard_count):
+    users = count_users(shard_count)
+    owners = {shard.id: shard for shard in Shard.query.all()}
+    instances = {}
+    for shard in range(shard_count):
+        owner = owners.get(shard)
+        key = (owner.instance, owner.url) if owner else ('unassigned', '')
+        instances.setdefault(key, []).append(shard)
+    for (instance, url), shards in sorted(instances.items()):
+        print(f'{instance} {url}: {len(shards)} shards ({format_shards(shards)}), '
+              f'{sum(users[shard] for shard in shards)} users')
+    stray = sorted(shard for shard in owners if shard >= shard_count)
+    if stray:
+        print(f'Shards beyond SHARD_COUNT: {format_shards(stray)}')
+
+
+def notify(urls, admin_token):
+    for url in urls:
+        try:
+            response = requests.post(f'{url}/admin/shards', headers={'X-Admin-Token': admin_token}, timeout=30)
+            print(f'{url}: {response.status_code} {response.text.strip()}')
+        except requests.RequestException as e:
+            print(f'{url} has not reloaded its shards, it will within SHARD_MAP_TTL: {e!r}')
+
+
+def move(shards, instance, url, admin_token, dry_run=False):
+    """assign the shards to the instance, return the urls of the instances that have lost some of them"""
+    owners = {shard.id: shard for shard in Shard.query.filter(Shard.id.in_(shards))}
+    previous_urls = set()
+    for shard in shards:
+        owner = owners.get(shard)
+        if owner is None:
+            db.session.add(Shard(id=shard, instance=instance, url=url))
+        elif (owner.instance, owner.url) != (instance, url):
+            previous_urls.add(owner.url)
+            owner.instance, owner.url = instance, url
+    print(f'{format_shards(shards)} -> {instance}' + (' (dry run)' if dry_run else ''))
+    if dry_run:
+        db.session.rollback()
+        return
+    db.session.commit()
+    if admin_token:
+        notify(sorted(previous_urls - {url}) + [url], admin_token)  # the old owners stop before the new one starts
+
+
+def balance(instances, shard_count, admin_token, dry_run=False):
+    """spread the shards evenly over the instances, moving as few of them (and of their users) as possible"""
+    users = count_users(shard_count)
+    owners = {shard.id: shard.instance for shard in Shard.query.all()}
+    names = [name for name, _ in instances]
+    quotas = {name: shard_count // len(names) + (idx < shard_count % len(names)) for idx, name in enumerate(names)}
+
+    kept = {name: [] for name in names}
+    free = []
+    for shard in sorted(range(shard_count), key=lambda shard: -users[shard]):  # the largest shards stay
+        owner = owners.get(shard)
+        if owner in kept and len(kept[owner]) < quotas[owner]:
+            kept[owner].append(shard)
+        else:
+            free.append(shard)
+
+    for name, url in instances:
+        count = quotas[name] - len(kept[name])
+        moved, free = free[:count], free[count:]
+        if moved:
+            move(sorted(moved), name, url, admin_token, dry_run)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show and move the shards of the bot instances')
+    parser.add_argument('--shard-count', type=int, default=SHARD_COUNT, help='SHARD_COUNT of the instances')
+    parser.add_argument('--admin-token', default=ADMIN_TOKEN, help='ADMIN_TOKEN of the instances to notify them')
+    parser.add_argument('--dry-run', action='store_true', help='print the moves without saving them')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('show', help='shards and users of every instance')
+    move_parser = commands.add_parser('move', help='assign shards to an instance')
+    move_parser.add_argument('shards', help="shards like '0-15,32'")
+    move_parser.add_argument('--to', required=True, help='INSTANCE_NAME of the instance')
+    move_parser.add_argument('--url', required=True, help='base url of the instance')
+    balance_parser = commands.add_parser('balance', help='spread the shards evenly over the instances')
+    balance_parser.add_argument('instances', nargs='+', help='INSTANCE_NAME=url of every instance')
+    args = parser.parse_args()
+
+    if not args.shard_count:
+        raise SystemExit('Set SHARD_COUNT or --shard-count')
+    if args.command == 'show':
+        show(args.shard_count)
+    elif args.command == 'move':
+        move(parse_shards(args.shards, args.shard_count), args.to, args.url.rstrip('/'), args.admin_token,
+             args.dry_run)
+    else:
+        instances = [instance.split('=', 1) for instance in args.instances]
+        balance([(name, url.rstrip('/')) for name, url in instances], args.shard_count, args.admin_token,
+                args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""Local stand-ins for the Telegram Bot API, the weather website and a Redis server.
+
+Run the bot against them with
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot{0}/{1} WEATHER_URL=http://127.0.0.1:8082/{} \
+    CACHE_URL=redis://127.0.0.1:8083/0 python run.py
+
+    python scripts/stubs.py [--telegram-port 8081] [--weather-port 8082] [--weather-latency 0.2] [--redis-port 8083]
+"""
+import argparse
+import fnmatch
+import hashlib
+import itertools
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        thread.start()
+        return thread
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self._handle(dict(parse_qsl(urlsplit(self.path).query)))
+
+    def do_POST(self):
+        params = dict(parse_qsl(urlsplit(self.path).query))  # telebot sends parameters in the query string
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8', errors='replace')
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params.update(json.loads(body or '{}'))
+        elif self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qsl(body))
+        self._handle(params)
+
+    def _handle(self, params):
+        method = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        self.server.record(method, params)
+        if method.startswith('send') and int(params.get('chat_id', 0)) in self.server.blocked_chats:
+            data = json.dumps({'ok': False, 'error_code': 403,
+                               'description': 'Forbidden: bot was blocked by the user'}).encode('utf-8')
+            self.send_response(403)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if method.startswith('send') or method.startswith('edit'):
+            result = {
+                'message_id': next(self.server.message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        data = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TelegramStub(StubServer):
+    """answers every Bot API method with success and records the calls, messages to `blocked_chats` fail with 403.
+    `on_call(method, params)` is called for every request
+    """
+
+    def __init__(self, address, on_call=None, blocked_chats=()):
+        super().__init__(address, TelegramStubHandler)
+        self.on_call = on_call
+        self.blocked_chats = set(blocked_chats)
+        self.calls = {}  # method -> count
+        self.message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def record(self, method, params):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.on_call is not None:
+            self.on_call(method, params)
+
+
+class WeatherStubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if '/pogoda/' not in path:
+            self.send_error(404)
+            return
+        page = 'details.html' if path.rstrip('/').endswith('/details') else 'pogoda.html'
+        latency = self.server.latency + random.uniform(0, self.server.jitter)
+        if latency:
+            time.sleep(latency)
+        if random.random() < self.server.error_rate:
+            self.send_error(503)
+            return
+        data = self.server.pages[page]
+        etag = self.server.etags[page]
+        if self.server.validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.server.validators:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        with self.server.lock:
+            self.server.requests += 1
+
+    def log_message(self, *args):
+        pass
+
+
+class WeatherStub(StubServer):
+    """serves the fixture pages for any city after `latency` + random(0, `jitter`) seconds,
+    a share of `error_rate` requests fails with 503 to simulate an outage.
+    With `validators` the pages have an ETag and conditional requests are answered 304 Not Modified
+    """
+
+    def __init__(self, address, latency=0.0, jitter=0.0, fixtures_dir=FIXTURES_DIR, error_rate=0.0, validators=False):
+        super().__init__(address, WeatherStubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.validators = validators
+        self.pages = {}
+        self.etags = {}
+        for page in ('pogoda.html', 'details.html'):
+            with open(os.path.join(fixtures_dir, page), 'rb') as f:
+                self.pages[page] = f.read()
+            self.etags[page] = f'"{hashlib.md5(self.pages[page]).hexdigest()}"'
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class RedisStubHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b'*'):
+                self.wfile.write(b'-ERR inline commands are not supported\r\n')
+                return
+            command = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                command.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(self.server.execute(command))
+
+
+class RedisStub(socketserver.ThreadingTCPServer):
+    """answers the commands of the cache (GET, MGET, SET with PX, DEL, SCAN, SELECT, PING) of the Redis protocol
+    from a dict, every database is the same one
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RedisStubHandler)
+        self.items = {}  # key -> (value, expiry time or None)
+        self.commands = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name=type(self).__name__, daemon=True)
+        thread.start()
+        return thread
+
+    def execute(self, command):
+        name, args = command[0].upper().decode(), command[1:]
+        with self.lock:
+            self.commands += 1
+            if name == 'GET':
+                return self._encode(self._get(args[0]))
+            if name == 'MGET':
+                return self._encode([self._get(key) for key in args])
+            if name == 'SET':
+                expiry = time.time() + int(args[3]) / 1000 if len(args) > 3 and args[2].upper() == b'PX' else None
+                self.items[args[0]] = (args[1], expiry)
+                return b'+OK\r\n'
+            if name == 'DEL':
+                return self._encode(sum(self.items.pop(key, None) is not None for key in args))
+            if name == 'SCAN':
+                pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+                keys = [key for key in list(self.items) if self._get(key) is not None
+                        and fnmatch.fnmatchcase(key.decode(), pattern)]
+                return self._encode([b'0', keys])
+            if name == 'SELECT':
+                return b'+OK\r\n'
+            if name == 'PING':
+                return b'+PONG\r\n'
+        return f'-ERR unknown command {name}\r\n'.encode()
+
+    def _get(self, key):
+        value, expiry = self.items.get(key, (None, None))
+        if expiry is not None and expiry <= time.time():
+            del self.items[key]
+            return None
+        return value
+
+    def _encode(self, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(map(self._encode, value))
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Telegram Bot API and weather website stand-ins')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--telegram-port', type=int, default=8081)
+    parser.add_argument('--weather-port', type=int, default=8082)
+    parser.add_argument('--weather-latency', type=float, default=0.0, help='seconds added to every page')
+    parser.add_argument('--weather-jitter', type=float, default=0.0, help='random extra seconds, up to')
+    parser.add_argument('--weather-error-rate', type=float, default=0.0, help='share of pages failing with 503')
+    parser.add_argument('--weather-etag', action='store_true', help='answer conditional requests with 304')
+    parser.add_argument('--redis-port', type=int, default=8083)
+    args = parser.parse_args()
+
+    telegram = TelegramStub((args.host, args.telegram_port))
+    weather = WeatherStub((args.host, args.weather_port), args.weather_latency, args.weather_jitter,
+                          error_rate=args.weather_error_rate, validators=args.weather_etag)
+    redis = RedisStub((args.host, args.redis_port))
+    telegram.start()
+    weather.start()
+    redis.start()
+    print(f'Telegram Bot API stub: http://{args.host}:{args.telegram_port}/bot{{0}}/{{1}}')
+    print(f'Weather stub: http://{args.host}:{args.weather_port}/{{}}')
+    print(f'Redis stub: redis://{args.host}:{args.redis_port}/0')
+    try:
+        while True:
+            time.sleep(10)
+            print(f'telegram calls: {telegram.calls}, weather pages: {weather.requests}, '
+                  f'redis commands: {redis.commands}')
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()